@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Gemini branch of the chat pipeline, run offline.
+Drives generate_response, generate_response_async and stream_response_async
+against the local fake LLM provider and a throwaway SQLite database, and
+reports throughput and latency at several concurrency levels, then shows
+how a per-call deadline and hedged requests reshape the latency histogram
+when a few LLM calls are very slow.
+"""
+
+import sys
+import os
+import asyncio
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+from chatbot import generate_response, generate_response_async, stream_response_async
+from database import create_async_database_engine
+from llm_providers import FakeProvider
+from llm_resilience import CircuitBreaker, LatencyHistogram, LLMCallPolicy
+from models import Base, User
+
+USERNAME = "benchmark_user"
+# Starlette's default threadpool size, which bounded the old sync /chat
+THREADPOOL_SIZE = 40
+
+
+def message(index):
+    """A message that none of the rule-based routes answer, so it reaches the LLM"""
+    return f"Tell me a tale, part {index}"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(label, latencies, elapsed):
+    print(f"{label:<34} {len(latencies) / elapsed:8.1f} msg/s   "
+          f"p50 {statistics.median(latencies) * 1000:7.0f} ms   "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.0f} ms")
+
+
+def print_histogram(label, latencies):
+    """Chat latencies bucketed the same way as the LLM call histogram"""
+    histogram = LatencyHistogram()
+    for latency in latencies:
+        histogram.record(latency)
+    snapshot = histogram.snapshot()
+    print(f"{label}: p50 {snapshot['p50'] * 1000:.0f} ms, p95 {snapshot['p95'] * 1000:.0f} ms, "
+          f"p99 {snapshot['p99'] * 1000:.0f} ms")
+    for bucket, count in snapshot["buckets"].items():
+        if count:
+            print(f"    {bucket:>8} {count:5d} {'#' * max(1, count * 50 // len(latencies))}")
+
+
+def run_sync(total):
+    """Old /chat: sync generate_response on a fixed-size threadpool"""
+    def one(index):
+        db = chatbot.SessionLocal()
+        started = time.perf_counter()
+        try:
+            generate_response(USERNAME, message(index), db)
+        finally:
+            db.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as pool:
+        latencies = list(pool.map(one, range(total)))
+    return latencies, time.perf_counter() - started
+
+
+async def run_async(total, concurrency):
+    """generate_response_async with up to concurrency chats in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            started = time.perf_counter()
+            await generate_response_async(USERNAME, message(index))
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[one(index) for index in range(total)])
+    return latencies, time.perf_counter() - started
+
+
+async def run_policies(total, concurrency, deadline):
+    """The same slow-tailed traffic with no deadline, a deadline, and a deadline plus hedging"""
+    policies = [
+        ("no deadline", LLMCallPolicy()),
+        (f"deadline {deadline:g}s", LLMCallPolicy(deadline=deadline)),
+        (f"deadline {deadline:g}s + hedge at p95", LLMCallPolicy(deadline=deadline, hedge_after="p95")),
+    ]
+    for label, policy in policies:
+        chatbot.LLM_CALL_POLICY = policy
+        # A fresh breaker, so timeouts under one policy do not open the circuit for the next
+        chatbot.LLM_BREAKER = CircuitBreaker(minimum_calls=total + 1)
+        latencies, elapsed = await run_async(total, concurrency)
+        print()
+        report(label, latencies, elapsed)
+        print(f"    LLM calls {policy.calls}, timeouts {policy.timeouts}, "
+              f"hedges {policy.hedges} ({policy.hedge_wins} won)")
+        print_histogram("    chat latency", latencies)
+
+
+async def run_stream(total, concurrency):
+    """stream_response_async: time to first chunk and to the full reply"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            started = time.perf_counter()
+            first = None
+            async for _ in stream_response_async(USERNAME, message(index)):
+                if first is None:
+                    first = time.perf_counter() - started
+            return first, time.perf_counter() - started
+
+    started = time.perf_counter()
+    timings = await asyncio.gather(*[one(index) for index in range(total)])
+    elapsed = time.perf_counter() - started
+    return [first for first, _ in timings], [full for _, full in timings], elapsed
+
+
+def run_in_loop(async_engine, coroutine):
+    """asyncio.run(coroutine), closing the async engine's pooled connections before the loop ends"""
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+
+def main():
+    latency = float(os.getenv('FAKE_LLM_LATENCY', '0.8'))
+    provider = FakeProvider(latency=latency, jitter=latency / 4, chunk_delay=0.02,
+                            error_rate=float(os.getenv('FAKE_LLM_ERROR_RATE', '0')), seed=42)
+    chatbot.llm_provider = provider
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}",
+                               connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        chatbot.SessionLocal = sessionmaker(bind=engine)
+        async_engine = create_async_database_engine(engine.url)
+        chatbot.AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+        db = chatbot.SessionLocal()
+        db.add(User(username=USERNAME, password="benchmark"))
+        db.commit()
+        db.close()
+
+        print("LLM branch benchmark (fake provider)")
+        print("-" * 80)
+        print(f"Provider latency: {latency * 1000:.0f} ms +/- {latency / 4 * 1000:.0f} ms, "
+              f"error rate {provider.error_rate:.0%}")
+
+        total = 200
+        latencies, elapsed = run_sync(total)
+        report(f"sync, {THREADPOOL_SIZE}-thread pool", latencies, elapsed)
+        for concurrency in (1, 10, 50, 200):
+            count = total if concurrency > 1 else 10
+            latencies, elapsed = run_in_loop(async_engine, run_async(count, concurrency))
+            report(f"async, {concurrency} concurrent", latencies, elapsed)
+
+        first, full, elapsed = run_in_loop(async_engine, run_stream(total, 50))
+        report("stream, 50 concurrent (full reply)", full, elapsed)
+        print(f"{'stream, time to first chunk':<34} {'':8}           "
+              f"p50 {statistics.median(first) * 1000:7.0f} ms   p95 {percentile(first, 0.95) * 1000:7.0f} ms")
+
+        # 4% of calls take ten times longer: the tail a deadline and hedging are for
+        chatbot.llm_provider = FakeProvider(latency=latency, jitter=latency / 4, chunk_delay=0,
+                                            slow_rate=0.04, slow_latency=latency * 10, seed=7)
+        print()
+        print(f"Deadline and hedging: {latency * 1000:.0f} ms calls, 4% take {latency * 11 * 1000:.0f} ms, 10 concurrent")
+        print("-" * 80)
+        run_in_loop(async_engine, run_policies(total, 10, latency * 3))
+        # Write the exchanges still queued before the database goes away
+        chatbot.CHAT_WRITER.stop()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
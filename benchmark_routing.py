@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark for chat message routing.
+Compares the per-message cost of the old per-list substring scans with the
+single word-boundary automaton pass used by generate_response.
+"""
+
+import sys
+import os
+import difflib
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chatbot import (
+    ALL_CRISIS_WORDS, GREETING_WORDS, ROUTINE_WORDS, BREATHING_WORDS, MINDFUL_WORDS,
+    PROFESSOR_KEYWORDS, PREVENTION_WORDS, INTENT_RESPONSES, ACADEMIC_STRESS_WORDS,
+    WORK_LIFE_WORDS, PROFESSIONAL_WORDS, DOCTOR_WORDS, ROUTING_AUTOMATON,
+    find_matching_intents,
+)
+import chatbot
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "I feel a bit off today and I don't really know why",
+    "How to prevent stress when I have too many deadlines at work?",
+    "I'm a professor and grading is taking over my weekends",
+    "Can you tell me about your day?",
+    "I have a headache and my neck feels stiff after sitting at the desk all day",
+    "Random question about the weather this weekend",
+    "I made dinner for my family and it went well",
+]
+
+
+def legacy_route(text):
+    """The substring scans generate_response ran before the automaton, in order"""
+    text_l = text.lower()
+    categories = []
+    for name, words in (("crisis", ALL_CRISIS_WORDS), ("greeting", GREETING_WORDS),
+                        ("routine", ROUTINE_WORDS), ("breathing", BREATHING_WORDS),
+                        ("mindful", MINDFUL_WORDS), ("professor", PROFESSOR_KEYWORDS),
+                        ("prevention", PREVENTION_WORDS)):
+        if any(word in text_l for word in words):
+            categories.append(name)
+    for intent in INTENT_RESPONSES:
+        if intent in text_l:
+            categories.append("intent:" + intent)
+            break
+    for name, words in (("academic_stress", ACADEMIC_STRESS_WORDS), ("work_life", WORK_LIFE_WORDS),
+                        ("professional", PROFESSIONAL_WORDS), ("doctor", DOCTOR_WORDS)):
+        if any(word in text_l for word in words):
+            categories.append(name)
+    return categories
+
+
+def automaton_route(text):
+    """One pass over the message with the compiled routing automaton"""
+    return ROUTING_AUTOMATON.find(text)
+
+
+def legacy_fuzzy_intents(text, intents, threshold=0.8):
+    """find_matching_intents as it was: difflib against every (word, intent) pair"""
+    matches = []
+    for word in text.split():
+        for intent in intents:
+            if difflib.SequenceMatcher(None, intent, word).ratio() >= threshold:
+                matches.append(intent)
+    return list(set(matches))
+
+
+def all_routing_terms():
+    """Every INTENT_RESPONSES key and *_WORDS keyword, for the fuzzy lookup benchmark"""
+    terms = list(INTENT_RESPONSES)
+    for name, value in vars(chatbot).items():
+        if name.endswith("_WORDS") and isinstance(value, list):
+            terms.extend(value)
+    return tuple(dict.fromkeys(terms))
+
+
+def benchmark(route, messages, repeat=5, number=2000):
+    """Best-of-repeat cost per message in microseconds"""
+    timer = timeit.Timer(lambda: [route(message) for message in messages])
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / (number * len(messages)) * 1e6
+
+
+def main():
+    random.seed(42)
+    messages = SAMPLE_MESSAGES + [" ".join(random.sample(SAMPLE_MESSAGES, 3)) for _ in range(8)]
+
+    print("Routing benchmark")
+    print("-" * 50)
+    print(f"Routing keywords compiled: {ROUTING_AUTOMATON.phrase_count}")
+    print(f"Messages per round: {len(messages)}")
+
+    legacy = benchmark(legacy_route, messages)
+    compiled = benchmark(automaton_route, messages)
+
+    print(f"Substring scans:      {legacy:8.2f} us/message")
+    print(f"Keyword automaton:    {compiled:8.2f} us/message")
+    print(f"Speedup:              {legacy / compiled:8.2f}x")
+
+    terms = all_routing_terms()
+    fuzzy_messages = SAMPLE_MESSAGES[:4]
+    print()
+    print("Fuzzy intent lookup")
+    print("-" * 50)
+    print(f"Terms indexed: {len(terms)}")
+    legacy = benchmark(lambda text: legacy_fuzzy_intents(text, terms), fuzzy_messages, repeat=3, number=2)
+    indexed = benchmark(lambda text: find_matching_intents(text, terms), fuzzy_messages, repeat=3, number=20)
+    print(f"difflib scan:         {legacy:8.0f} us/message")
+    print(f"Fuzzy index:          {indexed:8.0f} us/message")
+    print(f"Speedup:              {legacy / indexed:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the SQLite connection profile in database.py.
+Runs the same mixed load, with threads saving chat exchanges and moods while
+others read recent history, against a throwaway database opened with
+SQLite's defaults and with the tuned profile, and reports writes per second,
+read latency and "database is locked" errors for each.
+
+Usage: python benchmark_sqlite.py [seconds] [writers] [readers]
+"""
+
+import sys
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from chatbot import load_conversation_history
+from database import SQLITE_PRAGMAS, configure_sqlite
+from models import Base, ChatHistory, MoodLog, User
+
+USERS = 200
+SEED_EXCHANGES = 50000
+# SQLite's own defaults, which the app ran with before the profile; the
+# sqlite3 module's 5 second lock timeout applied all the same
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def seed(Session):
+    db = Session()
+    db.add_all([User(username=f"user{index}", password="benchmark") for index in range(USERS)])
+    db.commit()
+    started = datetime.utcnow() - timedelta(days=30)
+    db.bulk_insert_mappings(ChatHistory, [
+        {"user_id": index % USERS + 1, "user_message": f"message {index}",
+         "bot_response": "A friendly reply. " * 10, "timestamp": started + timedelta(seconds=index * 30)}
+        for index in range(SEED_EXCHANGES)
+    ])
+    db.commit()
+    db.close()
+
+
+def writer(Session, stop, counts, errors):
+    """Save an exchange, and every fifth time a mood, one transaction each, like /chat and /mood"""
+    rng = random.Random()
+    while not stop.is_set():
+        user_id = rng.randint(1, USERS)
+        db = Session()
+        try:
+            db.add(ChatHistory(user_id=user_id, user_message="How are you?", bot_response="A friendly reply.",
+                               timestamp=datetime.utcnow()))
+            db.commit()
+            counts.append(1)
+            if len(counts) % 5 == 0:
+                statement = sqlite.insert(MoodLog).values(user_id=user_id, mood="calm", log_date=date.today())
+                db.execute(statement.on_conflict_do_update(index_elements=["user_id", "log_date"],
+                                                           set_={"mood": "calm"}))
+                db.commit()
+                counts.append(1)
+        except OperationalError:
+            db.rollback()
+            errors.append(1)
+        finally:
+            db.close()
+
+
+def reader(Session, stop, latencies, errors):
+    """Load a user's recent history, as a chat does on a buffer miss"""
+    rng = random.Random()
+    while not stop.is_set():
+        db = Session()
+        started = time.perf_counter()
+        try:
+            load_conversation_history(db, rng.randint(1, USERS))
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors.append(1)
+        finally:
+            db.close()
+
+
+def run(label, pragmas, seconds, writers, readers):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = configure_sqlite(create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}",
+                                                connect_args={"check_same_thread": False},
+                                                pool_size=writers + readers), pragmas)
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        seed(Session)
+
+        stop = threading.Event()
+        writes, latencies, errors = [], [], []
+        threads = [threading.Thread(target=writer, args=(Session, stop, writes, errors)) for _ in range(writers)]
+        threads += [threading.Thread(target=reader, args=(Session, stop, latencies, errors)) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    print(f"{label:<22} {len(writes) / seconds:8.1f} writes/s   {len(latencies) / seconds:8.1f} reads/s   "
+          f"read p50 {statistics.median(latencies) * 1000:6.1f} ms   p95 {percentile(latencies, 0.95) * 1000:6.1f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:6.1f} ms   locked {len(errors)}")
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    print("SQLite profile benchmark")
+    print("-" * 80)
+    print(f"{writers} writer and {readers} reader threads for {seconds:g}s, "
+          f"{USERS} users, {SEED_EXCHANGES} exchanges seeded")
+    run("SQLite defaults", DEFAULT_PRAGMAS, seconds, writers, readers)
+    run("tuned profile", SQLITE_PRAGMAS, seconds, writers, readers)
+
+
+if __name__ == "__main__":
+    main()
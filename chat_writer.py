@@ -0,0 +1,143 @@
+"""
+Write-behind persistence for ChatHistory.
+Chats hand each exchange to a bounded queue and reply straight away; a
+background thread inserts queued exchanges in batches, one transaction per
+batch, once batch_size rows are waiting or flush_interval seconds after the
+first. When the queue is full submit() refuses the exchange and the caller
+writes it inline, so a slow disk slows requests down instead of growing the
+queue without bound. stop() writes everything still queued, for shutdown.
+"""
+
+import queue
+import threading
+import time
+
+from models import ChatHistory
+
+
+class ChatHistoryWriter:
+    """Background thread that batches ChatHistory inserts
+
+    Exchanges stay visible through pending() from submit() until their batch
+    is committed, so readers can merge them with what the database returns.
+    A max_queue of 0 turns the writer off and every exchange is written inline.
+    """
+
+    def __init__(self, session_factory, max_queue=1000, batch_size=100, flush_interval=0.05,
+                 clock=time.monotonic):
+        self.session_factory = session_factory
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._queue = queue.Queue(maxsize=max(max_queue, 0))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.overflows = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return self.max_queue > 0
+
+    def submit(self, user_id, user_message, bot_response, timestamp):
+        """Queue one exchange; False when the writer is off or its queue is full"""
+        if not self.enabled:
+            return False
+        row = (user_id, user_message, bot_response, timestamp)
+        with self._lock:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                self.overflows += 1
+                return False
+            self._pending.setdefault(user_id, []).append(row)
+            self.queued += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                self._thread.start()
+        return True
+
+    def pending(self, user_id):
+        """(user_message, bot_response, timestamp) exchanges queued for user_id but not yet committed"""
+        with self._lock:
+            return [row[1:] for row in self._pending.get(user_id, ())]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            row = self._queue.get()
+            if row is None:
+                self._queue.task_done()
+                return
+            batch = [row]
+            deadline = self._clock() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(row)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        """Insert one batch in a single transaction"""
+        db = self.session_factory()
+        try:
+            db.add_all([ChatHistory(user_id=user_id, user_message=user_message, bot_response=bot_response,
+                                    timestamp=timestamp)
+                        for user_id, user_message, bot_response, timestamp in batch])
+            db.commit()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            db.rollback()
+            self.failed += len(batch)
+            print(f"Chat history write failed: {str(e)}")
+        finally:
+            db.close()
+            with self._lock:
+                for row in batch:
+                    rows = self._pending.get(row[0])
+                    if rows is not None:
+                        rows.remove(row)
+                        if not rows:
+                            del self._pending[row[0]]
+
+    def join(self):
+        """Wait until every queued exchange has been written"""
+        self._queue.join()
+
+    def stop(self):
+        """Write everything still queued and stop the thread, e.g. at shutdown"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self):
+        """Counters and queue depth, for status endpoints"""
+        return {
+            "max_queue": self.max_queue,
+            "depth": self._queue.qsize(),
+            "queued": self.queued,
+            "written": self.written,
+            "batches": self.batches,
+            "overflows": self.overflows,
+            "failed": self.failed,
+        }
@@ -1,31 +1,81 @@
-import google.generativeai as genai
 from textblob import TextBlob
 from excercises import breathing_exercise, mindfulness_exercise
 from professor_exercises import academic_time_management_exercise, tenure_track_stress_management, work_life_boundary_setting, imposter_syndrome_academia, grading_overwhelm_relief, research_block_planning, student_interaction_recharge, academic_social_connection, sabbatical_preparation
-from health_knowledge import get_health_info, get_symptom_info, get_wellness_advice, search_health_database
-from models import User, MoodLog, ChatHistory
+from health_knowledge import get_health_info, get_symptom_info, get_wellness_advice, search_health_database, normalize_query, HEALTH_CONDITIONS, WELLNESS_TOPICS
+from models import User, MoodLog, ChatHistory, ConversationSummary
+from database import AsyncSessionLocal, SessionLocal
+from translation_service import translation_service
+from llm_providers import get_provider
+from llm_resilience import CircuitOpenError, LLMDeadlineExceeded, breaker_from_environment, call_policy_from_environment
+from caching import LRUCache
+from prompt_history import build_history_window, estimate_tokens, truncate_to_tokens, PromptStats
+from conversation_summary import SummaryWorker, build_summary_prompt
+from history_buffer import ConversationBuffer
+from chat_writer import ChatHistoryWriter
+from user_cache import UserProfile, user_cache_from_environment
+from keyword_matcher import KeywordAutomaton, FuzzyIndex, compile_keyword_lists, MIN_INFLECTED_LENGTH
 
 from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import aliased
 import os
 import random
-import difflib
+import functools
 
 load_dotenv()
 
-# Configure Google Generative AI
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-gemini_model = genai.GenerativeModel('gemini-pro')
+# LLM backend picked by LLM_PROVIDER: Gemini by default, or the local fake for tests and benchmarks
+llm_provider = get_provider()
+# The underlying Gemini model, for code that still reaches for it directly
+gemini_model = getattr(llm_provider, "model", None)
+# Stops calling the LLM while it keeps failing, so replies drop to the fallback at once
+LLM_BREAKER = breaker_from_environment()
+# Deadline, optional hedging and latency histogram for async LLM calls
+LLM_CALL_POLICY = call_policy_from_environment()
+
+# LLM replies shared between users who send the same message with the same mood and language
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+# A conversation this recent shapes the reply, so it is never served from or stored in the cache
+RESPONSE_CACHE_HISTORY_WINDOW = timedelta(minutes=float(os.getenv('RESPONSE_CACHE_HISTORY_MINUTES', '30')))
+RESPONSE_CACHE = LRUCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+RESPONSE_CACHE_COUNTERS = {"bypassed": 0}
+
+# Conversation history sent to the LLM is cut to fit these token limits
+PROMPT_HISTORY_TOKENS = int(os.getenv('PROMPT_HISTORY_TOKENS', '800'))
+PROMPT_TURN_TOKENS = int(os.getenv('PROMPT_TURN_TOKENS', '150'))
+PROMPT_STATS = PromptStats()
+
+# Prompts carry the user's stored summary plus this many of their latest exchanges
+PROMPT_HISTORY_EXCHANGES = int(os.getenv('PROMPT_HISTORY_EXCHANGES', '10'))
+# Older exchanges are folded into the summary once this many are unsummarized (0 turns summaries off)
+SUMMARY_THRESHOLD = int(os.getenv('SUMMARY_THRESHOLD', '20'))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '200'))
+
+# Recent turns of active users kept in memory, so their prompts need no chat_history query.
+# Per process: with several workers keep the TTL short (seconds), or set the user count to 0 to turn it off
+HISTORY_BUFFER = ConversationBuffer(
+    max_users=int(os.getenv('HISTORY_BUFFER_USERS', '10000')),
+    max_bytes=int(float(os.getenv('HISTORY_BUFFER_MB', '64')) * 1024 * 1024),
+    exchanges_per_user=PROMPT_HISTORY_EXCHANGES,
+    ttl=float(os.getenv('HISTORY_BUFFER_TTL', '120')) or None,
+)
+# username -> id, role and language; also tells a chat whether the user's
+# conversation is buffered before its context query
+USER_CACHE = user_cache_from_environment()
+
+@functools.lru_cache(maxsize=32)
+def get_fuzzy_index(intents):
+    """Build (once per intent collection) the fuzzy index used by find_matching_intents"""
+    return FuzzyIndex(intents)
 
 def find_matching_intents(text, intents, threshold=0.8):
     """Find intents that match words in the text using fuzzy matching"""
-    words = text.split()
+    index = get_fuzzy_index(tuple(intents))
     matches = []
-    for word in words:
-        for intent in intents:
-            ratio = difflib.SequenceMatcher(None, intent, word).ratio()
-            if ratio >= threshold:
-                matches.append(intent)
+    for word in set(text.split()):
+        matches.extend(index.query(word, threshold))
     return list(set(matches))  # Return unique matches
 
 CRISIS_WORDS = {
@@ -473,24 +523,44 @@ PHARMACOGENOMICS_WORDS = ["pharmacogenomics", "personalized medication"]
 ACADEMIC_STRESS_WORDS = ["grading", "papers", "deadlines", "tenure", "publish", "research", "students", "committee", "teaching", "lectures", "exams", "syllabus"]
 WORK_LIFE_WORDS = ["work-life", "balance", "overwhelmed", "burnout", "exhausted", "time management"]
 PROFESSIONAL_WORDS = ["career", "promotion", "review", "evaluation", "colleagues", "department"]
+PROFESSOR_KEYWORDS = ['professor', 'academic', 'teaching', 'research', 'grading', 'tenure', 'students', 'university', 'college', 'faculty']
+
+# Conversational keywords
+GREETING_WORDS = ["hello", "hi", "hey", "good morning", "good afternoon", "good evening", "greetings", "howdy", "sup", "yo"]
+ROUTINE_WORDS = ["daily routine", "your day", "how is your day", "what's your routine", "tell me about your day", "how was your day", "what do you do daily", "your daily life"]
+DOCTOR_WORDS = ["doctor", "consult", "appointment", "medical help", "see a doctor", "healthcare", "physician"]
+
+# Keywords that pick the exercise once a professor-specific route has matched
+PROFESSOR_TOPIC_WORDS = {
+    "grading": ["grading", "grade"],
+    "research": ["research", "publish"],
+    "tenure": ["tenure"],
+    "deadline": ["time", "deadline"],
+    "burnout": ["burnout"],
+    "imposter": ["imposter", "fraud", "not good enough"],
+    "students": ["student", "teaching"],
+    "connection": ["social", "connection", "isolated"],
+    "sabbatical": ["sabbatical", "break"],
+}
 
-def get_crisis_support_response(text):
+def get_crisis_support_response(text, analysis=None):
     """Provide supportive crisis response with tips and suggestions to help users come out of crisis thoughts"""
-    text_lower = text.lower()
-
-    # Determine the type of crisis based on keywords
+    # Determine the type of crisis based on keywords, reusing the caller's routing pass when given
+    if analysis is None:
+        analysis = MessageAnalysis(text)
+    matches = analysis.matches
     crisis_type = None
-    if any(word in text_lower for word in CRISIS_WORDS["suicide"]):
+    if "crisis:suicide" in matches:
         crisis_type = "suicidal"
-    elif any(word in text_lower for word in CRISIS_WORDS["self_harm"]):
+    elif "crisis:self_harm" in matches:
         crisis_type = "self_harm"
-    elif any(word in text_lower for word in CRISIS_WORDS["severe_depression"]):
+    elif "crisis:severe_depression" in matches:
         crisis_type = "severe_depression"
-    elif any(word in text_lower for word in CRISIS_WORDS["mental_crisis"]):
+    elif "crisis:mental_crisis" in matches:
         crisis_type = "mental_crisis"
-    elif any(word in text_lower for word in CRISIS_WORDS["trauma_abuse"]):
+    elif "crisis:trauma_abuse" in matches:
         crisis_type = "trauma"
-    elif any(word in text_lower for word in CRISIS_WORDS["addiction"]):
+    elif "crisis:addiction" in matches:
         crisis_type = "addiction"
     else:
         crisis_type = "general_crisis"
@@ -839,164 +909,552 @@ INTENT_RESPONSES = {
     "career_changes": "Career changes can be daunting but rewarding. Assess skills, explore options, and seek career counseling.",
 }
 
+# Position of each intent in INTENT_RESPONSES; the first listed intent wins
+INTENT_ORDER = {intent: position for position, intent in enumerate(INTENT_RESPONSES)}
+
+def build_routing_automaton():
+    """Compile crisis words and every routing keyword list into one automaton"""
+    automaton = KeywordAutomaton(word_boundaries=True)
+    for crisis_type, words in CRISIS_WORDS.items():
+        for word in words:
+            # Crisis detection stays recall-biased: keywords keep substring
+            # matching ("hopelessness", "enraged") and only ones too short to
+            # be distinctive ("mad" in "made") need a whole-word match
+            automaton.add(word, "crisis", "crisis:" + crisis_type,
+                          word_boundaries=len(word) < MIN_INFLECTED_LENGTH)
+    automaton.add_many(GREETING_WORDS, "greeting")
+    automaton.add_many(ROUTINE_WORDS, "routine")
+    automaton.add_many(BREATHING_WORDS, "breathing")
+    automaton.add_many(MINDFUL_WORDS, "mindful")
+    automaton.add_many(PROFESSOR_KEYWORDS, "professor")
+    automaton.add_many(PREVENTION_WORDS, "prevention")
+    for intent in INTENT_RESPONSES:
+        automaton.add(intent, "intent:" + intent)
+    automaton.add_many(ACADEMIC_STRESS_WORDS, "academic_stress")
+    automaton.add_many(WORK_LIFE_WORDS, "work_life")
+    automaton.add_many(PROFESSIONAL_WORDS, "professional")
+    automaton.add_many(DOCTOR_WORDS, "doctor")
+    for topic, words in PROFESSOR_TOPIC_WORDS.items():
+        automaton.add_many(words, "topic:" + topic)
+    return automaton.build()
+
+ROUTING_AUTOMATON = build_routing_automaton()
+
+def first_matching_intent(matches):
+    """Return the earliest INTENT_RESPONSES key present in a routing match set"""
+    intents = [category[len("intent:"):] for category in matches if category.startswith("intent:")]
+    if not intents:
+        return None
+    return min(intents, key=INTENT_ORDER.__getitem__)
+
+class MessageAnalysis:
+    """Everything the response stages derive from one message, computed once per request
+
+    The routing pass runs up front; health search and the health-question and
+    fallback keyword passes run the first time a stage asks for them, so a
+    message answered early never pays for them.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.text_lower = text.lower()
+        self.words = self.text_lower.split()
+        self.matches = ROUTING_AUTOMATON.find(self.text_lower)
+        self.intent = first_matching_intent(self.matches)
+        self.is_crisis = "crisis" in self.matches
+        self.is_professor_query = "professor" in self.matches
+        self.is_prevention_query = "prevention" in self.matches
+        self.is_question = text.endswith('?') or self.text_lower.startswith(('what', 'how', 'why', 'when', 'where', 'can you', 'do you', 'should i'))
+        self._health_results = None
+        self._query_types = None
+        self._feelings = None
+
+    @property
+    def health_results(self):
+        """search_health_database hits for the message"""
+        if self._health_results is None:
+            self._health_results = search_health_database(self.text)
+        return self._health_results
+
+    @property
+    def query_types(self):
+        """HEALTH_QUERY_WORDS categories: what a health question is asking for"""
+        if self._query_types is None:
+            self._query_types = HEALTH_QUERY_AUTOMATON.find(self.text_lower)
+        return self._query_types
+
+    @property
+    def feelings(self):
+        """FALLBACK_WORDS categories: emotions and needs the message expresses"""
+        if self._feelings is None:
+            self._feelings = FALLBACK_AUTOMATON.find(self.text_lower)
+        return self._feelings
+
+
+class ChatContext:
+    """What a chat needs to know about its user, loaded once per request
+
+    user_id is None for an unknown user. summary and conversation_history
+    are the conversation summary, or None, and the exchanges it does not
+    cover, oldest first.
+    """
+
+    def __init__(self, user_id=None, current_mood=None, language='en', summary=None, conversation_history=None):
+        self.user_id = user_id
+        self.current_mood = current_mood
+        self.language = language
+        self.summary = summary
+        self.conversation_history = conversation_history if conversation_history is not None else []
+
+def chat_context_query(username, today, history_limit, with_history=True):
+    """Statement for a user's id, language and mood today, plus their summary and latest exchanges
+
+    Gives one row per exchange, oldest first, or a single row with empty
+    exchange columns when there are none; no rows for an unknown user.
+    Without with_history it selects only the user and mood columns.
+    """
+    statement = select(User.id.label("user_id"), User.role, User.language, MoodLog.mood).select_from(User).outerjoin(
+        MoodLog, and_(MoodLog.user_id == User.id, MoodLog.log_date == today)
+    ).where(User.username == username)
+    if not with_history:
+        return statement
+    recent = aliased(ChatHistory)
+    recent_ids = select(recent.id).where(
+        recent.user_id == User.id,
+        recent.id > func.coalesce(ConversationSummary.summarized_through, 0)
+    ).order_by(recent.timestamp.desc(), recent.id.desc()).limit(history_limit).correlate(User, ConversationSummary)
+    return statement.add_columns(
+        ConversationSummary.summary, ChatHistory.id.label("chat_id"),
+        ChatHistory.user_message, ChatHistory.bot_response, ChatHistory.timestamp
+    ).outerjoin(ConversationSummary, ConversationSummary.user_id == User.id).outerjoin(
+        ChatHistory, ChatHistory.id.in_(recent_ids)
+    ).order_by(ChatHistory.timestamp, ChatHistory.id)
+
+def load_conversation_history(db, user_id, limit=10, after_id=0):
+    """Recent exchanges for the Gemini prompt, oldest first"""
+    recent_chats = db.query(ChatHistory).filter(
+        ChatHistory.user_id == user_id,
+        ChatHistory.id > after_id
+    ).order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit).all()
+
+    # Reverse to get chronological order (oldest first)
+    recent_chats.reverse()
 
-def generate_response(username, text, db, target_lang=None):
-    text_l = text.lower()
-
-    # Get user's language preference and latest mood
-    user = db.query(User).filter(User.username == username).first()
-    if user:
-        today = date.today()
-        mood_record = db.query(MoodLog).filter(
-            MoodLog.user_id == user.id,
-            MoodLog.log_date == today
-        ).first()
-        current_mood = mood_record.mood if mood_record else None
-        user_lang = user.language if user.language else 'en'
-    else:
-        current_mood = None
-        user_lang = 'en'
-
-    # Use provided target_lang or user's preference
-    target_language = target_lang if target_lang else user_lang
+    conversation_history = []
+    for chat in recent_chats:
+        conversation_history.append({"role": "user", "content": chat.user_message, "timestamp": chat.timestamp})
+        conversation_history.append({"role": "assistant", "content": chat.bot_response, "timestamp": chat.timestamp})
+    return conversation_history
+
+def merge_queued_exchanges(conversation_history, queued, limit):
+    """Add exchanges still waiting in CHAT_WRITER to history read from the database
+
+    An exchange committed between the queue snapshot and the read shows up in
+    both and is kept once. Only the last limit exchanges are returned.
+    """
+    if not queued:
+        return conversation_history
+    stored = {(message["content"], message["timestamp"]) for message in conversation_history[::2]}
+    merged = list(conversation_history)
+    for user_message, bot_response, timestamp in queued:
+        if (user_message, timestamp) not in stored:
+            merged.append({"role": "user", "content": user_message, "timestamp": timestamp})
+            merged.append({"role": "assistant", "content": bot_response, "timestamp": timestamp})
+    return merged[-2 * limit:]
+
+def load_chat_context(db, username):
+    """ChatContext for username, read with a single query
+
+    A user whose conversation is in HISTORY_BUFFER gets it from there and
+    the query reads only their id, language and mood; otherwise it reads
+    their summary and recent history too, which then fill the buffer.
+    """
+    profile = USER_CACHE.get(username)
+    known_id = profile.id if profile is not None else None
+    buffered = HISTORY_BUFFER.get(known_id) if known_id is not None else None
+    if buffered is None:
+        if known_id is not None:
+            HISTORY_BUFFER.begin_load(known_id)
+            mark = None
+        else:
+            mark = HISTORY_BUFFER.load_mark()
+        # Taken before the read, so an exchange the writer commits meanwhile is not missed
+        queued = CHAT_WRITER.pending(known_id) if known_id is not None else []
+    rows = db.execute(chat_context_query(username, date.today(), PROMPT_HISTORY_EXCHANGES,
+                                         with_history=buffered is None)).all()
+    if not rows:
+        return ChatContext()
+    first = rows[0]
+    if profile is None:
+        USER_CACHE.set(UserProfile(first.user_id, username, first.role, first.language))
+    context = ChatContext(first.user_id, first.mood, first.language or 'en')
+    if buffered is not None:
+        context.summary, context.conversation_history = buffered
+        return context
 
-    if any(word in text_l for word in ALL_CRISIS_WORDS):
-        return get_crisis_support_response(text)
+    conversation_history = []
+    for row in rows:
+        if row.chat_id is not None:
+            conversation_history.append({"role": "user", "content": row.user_message, "timestamp": row.timestamp})
+            conversation_history.append({"role": "assistant", "content": row.bot_response, "timestamp": row.timestamp})
+    if known_id != first.user_id:
+        queued = CHAT_WRITER.pending(first.user_id)
+    context.summary = first.summary
+    context.conversation_history = merge_queued_exchanges(conversation_history, queued, PROMPT_HISTORY_EXCHANGES)
+    HISTORY_BUFFER.put(first.user_id, context.summary, context.conversation_history, mark)
+    return context
+
+def summarize_conversation(previous_summary, exchanges):
+    """New summary text folding exchanges into previous_summary, written by the LLM"""
+    prompt = build_summary_prompt(previous_summary, exchanges, SUMMARY_MAX_TOKENS, PROMPT_TURN_TOKENS)
+    summary = LLM_BREAKER.call(llm_provider.generate, prompt).strip()
+    return truncate_to_tokens(summary, SUMMARY_MAX_TOKENS)[0]
+
+# Folds older exchanges into per-user summaries on a background thread
+SUMMARY_WORKER = SummaryWorker(lambda: SessionLocal(), summarize_conversation,
+                               threshold=SUMMARY_THRESHOLD, keep_recent=PROMPT_HISTORY_EXCHANGES,
+                               on_update=lambda user_id: HISTORY_BUFFER.invalidate(user_id))
+
+def request_summary_if_due(user_id, conversation_history):
+    """Queue a summary check once the unsummarized exchanges fill the history window"""
+    if len(conversation_history) // 2 >= PROMPT_HISTORY_EXCHANGES:
+        SUMMARY_WORKER.request(user_id)
+
+def has_recent_history(conversation_history):
+    """Whether the last exchange is recent enough to shape the next reply"""
+    if not conversation_history:
+        return False
+    last_timestamp = conversation_history[-1].get("timestamp")
+    return last_timestamp is not None and datetime.utcnow() - last_timestamp < RESPONSE_CACHE_HISTORY_WINDOW
+
+def response_cache_key(text, current_mood, target_language):
+    """Cache key for an LLM reply: normalized message, mood and language"""
+    return normalize_query(text), (current_mood or "").lower(), target_language or 'en'
+
+def plan_llm_request(username, text, current_mood, target_language, conversation_history, analysis, summary=None):
+    """Prompt, cache key and any cached reply for the LLM branch
+
+    When a conversation summary or a recent conversation shapes the reply the
+    cache is bypassed and the key is None. Otherwise the prompt leaves out
+    the username and older history, so the reply depends on nothing but the
+    key and can be shared.
+    """
+    # A returning user's summary outlives the recent-history window, so it bypasses the cache on its own
+    if summary or has_recent_history(conversation_history):
+        RESPONSE_CACHE_COUNTERS["bypassed"] += 1
+        history, window = build_history_window(conversation_history, PROMPT_HISTORY_TOKENS, PROMPT_TURN_TOKENS)
+        prompt = build_gemini_prompt(username, text, current_mood, history, analysis, summary)
+        PROMPT_STATS.record(estimate_tokens(prompt), window)
+        return prompt, None, None
+    cache_key = response_cache_key(text, current_mood, target_language)
+    prompt = build_gemini_prompt(None, text, current_mood, [], analysis)
+    cached_response = RESPONSE_CACHE.get(cache_key)
+    if cached_response is None:
+        PROMPT_STATS.record(estimate_tokens(prompt))
+    return prompt, cache_key, cached_response
+
+def response_cache_stats():
+    """Response cache counters, including requests that bypassed it"""
+    stats = RESPONSE_CACHE.stats()
+    stats["bypassed"] = RESPONSE_CACHE_COUNTERS["bypassed"]
+    return stats
+
+# Writes exchanges to ChatHistory in batches on a background thread, so replies
+# do not wait for the commit; CHAT_WRITE_QUEUE_SIZE=0 writes each one inline
+CHAT_WRITER = ChatHistoryWriter(lambda: SessionLocal(),
+                                max_queue=int(os.getenv('CHAT_WRITE_QUEUE_SIZE', '1000')),
+                                batch_size=int(os.getenv('CHAT_WRITE_BATCH_SIZE', '100')),
+                                flush_interval=float(os.getenv('CHAT_WRITE_INTERVAL_MS', '50')) / 1000)
+
+def save_chat(db, user_id, text, response):
+    """Write one exchange to ChatHistory now and add it to the user's history buffer"""
+    timestamp = datetime.utcnow()
+    db.add(ChatHistory(user_id=user_id, user_message=text, bot_response=response, timestamp=timestamp))
+    db.commit()
+    HISTORY_BUFFER.append(user_id, text, response, timestamp)
+
+def queue_chat(user_id, text, response):
+    """Hand one exchange to CHAT_WRITER and the user's history buffer
+
+    Returns False when the writer's queue is full; the caller then writes the
+    exchange itself with save_chat, which slows it down until the writer catches up.
+    """
+    timestamp = datetime.utcnow()
+    if not CHAT_WRITER.submit(user_id, text, response, timestamp):
+        return False
+    HISTORY_BUFFER.append(user_id, text, response, timestamp)
+    return True
+
+def store_chat(db, user_id, text, response):
+    """Queue an exchange, or write it in db when the queue is full"""
+    if not queue_chat(user_id, text, response):
+        save_chat(db, user_id, text, response)
+
+async def store_chat_async(user_id, text, response):
+    """Queue an exchange, or write it in a session of its own when the queue is full"""
+    if not queue_chat(user_id, text, response):
+        await run_in_async_session(save_chat, user_id, text, response)
+
+async def run_in_async_session(work, *args):
+    """Run work(db, *args) in a short-lived async session of its own
+
+    work is ordinary Session code; run_sync drives it over the async driver,
+    so it needs no worker thread.
+    """
+    db = AsyncSessionLocal()
+    try:
+        return await db.run_sync(work, *args)
+    finally:
+        await db.close()
+
+def translate_response(bot_response, target_language):
+    """Translate a reply when the target language is not English"""
+    if target_language and target_language != 'en':
+        try:
+            bot_response = translation_service.translate(bot_response, target_language)
+        except Exception as e:
+            # If translation fails, keep original English response
+            print(f"Translation failed: {str(e)}")
+    return bot_response
+
+def get_rule_based_response(text, analysis, current_mood):
+    """Answer from the crisis, conversational, exercise, health and professor routes
+
+    Returns None when the message should go to Gemini.
+    """
+    matches = analysis.matches
+
+    if analysis.is_crisis:
+        return get_crisis_support_response(text, analysis)
 
     # Check for greetings
-    greeting_words = ["hello", "hi", "hey", "good morning", "good afternoon", "good evening", "greetings", "howdy", "sup", "yo"]
-    if any(word in text_l for word in greeting_words) and len(text.split()) <= 3:
+    if "greeting" in matches and len(analysis.words) <= 3:
         greeting_responses = [
             "Hi there! How's your day going?",
             "Hello! It's great to hear from you. What's new?",
             "Hey! How are you feeling today?",
             "Hi! I'm here whenever you need to talk. How's everything?"
         ]
-        response = greeting_responses[len(text) % len(greeting_responses)]
-
-        # Save to database
-        if user:
-            chat_entry = ChatHistory(
-                user_id=user.id,
-                user_message=text,
-                bot_response=response
-            )
-            db.add(chat_entry)
-            db.commit()
-
-        return response
+        return greeting_responses[len(text) % len(greeting_responses)]
 
     # Check for daily routine questions
-    routine_words = ["daily routine", "your day", "how is your day", "what's your routine", "tell me about your day", "how was your day", "what do you do daily", "your daily life"]
-    if any(phrase in text_l for phrase in routine_words):
+    if "routine" in matches:
         routine_responses = [
             "My day usually involves helping people like you with wellbeing support, learning about health topics, and being here whenever someone needs to talk. How about you - what's been happening in your daily routine lately?",
             "As an AI wellbeing companion, my 'routine' is being available 24/7 to listen and support. I spend my time learning about mental health, wellness practices, and how to best help people. What's a typical day like for you?",
             "I don't have a traditional daily routine like humans do, but I'm always here to chat about wellbeing, share exercises, and provide support. What does your daily routine look like these days?",
             "My purpose is to support wellbeing, so my 'day' is filled with conversations like this one. I love hearing about people's daily lives - what's been going on with you?"
         ]
-        response = routine_responses[len(text) % len(routine_responses)]
-
-        # Save to database
-        if user:
-            chat_entry = ChatHistory(
-                user_id=user.id,
-                user_message=text,
-                bot_response=response
-            )
-            db.add(chat_entry)
-            db.commit()
-
-        return response
+        return routine_responses[len(text) % len(routine_responses)]
 
-    if any(word in text_l for word in BREATHING_WORDS):
+    if "breathing" in matches:
         return breathing_exercise()
 
-    if any(word in text_l for word in MINDFUL_WORDS):
+    if "mindful" in matches:
         return mindfulness_exercise()
 
-    # Skip health search for professor-specific queries to avoid false matches
-    professor_keywords = ['professor', 'academic', 'teaching', 'research', 'grading', 'tenure', 'students', 'university', 'college', 'faculty']
-    is_professor_query = any(keyword in text.lower() for keyword in professor_keywords)
-
     # Check for prevention-focused queries first to prioritize them over health searches
-    is_prevention_query = any(word in text_l for word in PREVENTION_WORDS)
-    if is_prevention_query:
-        prevention_response = get_prevention_solutions(text)
+    if analysis.is_prevention_query:
+        prevention_response = get_prevention_solutions(text, analysis)
         if prevention_response:
             return prevention_response
 
     # Check for intent-based responses (general responses for emotions/issues) before health database
-    for intent in INTENT_RESPONSES:
-        if intent in text_l:
-            return INTENT_RESPONSES[intent]
+    if analysis.intent:
+        return INTENT_RESPONSES[analysis.intent]
 
     # Health information queries - skip for professor or prevention queries to avoid false matches
-    if not is_professor_query and not is_prevention_query:
-        health_results = search_health_database(text)
-        if health_results:
-            return format_health_response(health_results, text)
+    if not analysis.is_professor_query and not analysis.is_prevention_query:
+        if analysis.health_results:
+            return format_health_response(analysis.health_results, text, analysis)
 
     # Professor-specific exercises - check after general responses to avoid overriding
-    if any(word in text_l for word in ACADEMIC_STRESS_WORDS):
-        if "grading" in text_l or "grade" in text_l:
+    if "academic_stress" in matches:
+        if "topic:grading" in matches:
             return grading_overwhelm_relief()
-        elif "research" in text_l or "publish" in text_l:
+        elif "topic:research" in matches:
             return research_block_planning()
-        elif "tenure" in text_l:
+        elif "topic:tenure" in matches:
             return tenure_track_stress_management()
-        elif "time" in text_l or "deadline" in text_l:
+        elif "topic:deadline" in matches:
             return academic_time_management_exercise()
         else:
-            return get_academic_stress_response(text, current_mood)
+            return get_academic_stress_response(text, current_mood, analysis)
 
-    if any(word in text_l for word in WORK_LIFE_WORDS):
-        if "burnout" in text_l:
+    if "work_life" in matches:
+        if "topic:burnout" in matches:
             return work_life_boundary_setting()
         else:
-            return get_work_life_balance_response(text, current_mood)
+            return get_work_life_balance_response(text, current_mood, analysis)
 
-    if any(word in text_l for word in PROFESSIONAL_WORDS):
-        if "imposter" in text_l or "fraud" in text_l or "not good enough" in text_l:
+    if "professional" in matches:
+        if "topic:imposter" in matches:
             return imposter_syndrome_academia()
-        elif "student" in text_l or "teaching" in text_l:
+        elif "topic:students" in matches:
             return student_interaction_recharge()
-        elif "social" in text_l or "connection" in text_l or "isolated" in text_l:
+        elif "topic:connection" in matches:
             return academic_social_connection()
-        elif "sabbatical" in text_l or "break" in text_l:
+        elif "topic:sabbatical" in matches:
             return sabbatical_preparation()
         else:
-            return get_professional_support_response(text, current_mood)
+            return get_professional_support_response(text, current_mood, analysis)
 
     # Doctor consultation requests
-    if any(word in text_l for word in ["doctor", "consult", "appointment", "medical help", "see a doctor", "healthcare", "physician"]):
+    if "doctor" in matches:
         return provide_doctor_consultation_info()
 
-    # Get recent conversation history for context
-    conversation_history = []
-    if user:
-        recent_chats = db.query(ChatHistory).filter(
-            ChatHistory.user_id == user.id
-        ).order_by(ChatHistory.timestamp.desc()).limit(10).all()
+    return None
+
+def generate_response(username, text, db, target_lang=None, context=None):
+    analysis = MessageAnalysis(text)
 
-        # Reverse to get chronological order (oldest first)
-        recent_chats.reverse()
+    # Get user's language preference, latest mood and conversation, unless the caller has them
+    if context is None:
+        context = load_chat_context(db, username)
+    user_id, current_mood = context.user_id, context.current_mood
+
+    # Use provided target_lang or user's preference
+    target_language = target_lang if target_lang else context.language
+
+    # Canned replies are stored too, so the history the LLM sees has no gaps
+    response = get_rule_based_response(text, analysis, current_mood)
+    if response is not None:
+        if user_id:
+            store_chat(db, user_id, text, response)
+        return response
 
-        for chat in recent_chats:
-            conversation_history.append({"role": "user", "content": chat.user_message})
-            conversation_history.append({"role": "assistant", "content": chat.bot_response})
+    summary, conversation_history = context.summary, context.conversation_history
+    if user_id:
+        request_summary_if_due(user_id, conversation_history)
 
-    # Enhanced data integration for comprehensive responses
-    health_results = search_health_database(text)
-    professor_keywords = ['academic', 'professor', 'teaching', 'research', 'grading', 'tenure', 'students', 'university', 'college', 'faculty']
-    is_academic_context = any(keyword in text.lower() for keyword in professor_keywords)
+    prompt, cache_key, bot_response = plan_llm_request(username, text, current_mood, target_language, conversation_history, analysis, summary)
 
     # Use Gemini for natural conversation
     try:
-        system_prompt = f"""You are a friendly, supportive wellbeing companion - like a trusted friend who genuinely cares about {username}'s wellbeing. You're not a therapist, but you're always there to listen and help."""
-        if current_mood:
-            system_prompt += f" They mentioned feeling {current_mood} recently."
-        system_prompt += """
+        if bot_response is None:
+            bot_response = translate_response(LLM_BREAKER.call(llm_provider.generate, prompt).strip(), target_language)
+            if cache_key:
+                RESPONSE_CACHE.set(cache_key, bot_response)
+
+        # Save conversation to database
+        if user_id:
+            store_chat(db, user_id, text, bot_response)
+
+        return bot_response
+    except CircuitOpenError:
+        # The LLM is known to be failing; answer from the rules without trying it
+        return get_enhanced_fallback_response(text, current_mood, analysis)
+    except Exception as e:
+        # Debug: Print the exception to understand the issue
+        print(f"OpenAI API Error: {str(e)}")
+        # Enhanced fallback to rule-based responses if OpenAI fails
+        return get_enhanced_fallback_response(text, current_mood, analysis)
+
+async def generate_response_async(username, text, target_lang=None, context=None):
+    """Async generate_response: awaits Gemini and keeps database work in short sessions around it"""
+    # Each session is closed before the model is awaited and its queries run
+    # on the async driver, so slow LLM calls hold neither a connection nor a thread
+    analysis = MessageAnalysis(text)
+    if context is None:
+        context = await run_in_async_session(load_chat_context, username)
+    user_id, current_mood = context.user_id, context.current_mood
+    target_language = target_lang if target_lang else context.language
+
+    response = get_rule_based_response(text, analysis, current_mood)
+    if response is not None:
+        if user_id:
+            await store_chat_async(user_id, text, response)
+        return response
+
+    summary, conversation_history = context.summary, context.conversation_history
+    if user_id:
+        request_summary_if_due(user_id, conversation_history)
+
+    prompt, cache_key, bot_response = plan_llm_request(username, text, current_mood, target_language, conversation_history, analysis, summary)
+    try:
+        if bot_response is None:
+            # Past the deadline the call counts as a breaker failure and the fallback answers
+            response = await LLM_BREAKER.call_async(LLM_CALL_POLICY.run, lambda: llm_provider.generate_async(prompt))
+            bot_response = translate_response(response.strip(), target_language)
+            if cache_key:
+                RESPONSE_CACHE.set(cache_key, bot_response)
+
+        if user_id:
+            await store_chat_async(user_id, text, bot_response)
+
+        return bot_response
+    except (CircuitOpenError, LLMDeadlineExceeded):
+        # Fast-fails and timeouts are counted at /status/llm rather than logged one by one
+        return get_enhanced_fallback_response(text, current_mood, analysis)
+    except Exception as e:
+        print(f"OpenAI API Error: {str(e)}")
+        return get_enhanced_fallback_response(text, current_mood, analysis)
+
+async def stream_response_async(username, text, target_lang=None, context=None):
+    """Yield the reply in chunks as Gemini produces them; ChatHistory is written once it completes"""
+    analysis = MessageAnalysis(text)
+    if context is None:
+        context = await run_in_async_session(load_chat_context, username)
+    user_id, current_mood = context.user_id, context.current_mood
+    target_language = target_lang if target_lang else context.language
+
+    # Rule-based answers are complete already and go out as a single chunk
+    response = get_rule_based_response(text, analysis, current_mood)
+    if response is not None:
+        if user_id:
+            await store_chat_async(user_id, text, response)
+        yield response
+        return
+
+    summary, conversation_history = context.summary, context.conversation_history
+    if user_id:
+        request_summary_if_due(user_id, conversation_history)
+
+    prompt, cache_key, cached_response = plan_llm_request(username, text, current_mood, target_language, conversation_history, analysis, summary)
+    if cached_response is not None:
+        if user_id:
+            await store_chat_async(user_id, text, cached_response)
+        yield cached_response
+        return
+
+    chunks = []
+    sent = False
+    try:
+        # Translation needs the whole reply, so translated replies are sent in one piece
+        translate = target_language and target_language != 'en'
+        async for chunk in LLM_BREAKER.stream(LLM_CALL_POLICY.first_chunk(llm_provider.stream_async(prompt))):
+            chunks.append(chunk)
+            if not translate:
+                sent = True
+                yield chunk
+        bot_response = "".join(chunks).strip()
+        if translate:
+            bot_response = translate_response(bot_response, target_language)
+            sent = True
+            yield bot_response
+    except Exception as e:
+        if not isinstance(e, (CircuitOpenError, LLMDeadlineExceeded)):
+            print(f"OpenAI API Error: {str(e)}")
+        # A reply cut off mid-stream is not stored; one that never started gets the fallback
+        if not sent:
+            yield get_enhanced_fallback_response(text, current_mood, analysis)
+        return
+
+    if cache_key:
+        RESPONSE_CACHE.set(cache_key, bot_response)
+    if user_id:
+        await store_chat_async(user_id, text, bot_response)
+
+def build_gemini_prompt(username, text, current_mood, conversation_history, analysis=None, summary=None):
+    """Build the Gemini prompt: companion persona, conversation summary, recent history and the new message"""
+    # Without a username the prompt is the same for everyone, so the reply can be cached
+    whose = f"{username}'s" if username else "the user's"
+    system_prompt = f"""You are a friendly, supportive wellbeing companion - like a trusted friend who genuinely cares about {whose} wellbeing. You're not a therapist, but you're always there to listen and help."""
+    if current_mood:
+        system_prompt += f" They mentioned feeling {current_mood} recently."
+    if analysis and analysis.is_professor_query:
+        system_prompt += " They work in academia, so professor-specific exercises are likely to be relevant."
+    system_prompt += """
 
 Your personality:
 - Talk like a caring friend: warm, genuine, and approachable
@@ -1031,41 +1489,17 @@ When suggesting exercises or activities:
 
 Always prioritize their emotional safety and encourage professional help for serious concerns."""
 
-        # Format conversation for Gemini
-        prompt = system_prompt + "\n\nConversation history:\n"
-        for msg in conversation_history:
-            prompt += f"{msg['role']}: {msg['content']}\n"
-        prompt += f"user: {text}"
-
-        response = gemini_model.generate_content(prompt)
-        bot_response = response.text.strip()
-
-        # Translate response if target language is not English
-        if target_language and target_language != 'en':
-            try:
-                bot_response = translation_service.translate(bot_response, target_language)
-            except Exception as e:
-                # If translation fails, keep original English response
-                print(f"Translation failed: {str(e)}")
-
-        # Save conversation to database
-        if user:
-            chat_entry = ChatHistory(
-                user_id=user.id,
-                user_message=text,
-                bot_response=bot_response
-            )
-            db.add(chat_entry)
-            db.commit()
-
-        return bot_response
-    except Exception as e:
-        # Debug: Print the exception to understand the issue
-        print(f"OpenAI API Error: {str(e)}")
-        # Enhanced fallback to rule-based responses if OpenAI fails
-        return get_enhanced_fallback_response(text, current_mood)
-
-def get_academic_stress_response(text, current_mood):
+    # Format conversation for Gemini
+    prompt = system_prompt
+    if summary:
+        prompt += f"\n\nSummary of earlier conversation:\n{summary}"
+    prompt += "\n\nConversation history:\n"
+    for msg in conversation_history:
+        prompt += f"{msg['role']}: {msg['content']}\n"
+    prompt += f"user: {text}"
+    return prompt
+
+def get_academic_stress_response(text, current_mood, analysis=None):
     """Provide professor-specific responses for academic stress"""
     responses = [
         "I understand the unique pressures of academic life - grading, research deadlines, and student expectations can be overwhelming. As a professor, you're doing important work that matters. Would you like some strategies for managing academic stress?",
@@ -1079,7 +1513,7 @@ def get_academic_stress_response(text, current_mood):
 
     return responses[len(text) % len(responses)]
 
-def get_work_life_balance_response(text, current_mood):
+def get_work_life_balance_response(text, current_mood, analysis=None):
     """Provide responses for work-life balance challenges"""
     responses = [
         "Work-life balance is crucial for professors, who often work beyond traditional hours. Setting boundaries between your professional and personal life is essential for long-term wellbeing.",
@@ -1088,12 +1522,13 @@ def get_work_life_balance_response(text, current_mood):
         "Many professors struggle with work-life balance. Try the 'academic sabbath' approach - designating certain times or days for complete disconnection from work emails and grading."
     ]
 
-    if "burnout" in text.lower():
+    text_lower = analysis.text_lower if analysis else text.lower()
+    if "burnout" in text_lower:
         return "Burnout in academia is real and serious. Consider speaking with a counselor or mentor about your workload. In the meantime, let's try a mindfulness exercise to help you reconnect with what matters most."
 
     return responses[len(text) % len(responses)]
 
-def get_professional_support_response(text, current_mood):
+def get_professional_support_response(text, current_mood, analysis=None):
     """Provide responses for professional challenges"""
     responses = [
         "Professional evaluations and career advancement in academia can be stressful. Remember that your value extends beyond metrics and reviews - your impact on students and knowledge is immeasurable.",
@@ -1102,21 +1537,34 @@ def get_professional_support_response(text, current_mood):
         "Professional relationships in academia can be complex. Consider finding mentors or peers who understand your challenges and can offer support and perspective."
     ]
 
-    if "review" in text.lower() or "evaluation" in text.lower():
+    text_lower = analysis.text_lower if analysis else text.lower()
+    if "review" in text_lower or "evaluation" in text_lower:
         return "Performance reviews can be anxiety-inducing. Remember that feedback, even critical, is an opportunity for growth. You've built a career through dedication and expertise - that's something to be proud of."
 
     return responses[len(text) % len(responses)]
 
-def format_health_response(results, query):
+# Phrases that reveal what a health question is asking for
+HEALTH_QUERY_WORDS = {
+    "symptom": ["symptoms of", "symptom", "signs of", "what are the symptoms"],
+    "cause": ["cause", "causes", "why", "what causes"],
+    "treatment": ["treatment", "treatments", "cure", "how to treat", "medicine"],
+    "prevention": ["prevent", "prevention", "avoid"],
+    "describing": ["i have", "i'm experiencing", "feeling", "pain", "ache", "hurt",
+                   "headache", "toothache", "stomachache", "backache", "earache", "heartache"],
+}
+
+HEALTH_QUERY_AUTOMATON = compile_keyword_lists(HEALTH_QUERY_WORDS, word_boundaries=True)
+
+def format_health_response(results, query, analysis=None):
     """Format health information responses professionally - provide targeted information based on query"""
-    query_lower = query.lower()
+    query_types = analysis.query_types if analysis else HEALTH_QUERY_AUTOMATON.find(query)
 
     # Determine query intent
-    is_symptom_query = any(word in query_lower for word in ["symptoms of", "symptom", "signs of", "what are the symptoms"])
-    is_cause_query = any(word in query_lower for word in ["cause", "causes", "why", "what causes"])
-    is_treatment_query = any(word in query_lower for word in ["treatment", "treatments", "cure", "how to treat", "medicine"])
-    is_prevention_query = any(word in query_lower for word in ["prevent", "prevention", "avoid"])
-    is_describing_symptoms = any(word in query_lower for word in ["i have", "i'm experiencing", "feeling", "pain", "ache", "hurt"])
+    is_symptom_query = "symptom" in query_types
+    is_cause_query = "cause" in query_types
+    is_treatment_query = "treatment" in query_types
+    is_prevention_query = "prevention" in query_types
+    is_describing_symptoms = "describing" in query_types
 
     response = ""
 
@@ -1191,9 +1639,9 @@ def format_health_response(results, query):
 
     return response
 
-def get_prevention_solutions(text):
+def get_prevention_solutions(text, analysis=None):
     """Provide prevention tips and solutions for health issues based on user query"""
-    text_lower = text.lower()
+    text_lower = analysis.text_lower if analysis else text.lower()
 
     # Map common prevention/solution queries to health conditions
     prevention_mappings = {
@@ -1382,23 +1830,40 @@ Would you like me to help you find specific resources or prepare for a doctor's
 """
     return consultation_info
 
-def get_enhanced_fallback_response(text, current_mood):
+# Emotion and need keywords for the rule-based fallback
+FALLBACK_WORDS = {
+    "sadness": ["sad", "depressed", "depression", "down", "blue", "unhappy", "miserable", "hopeless", "crying", "tears", "heartbroken", "low mood"],
+    "anxiety": ["anxious", "anxiety", "worried", "worry", "nervous", "panic", "panicking", "scared", "fear", "frightened", "heart racing", "chest tight", "can't breathe"],
+    "stress": ["stressed", "stress", "overwhelmed", "overwhelming", "pressure", "tension", "burnout", "burned out", "can't cope", "too much", "breaking point"],
+    "loneliness": ["lonely", "alone", "isolated", "isolation", "no one", "abandoned", "friendless", "empty", "disconnect"],
+    "tiredness": ["tired", "exhausted", "fatigued", "fatigue", "no energy", "sleepy", "drained", "worn out", "lethargic"],
+    "anger": ["angry", "anger", "frustrated", "frustration", "irritated", "irritation", "mad", "furious", "upset", "annoyed"],
+    "seeking_help": ["help me", "i need help", "what can i do", "how can i", "what should i", "give me advice", "suggest", "recommend"],
+    "gratitude": ["grateful", "thankful", "appreciate", "blessed", "gratitude", "thanks"],
+    "happiness": ["happy", "joy", "excited", "great", "wonderful", "good", "positive", "amazing"],
+}
+
+FALLBACK_AUTOMATON = compile_keyword_lists(FALLBACK_WORDS, word_boundaries=True)
+
+def get_enhanced_fallback_response(text, current_mood, analysis=None):
     """Enhanced rule-based fallback responses when OpenAI API is unavailable - focused on practical, specific help"""
-    text_lower = text.lower()
+    if analysis is None:
+        analysis = MessageAnalysis(text)
+    feelings = analysis.feelings
 
     # Expanded keyword detection for better matching
-    expressing_sadness = any(word in text_lower for word in ["sad", "depressed", "depression", "down", "blue", "unhappy", "miserable", "hopeless", "crying", "tears", "heartbroken", "low mood"])
-    expressing_anxiety = any(word in text_lower for word in ["anxious", "anxiety", "worried", "worry", "nervous", "panic", "panicking", "scared", "fear", "frightened", "heart racing", "chest tight", "can't breathe"])
-    expressing_stress = any(word in text_lower for word in ["stressed", "stress", "overwhelmed", "overwhelming", "pressure", "tension", "burnout", "burned out", "can't cope", "too much", "breaking point"])
-    expressing_loneliness = any(word in text_lower for word in ["lonely", "alone", "isolated", "isolation", "no one", "abandoned", "friendless", "empty", "disconnect"])
-    expressing_tiredness = any(word in text_lower for word in ["tired", "exhausted", "fatigued", "fatigue", "no energy", "sleepy", "drained", "worn out", "lethargic"])
-    expressing_anger = any(word in text_lower for word in ["angry", "anger", "frustrated", "frustration", "irritated", "irritation", "mad", "furious", "upset", "annoyed"])
+    expressing_sadness = "sadness" in feelings
+    expressing_anxiety = "anxiety" in feelings
+    expressing_stress = "stress" in feelings
+    expressing_loneliness = "loneliness" in feelings
+    expressing_tiredness = "tiredness" in feelings
+    expressing_anger = "anger" in feelings
 
     # Check for specific needs and requests
-    seeking_help = any(phrase in text_lower for phrase in ["help me", "i need help", "what can i do", "how can i", "what should i", "give me advice", "suggest", "recommend"])
-    is_question = text.endswith('?') or text_lower.startswith(('what', 'how', 'why', 'when', 'where', 'can you', 'do you', 'should i'))
-    expressing_gratitude = any(word in text_lower for word in ["grateful", "thankful", "appreciate", "blessed", "gratitude", "thanks"])
-    expressing_happiness = any(word in text_lower for word in ["happy", "joy", "excited", "great", "wonderful", "good", "positive", "amazing"])
+    seeking_help = "seeking_help" in feelings
+    is_question = analysis.is_question
+    expressing_gratitude = "gratitude" in feelings
+    expressing_happiness = "happiness" in feelings
 
     # Specific actionable responses based on detected emotions and needs
     if expressing_sadness and seeking_help:
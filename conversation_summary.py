@@ -0,0 +1,152 @@
+"""
+Rolling per-user conversation summaries.
+A background worker folds a user's older ChatHistory exchanges into one
+stored summary once enough of them have built up, so prompts can carry the
+summary plus the last few exchanges instead of an ever longer raw history.
+"""
+
+import queue
+import threading
+from datetime import datetime
+
+from models import ChatHistory, ConversationSummary
+from prompt_history import truncate_to_tokens
+
+
+def load_summary(db, user_id):
+    """The user's ConversationSummary row, or None before their first summary"""
+    return db.query(ConversationSummary).filter(ConversationSummary.user_id == user_id).first()
+
+
+def build_summary_prompt(previous_summary, exchanges, max_tokens, turn_tokens):
+    """Prompt asking the LLM to fold exchanges into the previous summary"""
+    prompt = (f"Summarize this conversation between a user and their wellbeing companion in at most "
+              f"{max_tokens * 3 // 4} words. Keep what matters for future chats: what the user is going "
+              f"through, how they feel, what helped and anything they asked to follow up on. "
+              f"Write plain prose about the user in the third person.\n")
+    if previous_summary:
+        prompt += f"\nSummary so far:\n{previous_summary}\n"
+    prompt += "\nNew exchanges:\n"
+    for user_message, bot_response in exchanges:
+        prompt += f"user: {truncate_to_tokens(user_message, turn_tokens)[0]}\n"
+        prompt += f"assistant: {truncate_to_tokens(bot_response, turn_tokens)[0]}\n"
+    return prompt
+
+
+def summarize_user(db, user_id, summarize, threshold, keep_recent):
+    """Fold a user's older exchanges into their summary once threshold are unsummarized
+
+    The newest keep_recent exchanges stay out of the summary, since prompts
+    send them in full. summarize(previous_summary, exchanges) returns the
+    new summary text for (user_message, bot_response) pairs. Returns whether
+    the summary was updated.
+    """
+    record = load_summary(db, user_id)
+    after_id = record.summarized_through if record else 0
+    query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id, ChatHistory.id > after_id)
+    if query.count() < threshold:
+        return False
+    rows = query.order_by(ChatHistory.id).all()
+    folded = rows[:len(rows) - keep_recent]
+    if not folded:
+        return False
+    summary = summarize(record.summary if record else None,
+                        [(row.user_message, row.bot_response) for row in folded])
+    if record is None:
+        record = ConversationSummary(user_id=user_id)
+        db.add(record)
+    record.summary = summary
+    record.summarized_through = folded[-1].id
+    record.updated_at = datetime.utcnow()
+    db.commit()
+    return True
+
+
+class SummaryWorker:
+    """Background thread that runs summarize_user for queued users
+
+    request() only queues the user id, so it is cheap enough to call on
+    every chat; a user who is already queued is not queued twice. The
+    thread starts on the first request. A threshold of 0 turns summaries off.
+    on_update, if given, is called with the user id after each new summary.
+    """
+
+    def __init__(self, session_factory, summarize, threshold=20, keep_recent=10, on_update=None):
+        self.session_factory = session_factory
+        self.summarize = summarize
+        self.on_update = on_update
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def request(self, user_id):
+        """Queue a summary check for user_id"""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="summary-worker", daemon=True)
+                self._thread.start()
+        self._queue.put(user_id)
+
+    def _run(self):
+        while True:
+            user_id = self._queue.get()
+            try:
+                if user_id is None:
+                    return
+                with self._lock:
+                    self._pending.discard(user_id)
+                self.run_once(user_id)
+            finally:
+                self._queue.task_done()
+
+    def run_once(self, user_id):
+        """Check and update one user's summary in a session of its own"""
+        db = self.session_factory()
+        try:
+            if summarize_user(db, user_id, self.summarize, self.threshold, self.keep_recent):
+                self.updated += 1
+                if self.on_update is not None:
+                    self.on_update(user_id)
+            else:
+                self.skipped += 1
+        except Exception as e:
+            db.rollback()
+            self.failed += 1
+            print(f"Conversation summary failed: {str(e)}")
+        finally:
+            db.close()
+
+    def join(self):
+        """Wait until every queued summary check has run"""
+        self._queue.join()
+
+    def stop(self):
+        """Finish queued checks and stop the thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self):
+        """Counters, for status endpoints"""
+        return {
+            "threshold": self.threshold,
+            "keep_recent": self.keep_recent,
+            "queued": self._queue.qsize(),
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
@@ -3,6 +3,22 @@ Comprehensive Health Knowledge Base for Wellbeing Chatbot
 Contains information on various health conditions, symptoms, treatments, and wellness advice
 """
 
+import string
+
+import numpy as np
+
+from caching import LRUCache
+from keyword_matcher import KeywordAutomaton, tokenize
+
+# BM25 parameters for ranking search results
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Distinct normalized queries whose ranked hits are kept in memory
+HEALTH_SEARCH_CACHE_SIZE = 2048
+# Entry names count this many times so "fatigue" ranks the fatigue entries first
+BM25_NAME_WEIGHT = 3
+
 HEALTH_CONDITIONS = {
     # Mental Health Conditions
     "anxiety": {
@@ -393,35 +409,134 @@ def get_wellness_advice(topic):
     """Get wellness advice for a specific topic"""
     return WELLNESS_TOPICS.get(topic.lower(), "General wellness advice: maintain healthy diet, regular exercise, adequate sleep, and manage stress.")
 
-def search_health_database(query):
-    """Search the health database for relevant information"""
-    query_lower = query.lower()
-    results = []
+def build_health_index():
+    """Build the phrase index used by search_health_database
+
+    Every searchable phrase (condition names, condition symptoms, symptom and
+    wellness keys) points at the entries it selects. Entries are numbered in
+    the order the tables used to be walked, so results keep that order.
+    """
+    automaton = KeywordAutomaton()
+    entries = []
+
+    def add_entry(phrases, result_type, name, field, value):
+        entry_id = len(entries)
+        entries.append((result_type, name, field, value))
+        for phrase in phrases:
+            automaton.add(phrase, entry_id)
 
     # Search conditions - handle both underscore and space versions
     for condition, info in HEALTH_CONDITIONS.items():
-        condition_normalized = condition.replace('_', ' ')
-        if condition in query_lower or condition_normalized in query_lower or any(symptom in query_lower for symptom in info.get('symptoms', [])):
-            results.append({"type": "condition", "name": condition, "info": info})
+        phrases = [condition, condition.replace('_', ' ')] + list(info.get('symptoms', []))
+        add_entry(phrases, "condition", condition, "info", info)
 
     for condition, info in MENTAL_HEALTH_CONDITIONS.items():
-        condition_normalized = condition.replace('_', ' ')
-        if condition in query_lower or condition_normalized in query_lower:
-            results.append({"type": "mental_health", "name": condition, "info": info})
+        add_entry([condition, condition.replace('_', ' ')], "mental_health", condition, "info", info)
 
-    # Search symptoms
     for symptom, causes in SYMPTOM_CHECKER.items():
-        if symptom in query_lower:
-            results.append({"type": "symptom", "name": symptom, "causes": causes})
+        add_entry([symptom], "symptom", symptom, "causes", causes)
 
-    # Search wellness topics
     for topic, advice in WELLNESS_TOPICS.items():
-        if topic in query_lower:
-            results.append({"type": "wellness", "name": topic, "advice": advice})
+        add_entry([topic], "wellness", topic, "advice", advice)
 
-    # Search symptom prevention
     for symptom, prevention_tips in SYMPTOM_PREVENTION.items():
-        if symptom in query_lower:
-            results.append({"type": "prevention", "name": symptom, "prevention_tips": prevention_tips})
+        add_entry([symptom], "prevention", symptom, "prevention_tips", prevention_tips)
+
+    return automaton.build(), entries
+
+HEALTH_INDEX, HEALTH_INDEX_ENTRIES = build_health_index()
+
+def stem_token(token):
+    """Fold simple plurals so "headaches" and "headache" score as one term"""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def entry_text(name, value):
+    """Text BM25 scores an entry on: its name plus symptoms, causes, treatments and prevention"""
+    parts = [name] * BM25_NAME_WEIGHT
+    if isinstance(value, dict):
+        for field in ("symptoms", "causes", "treatments", "prevention", "management"):
+            parts.extend(value.get(field, []))
+        # Wellness topics map sub-topics to advice strings
+        for key, advice in value.items():
+            if isinstance(advice, str):
+                parts.extend([key, advice])
+    else:
+        parts.extend(value)
+    return " ".join(parts)
 
+def build_bm25_matrix(entries):
+    """Precompute the BM25 term weight of every vocabulary term in every index entry"""
+    documents = [[stem_token(token) for token in tokenize(entry_text(name, value))]
+                 for _, name, _, value in entries]
+    vocabulary = {}
+    for document in documents:
+        for token in document:
+            vocabulary.setdefault(token, len(vocabulary))
+
+    term_frequencies = np.zeros((len(documents), len(vocabulary)))
+    for row, document in enumerate(documents):
+        for token in document:
+            term_frequencies[row, vocabulary[token]] += 1
+
+    document_lengths = term_frequencies.sum(axis=1, keepdims=True)
+    average_length = document_lengths.mean() if len(documents) else 1.0
+    document_frequencies = (term_frequencies > 0).sum(axis=0)
+    idf = np.log(1 + (len(documents) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * document_lengths / average_length)
+    weights = idf * term_frequencies * (BM25_K1 + 1) / (term_frequencies + length_norm)
+    return vocabulary, weights
+
+BM25_VOCABULARY, BM25_WEIGHTS = build_bm25_matrix(HEALTH_INDEX_ENTRIES)
+
+def score_health_entries(query):
+    """BM25 score of the query against every index entry in one vectorized operation"""
+    query_counts = np.zeros(len(BM25_VOCABULARY))
+    for token in tokenize(query):
+        column = BM25_VOCABULARY.get(stem_token(token))
+        if column is not None:
+            query_counts[column] += 1
+    return BM25_WEIGHTS @ query_counts
+
+def normalize_query(query):
+    """Cache key for a query: lowercased, whitespace collapsed, outer punctuation dropped
+
+    "I have a headache" and "i have a  headache!!" share one key, and the key
+    is what gets searched. Case and outer punctuation never change the
+    results, since the search only matches letters and digits. Collapsing
+    whitespace can: "chest  pain" finds the chest pain entries once
+    normalized, where the raw text finds nothing.
+    """
+    return " ".join(query.lower().split()).strip(string.punctuation + " ")
+
+HEALTH_SEARCH_CACHE = LRUCache(maxsize=HEALTH_SEARCH_CACHE_SIZE)
+
+def rank_health_entries(query):
+    """(entry id, score) pairs for entries the query mentions, most relevant first"""
+    entry_ids = sorted(set(HEALTH_INDEX.find(query)))
+    if not entry_ids:
+        return ()
+    scores = score_health_entries(query)
+    # Python's sort is stable, so equally scored entries keep table order
+    entry_ids.sort(key=lambda entry_id: -scores[entry_id])
+    return tuple((entry_id, float(scores[entry_id])) for entry_id in entry_ids)
+
+def search_health_database(query):
+    """Search the health database for relevant information, most relevant first"""
+    key = normalize_query(query)
+    ranked = HEALTH_SEARCH_CACHE.get_or_set(key, lambda: rank_health_entries(key))
+    results = []
+    for entry_id, score in ranked:
+        result_type, name, field, value = HEALTH_INDEX_ENTRIES[entry_id]
+        results.append({"type": result_type, "name": name, field: value, "score": score})
     return results
+
+def refresh_health_index():
+    """Rebuild the phrase index and BM25 matrix after the knowledge tables change"""
+    global HEALTH_INDEX, HEALTH_INDEX_ENTRIES, BM25_VOCABULARY, BM25_WEIGHTS
+    HEALTH_INDEX, HEALTH_INDEX_ENTRIES = build_health_index()
+    BM25_VOCABULARY, BM25_WEIGHTS = build_bm25_matrix(HEALTH_INDEX_ENTRIES)
+    HEALTH_SEARCH_CACHE.invalidate()
@@ -0,0 +1,194 @@
+"""
+In-process buffer of recent conversation turns per user.
+Holds each active user's conversation summary and latest exchanges so a chat
+can build its prompt without querying chat_history. Entries are filled from
+the database on first access and extended as exchanges are saved; the least
+recently used users are evicted past a user count or memory cap.
+
+Each process has its own buffer. With several workers, an exchange saved by
+one worker is not seen by the others until their entry expires after ttl
+seconds, so keep ttl short, route a user's requests to one worker, or turn
+the buffer off with max_users=0.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Rough per-exchange bookkeeping cost on top of the strings themselves
+EXCHANGE_OVERHEAD = 200
+
+
+class _Entry:
+    __slots__ = ("summary", "exchanges", "size", "stored_at")
+
+    def __init__(self, summary, exchanges, stored_at):
+        self.summary = summary
+        self.exchanges = exchanges
+        self.stored_at = stored_at
+        self.size = 0
+
+
+def exchange_size(exchange):
+    """Approximate bytes held by one (user_message, bot_response, timestamp) exchange"""
+    user_message, bot_response, _ = exchange
+    return sys.getsizeof(user_message or "") + sys.getsizeof(bot_response or "") + EXCHANGE_OVERHEAD
+
+
+class ConversationBuffer:
+    """Per-user ring buffers of the latest exchanges, LRU-evicted across users
+
+    get() returns (summary, history) in the shape load_conversation gives,
+    or None on a miss. A load from the database is bracketed by
+    begin_load() and put(); an exchange saved or an invalidation in between
+    means the loaded rows may be stale, and put() drops them. A load that
+    starts before the user id is known takes load_mark() instead, and its
+    put() is dropped after an exchange saved or invalidation for anyone.
+    """
+
+    def __init__(self, max_users=10000, max_bytes=64 * 1024 * 1024, exchanges_per_user=10,
+                 ttl=None, clock=time.monotonic):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.exchanges_per_user = exchanges_per_user
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_users > 0
+
+    def get(self, user_id):
+        """The user's (summary, history) from the buffer, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and self.ttl is not None and self._clock() - entry.stored_at >= self.ttl:
+                self._remove(user_id)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            history = []
+            for user_message, bot_response, timestamp in entry.exchanges:
+                history.append({"role": "user", "content": user_message, "timestamp": timestamp})
+                history.append({"role": "assistant", "content": bot_response, "timestamp": timestamp})
+            return entry.summary, history
+
+    def begin_load(self, user_id):
+        """Mark that the user's conversation is being read from the database"""
+        if self.enabled:
+            with self._lock:
+                self._loading[user_id] = False
+
+    def load_mark(self):
+        """Mark the start of a load whose user id is not known yet; pass the result to put()"""
+        with self._lock:
+            return self._writes
+
+    def put(self, user_id, summary, history, mark=None):
+        """Store a conversation loaded from the database since begin_load() or load_mark()"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if mark is not None:
+                stale = mark != self._writes
+                self._loading.pop(user_id, None)
+            else:
+                stale = self._loading.pop(user_id, True)
+            if stale:
+                # Written to or invalidated mid-load, or never marked: the rows may be stale
+                return
+            self._remove(user_id)
+            exchanges = deque(maxlen=self.exchanges_per_user)
+            for index in range(0, len(history) - 1, 2):
+                exchanges.append((history[index]["content"], history[index + 1]["content"],
+                                  history[index + 1].get("timestamp")))
+            entry = _Entry(summary, exchanges, self._clock())
+            entry.size = sys.getsizeof(summary or "") + sum(exchange_size(exchange) for exchange in exchanges)
+            self._entries[user_id] = entry
+            self.bytes += entry.size
+            self._evict()
+
+    def append(self, user_id, user_message, bot_response, timestamp):
+        """Add a saved exchange to the user's buffer if they have one"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._writes += 1
+            if user_id in self._loading:
+                self._loading[user_id] = True
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            exchange = (user_message, bot_response, timestamp)
+            if len(entry.exchanges) == entry.exchanges.maxlen:
+                dropped = exchange_size(entry.exchanges[0])
+                entry.size -= dropped
+                self.bytes -= dropped
+            entry.exchanges.append(exchange)
+            entry.size += exchange_size(exchange)
+            self.bytes += exchange_size(exchange)
+            self._entries.move_to_end(user_id)
+            self._evict()
+
+    def invalidate(self, user_id=None):
+        """Drop one user's entry, or every entry when called without a user"""
+        with self._lock:
+            self._writes += 1
+            if user_id is None:
+                self._entries.clear()
+                self.bytes = 0
+                for loading in self._loading:
+                    self._loading[loading] = True
+            else:
+                self._remove(user_id)
+                if user_id in self._loading:
+                    self._loading[user_id] = True
+
+    def _remove(self, user_id):
+        """Drop an entry and its size; caller holds the lock"""
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def _evict(self):
+        """Evict least recently used users past the caps; caller holds the lock"""
+        while self._entries and (len(self._entries) > self.max_users or self.bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """Counters and current size, for status endpoints"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._entries),
+                "max_users": self.max_users,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
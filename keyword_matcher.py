@@ -0,0 +1,246 @@
+"""
+Keyword automaton for routing chat messages.
+Compiles every routing keyword list into one Aho-Corasick automaton so a message
+is scanned once, however many keywords and categories the chatbot knows about.
+"""
+
+import difflib
+import re
+from collections import Counter, deque
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+
+# Endings a keyword may carry and still count as a whole-word match
+# ("abuse" -> "abused", "hopeless" -> "hopelessness", "pain" -> "painful").
+# Short keywords such as "hi" or "mad" must match exactly so "his" and
+# "made" stay out
+INFLECTION_SUFFIXES = ("s", "es", "d", "ed", "ing", "er", "ers", "ly", "ful", "ness", "ity", "al")
+MIN_INFLECTED_LENGTH = 4
+
+# Endings that attach to a changed stem: "abuse" -> "abus|ing",
+# "stop" -> "stopp|ing", "empty" -> "empti|ness"
+E_DROP_SUFFIXES = ("es", "ed", "ing", "er", "ers", "ity", "al")
+DOUBLED_CONSONANT_SUFFIXES = ("ing", "ed", "er", "ers")
+Y_TO_I_SUFFIXES = ("es", "ed", "er", "ers", "ly", "ful", "ness")
+
+VOWELS = "aeiou"
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens; underscores separate words"""
+    return TOKEN_PATTERN.findall(text.lower().replace("_", " "))
+
+
+def is_word_char(char):
+    """Characters that continue a word for boundary checks"""
+    return char.isalnum() or char == "_"
+
+
+def stem_variants(phrase):
+    """Spelling-changed stems of a phrase with the endings each one accepts"""
+    variants = []
+    if len(phrase) < MIN_INFLECTED_LENGTH or not phrase[-1].isalpha():
+        return variants
+    last, before = phrase[-1], phrase[-2]
+    if last == "e":
+        variants.append((phrase[:-1], E_DROP_SUFFIXES))
+    elif last == "y" and before not in VOWELS:
+        variants.append((phrase[:-1] + "i", Y_TO_I_SUFFIXES))
+    elif last not in VOWELS + "wxy" and before in VOWELS and phrase[-3] not in VOWELS:
+        variants.append((phrase + last, DOUBLED_CONSONANT_SUFFIXES))
+    return variants
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton mapping keyword phrases to routing categories"""
+
+    def __init__(self, word_boundaries=False):
+        # With word_boundaries set, a phrase only matches as a whole word
+        # (or an inflection of one), so "hi" no longer fires inside "this"
+        self.word_boundaries = word_boundaries
+        # Node 0 is the root; each node has goto transitions, a failure link
+        # and an entry for every keyword form that ends at that node
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._built = False
+        self.phrase_count = 0
+
+    def _insert(self, form, entry):
+        """Add one spelling of a keyword to the trie"""
+        node = 0
+        for char in form:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(entry)
+
+    def add(self, phrase, *categories, word_boundaries=None):
+        """Register a phrase under one or more categories
+
+        word_boundaries overrides the automaton default for this phrase, so a
+        recall-sensitive list can keep plain substring matching.
+        """
+        phrase = phrase.lower()
+        if not phrase:
+            return
+        if word_boundaries is None:
+            word_boundaries = self.word_boundaries
+        # Entries are (phrase, category, matched length, word boundaries,
+        # accepted endings, whether the bare form is a match on its own)
+        suffixes = INFLECTION_SUFFIXES if len(phrase) >= MIN_INFLECTED_LENGTH else ()
+        for category in categories:
+            self._insert(phrase, (phrase, category, len(phrase), word_boundaries, suffixes, True))
+        if word_boundaries:
+            for stem, stem_suffixes in stem_variants(phrase):
+                for category in categories:
+                    self._insert(stem, (phrase, category, len(stem), True, stem_suffixes, False))
+        self.phrase_count += 1
+        self._built = False
+
+    def add_many(self, phrases, *categories, word_boundaries=None):
+        """Register every phrase in a keyword list under the same categories"""
+        for phrase in phrases:
+            self.add(phrase, *categories, word_boundaries=word_boundaries)
+
+    def build(self):
+        """Compute failure links; called automatically before the first search"""
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                # Inherit matches of the longest proper suffix so a search
+                # only has to look at the current node's output list
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+        self._built = True
+        return self
+
+    def iter_matches(self, text):
+        """Yield (start, end, phrase, category) for every keyword occurrence in text"""
+        if not self._built:
+            self.build()
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        text = text.lower()
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for phrase, category, length, word_boundaries, suffixes, bare in output[node]:
+                start = index - length + 1
+                end = index + 1
+                if word_boundaries and not self._on_word_boundary(text, start, end, suffixes, bare):
+                    continue
+                yield start, end, phrase, category
+
+    @staticmethod
+    def _on_word_boundary(text, start, end, suffixes, bare):
+        """Check that text[start:end] starts a word and ends it, alone or with an accepted ending"""
+        if start > 0 and is_word_char(text[start - 1]) and is_word_char(text[start]):
+            return False
+        if end == len(text) or not is_word_char(text[end]) or not is_word_char(text[end - 1]):
+            return bare
+        word_end = end
+        while word_end < len(text) and is_word_char(text[word_end]):
+            word_end += 1
+        return text[end:word_end] in suffixes
+
+    def find(self, text):
+        """Return {category: [matched phrases]} for a single pass over text"""
+        matches = {}
+        for _, _, phrase, category in self.iter_matches(text):
+            phrases = matches.setdefault(category, [])
+            if phrase not in phrases:
+                phrases.append(phrase)
+        return matches
+
+
+def compile_keyword_lists(keyword_lists, word_boundaries=False):
+    """Build an automaton from a {category: [phrases]} mapping"""
+    automaton = KeywordAutomaton(word_boundaries=word_boundaries)
+    for category, phrases in keyword_lists.items():
+        automaton.add_many(phrases, category)
+    return automaton.build()
+
+
+def bigrams(term):
+    """Adjacent character pairs of a term"""
+    return [term[index:index + 2] for index in range(len(term) - 1)]
+
+
+class FuzzyIndex:
+    """Bigram inverted index answering difflib ratio queries without comparing every term
+
+    query() returns exactly the terms whose SequenceMatcher ratio against the
+    word reaches the threshold. Terms are bucketed by length and only buckets
+    that can reach the threshold are considered; inside a bucket, the bigram
+    postings rule out terms that share too few bigrams before the exact
+    SequenceMatcher check runs.
+    """
+
+    def __init__(self, terms):
+        self.terms = list(dict.fromkeys(terms))
+        self._by_length = {}
+        self._postings = {}
+        for term_id, term in enumerate(self.terms):
+            self._by_length.setdefault(len(term), []).append(term_id)
+            for gram, count in Counter(bigrams(term)).items():
+                self._postings.setdefault(gram, []).append((term_id, count))
+
+    def _shared_bigrams(self, word):
+        """Count bigrams each indexed term shares with word"""
+        shared = {}
+        for gram, word_count in Counter(bigrams(word)).items():
+            for term_id, term_count in self._postings.get(gram, ()):
+                shared[term_id] = shared.get(term_id, 0) + min(word_count, term_count)
+        return shared
+
+    def query(self, word, threshold=0.8):
+        """Return indexed terms with SequenceMatcher(None, term, word).ratio() >= threshold"""
+        word_length = len(word)
+        shared = None
+        matches = []
+        for term_length, term_ids in self._by_length.items():
+            total = word_length + term_length
+            if total == 0 or 2.0 * min(word_length, term_length) / total < threshold:
+                continue
+
+            # Fewest matched characters that can reach the threshold
+            min_matched = max(0, int(threshold * total / 2) - 1)
+            while 2.0 * min_matched / total < threshold:
+                min_matched += 1
+
+            # Matching blocks are separated by at least one unmatched character
+            # in one of the strings, and a block of k characters shares k - 1
+            # bigrams, so the pair shares at least this many bigrams
+            min_shared = 3 * min_matched - total - 1
+            if min_shared >= 1:
+                if shared is None:
+                    shared = self._shared_bigrams(word)
+                candidates = [term_id for term_id in term_ids if shared.get(term_id, 0) >= min_shared]
+            else:
+                candidates = term_ids
+
+            for term_id in candidates:
+                term = self.terms[term_id]
+                if difflib.SequenceMatcher(None, term, word).ratio() >= threshold:
+                    matches.append(term)
+        return matches
@@ -0,0 +1,156 @@
+"""
+LLM providers for the chatbot.
+generate_response talks to whichever provider LLM_PROVIDER selects: Gemini in
+production, or a local fake with configurable latency, jitter, error rate and
+streaming for tests and offline load benchmarks.
+"""
+
+import asyncio
+import os
+import random
+import time
+import zlib
+
+import google.generativeai as genai
+
+
+class LLMError(Exception):
+    """Raised by a provider when a generation request fails"""
+
+
+class GeminiProvider:
+    """Google Gemini through google.generativeai"""
+
+    name = "gemini"
+
+    def __init__(self, model_name="gemini-pro", api_key=None):
+        genai.configure(api_key=api_key or os.getenv('GOOGLE_API_KEY'))
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        """Complete reply text for a prompt"""
+        return self.model.generate_content(prompt).text
+
+    async def generate_async(self, prompt):
+        """Complete reply text for a prompt, awaiting the model on the event loop"""
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+    async def stream_async(self, prompt):
+        """Yield reply text chunks as the model produces them"""
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+FAKE_SENTENCES = [
+    "That sounds like a lot to carry, and it makes sense that you feel this way.",
+    "Thanks for telling me about it - it takes something to put feelings into words.",
+    "One small thing that often helps is a slow breath in for four counts and out for six.",
+    "You don't have to sort everything out today; picking one tiny next step is enough.",
+    "It might help to notice what your body is telling you right now, without judging it.",
+    "A short walk, a glass of water or a few minutes away from the screen can reset things a little.",
+    "Is there someone you trust who you could share a bit of this with this week?",
+    "I'm here to keep talking whenever you want to - what feels most pressing right now?",
+]
+
+
+class FakeProvider:
+    """Deterministic local stand-in for an LLM
+
+    Replies are built from FAKE_SENTENCES, picked by a hash of the prompt, so
+    the same prompt always gets the same reply. Each call waits latency
+    seconds, plus or minus up to jitter, before the first chunk, then
+    chunk_delay between chunks of chunk_words words. A share of calls given by
+    error_rate fails with LLMError after the wait, and a share given by
+    slow_rate takes slow_latency seconds longer, for a long latency tail.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=0.8, jitter=0.2, error_rate=0.0, chunk_delay=0.05,
+                 chunk_words=8, reply_words=160, slow_rate=0.0, slow_latency=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.reply_words = reply_words
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    def reply_for(self, prompt):
+        """The reply this provider gives for a prompt"""
+        start = zlib.crc32(prompt.encode("utf-8"))
+        words = []
+        index = 0
+        while len(words) < self.reply_words:
+            words.extend(FAKE_SENTENCES[(start + index) % len(FAKE_SENTENCES)].split())
+            index += 1
+        return " ".join(words[:self.reply_words])
+
+    def _chunks(self, prompt):
+        """Reply split into chunk_words-word pieces that join back to the reply"""
+        words = self.reply_for(prompt).split(" ")
+        return [" ".join(words[index:index + self.chunk_words]) + " "
+                for index in range(0, len(words), self.chunk_words)]
+
+    def _plan_call(self):
+        """Latency for one call, with jitter, and whether the call fails"""
+        self.calls += 1
+        delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            delay += self.slow_latency
+        return delay, self._random.random() < self.error_rate
+
+    def generate(self, prompt):
+        """Complete reply text for a prompt, blocking for the simulated latency"""
+        chunks = self._chunks(prompt)
+        delay, fails = self._plan_call()
+        time.sleep(delay + self.chunk_delay * (len(chunks) - 1))
+        if fails:
+            raise LLMError("fake provider error")
+        return "".join(chunks)
+
+    async def generate_async(self, prompt):
+        """Complete reply text for a prompt, sleeping on the event loop"""
+        chunks = self._chunks(prompt)
+        delay, fails = self._plan_call()
+        await asyncio.sleep(delay + self.chunk_delay * (len(chunks) - 1))
+        if fails:
+            raise LLMError("fake provider error")
+        return "".join(chunks)
+
+    async def stream_async(self, prompt):
+        """Yield reply chunks with the simulated first-chunk latency and chunk spacing"""
+        chunks = self._chunks(prompt)
+        delay, fails = self._plan_call()
+        await asyncio.sleep(delay)
+        if fails:
+            raise LLMError("fake provider error")
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(self.chunk_delay)
+            yield chunk
+
+
+def get_provider(name=None):
+    """Build the provider named by name or the LLM_PROVIDER environment variable"""
+    name = (name or os.getenv('LLM_PROVIDER', 'gemini')).lower()
+    if name == "gemini":
+        return GeminiProvider(os.getenv('GEMINI_MODEL', 'gemini-pro'))
+    if name == "fake":
+        seed = os.getenv('FAKE_LLM_SEED')
+        return FakeProvider(
+            latency=float(os.getenv('FAKE_LLM_LATENCY', '0.8')),
+            jitter=float(os.getenv('FAKE_LLM_JITTER', '0.2')),
+            error_rate=float(os.getenv('FAKE_LLM_ERROR_RATE', '0')),
+            chunk_delay=float(os.getenv('FAKE_LLM_CHUNK_DELAY', '0.05')),
+            slow_rate=float(os.getenv('FAKE_LLM_SLOW_RATE', '0')),
+            slow_latency=float(os.getenv('FAKE_LLM_SLOW_LATENCY', '0')),
+            seed=int(seed) if seed is not None else None,
+        )
+    raise ValueError(f"Unknown LLM_PROVIDER: {name}")
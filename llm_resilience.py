@@ -0,0 +1,347 @@
+"""
+Resilience helpers for LLM calls.
+A circuit breaker that stops calling the LLM while it keeps failing, so chat
+requests drop to the rule-based fallback at once instead of waiting for each
+call to fail, and a call policy that bounds each call with a deadline and can
+hedge slow calls with a second request.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit is open"""
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when the LLM has not answered within the call deadline"""
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker driven by a rolling failure rate
+
+    Closed: calls go through and their outcomes fill a window of the last
+    window_size calls. Once at least minimum_calls are in the window and the
+    share of failures reaches failure_rate_threshold, the circuit opens.
+    Open: calls fail fast with CircuitOpenError until probe_interval seconds
+    have passed. Half-open: a single probe call goes through; success closes
+    the circuit, failure opens it for another probe_interval.
+    """
+
+    def __init__(self, failure_rate_threshold=0.5, minimum_calls=5, window_size=20,
+                 probe_interval=30.0, clock=time.monotonic):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.probe_interval = probe_interval
+        self._clock = clock
+        self._outcomes = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        """Current state, moving an expired open circuit to half-open"""
+        with self._lock:
+            self._check_probe_due()
+            return self._state
+
+    def _check_probe_due(self):
+        """Move an open circuit to half-open once probe_interval has passed; caller holds the lock"""
+        if self._state == OPEN and self._clock() - self._opened_at >= self.probe_interval:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+
+    def _open(self):
+        """Open the circuit and start the probe interval; caller holds the lock"""
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self._probe_in_flight = False
+        self.times_opened += 1
+
+    def allow_request(self):
+        """Whether a call may go ahead now; a half-open circuit lets one probe through"""
+        with self._lock:
+            self._check_probe_due()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Count a successful call; a successful probe closes the circuit"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            elif self._state == CLOSED:
+                self._outcomes.append(False)
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit past the failure rate threshold"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+            elif self._state == CLOSED:
+                self._outcomes.append(True)
+                failures = sum(self._outcomes)
+                if len(self._outcomes) >= self.minimum_calls and failures / len(self._outcomes) >= self.failure_rate_threshold:
+                    self._open()
+
+    def release(self):
+        """Give back a half-open probe whose call ended without an outcome"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead"""
+        if not self.allow_request():
+            raise CircuitOpenError("LLM circuit is open")
+
+    def call(self, func, *args, **kwargs):
+        """Run func through the breaker, recording whether it raised"""
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) through the breaker"""
+        self._before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled: no verdict on the LLM either way
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+    async def stream(self, chunks):
+        """Pass an async iterator of chunks through the breaker
+
+        The stream counts as one call: a success once it is exhausted, a
+        failure if it raises part way.
+        """
+        self._before_call()
+        finished = False
+        try:
+            async for chunk in chunks:
+                yield chunk
+            finished = True
+        except Exception:
+            finished = True
+            self.record_failure()
+            raise
+        finally:
+            if not finished:
+                # The consumer stopped early; no verdict on the LLM either way
+                self.release()
+        self.record_success()
+
+    def status(self):
+        """State and counters, for status endpoints"""
+        with self._lock:
+            self._check_probe_due()
+            failures = sum(self._outcomes)
+            status = {
+                "state": self._state,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": failures,
+                "failure_rate": failures / len(self._outcomes) if self._outcomes else 0.0,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "retry_in": None,
+            }
+            if self._state == OPEN:
+                status["retry_in"] = max(0.0, self.probe_interval - (self._clock() - self._opened_at))
+            return status
+
+
+def breaker_from_environment():
+    """CircuitBreaker configured by the LLM_BREAKER_* environment variables"""
+    return CircuitBreaker(
+        failure_rate_threshold=float(os.getenv('LLM_BREAKER_FAILURE_RATE', '0.5')),
+        minimum_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', '5')),
+        window_size=int(os.getenv('LLM_BREAKER_WINDOW', '20')),
+        probe_interval=float(os.getenv('LLM_BREAKER_PROBE_INTERVAL', '30')),
+    )
+
+
+class LatencyHistogram:
+    """Bucketed latency counts plus a window of recent samples for percentiles"""
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, sample_size=1000):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._samples = deque(maxlen=sample_size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds):
+        """Add one latency measurement"""
+        with self._lock:
+            index = 0
+            while index < len(self.buckets) and seconds > self.buckets[index]:
+                index += 1
+            self._counts[index] += 1
+            self._samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, fraction):
+        """Latency below which fraction of the recent samples fall, or None without samples"""
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def snapshot(self):
+        """Bucket counts keyed by upper bound, with recent p50/p95/p99"""
+        with self._lock:
+            counts = list(self._counts)
+        labels = [f"<={bound:g}s" for bound in self.buckets] + [f">{self.buckets[-1]:g}s"]
+        return {
+            "count": self.count,
+            "buckets": dict(zip(labels, counts)),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class LLMCallPolicy:
+    """Deadline and optional hedging for async LLM calls
+
+    Each call gets deadline seconds (None for no limit) and raises
+    LLMDeadlineExceeded past it. With hedge_after set, a second identical
+    request starts if the first has not answered by then and whichever
+    answers first wins; hedge_after may be a number of seconds or "p95" to
+    hedge at the recent 95th percentile latency once min_samples calls have
+    been measured.
+    """
+
+    def __init__(self, deadline=None, hedge_after=None, min_samples=20, histogram=None):
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.histogram = histogram or LatencyHistogram()
+        self.calls = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging this call, or None not to hedge"""
+        if self.hedge_after == "p95":
+            if self.histogram.count < self.min_samples:
+                return None
+            return self.histogram.percentile(0.95)
+        return self.hedge_after
+
+    async def run(self, make_call):
+        """Await make_call() under the deadline, hedging with a second make_call() if slow"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline_at = started + self.deadline if self.deadline is not None else None
+        hedge_delay = self.hedge_delay()
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        if hedge_at is not None and deadline_at is not None and hedge_at >= deadline_at:
+            hedge_at = None
+        self.calls += 1
+
+        primary = asyncio.ensure_future(make_call())
+        pending = {primary}
+        error = None
+        try:
+            while pending:
+                wake_at = hedge_at if hedge_at is not None else deadline_at
+                timeout = max(0.0, wake_at - loop.time()) if wake_at is not None else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.histogram.record(loop.time() - started)
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if done:
+                    continue
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    self.hedges += 1
+                    pending.add(asyncio.ensure_future(make_call()))
+                    continue
+                self.timeouts += 1
+                raise LLMDeadlineExceeded(f"LLM did not answer within {self.deadline:g}s")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def first_chunk(self, chunks):
+        """Pass a stream through, bounding the wait for its first chunk by the deadline"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.calls += 1
+        iterator = chunks.__aiter__()
+        try:
+            first = await asyncio.wait_for(iterator.__anext__(), self.deadline)
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMDeadlineExceeded(f"LLM did not start answering within {self.deadline:g}s")
+        self.histogram.record(loop.time() - started)
+        yield first
+        async for chunk in iterator:
+            yield chunk
+
+    def status(self):
+        """Call counters and the latency histogram, for status endpoints"""
+        return {
+            "deadline": self.deadline,
+            "hedge_after": self.hedge_after,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency": self.histogram.snapshot(),
+        }
+
+
+def call_policy_from_environment():
+    """LLMCallPolicy configured by LLM_DEADLINE and LLM_HEDGE_AFTER"""
+    deadline = os.getenv('LLM_DEADLINE', '10')
+    hedge_after = os.getenv('LLM_HEDGE_AFTER', '')
+    if hedge_after and hedge_after != "p95":
+        hedge_after = float(hedge_after)
+    return LLMCallPolicy(
+        deadline=float(deadline) if deadline else None,
+        hedge_after=hedge_after or None,
+    )
@@ -2,13 +2,21 @@ import uvicorn
 from fastapi import FastAPI, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from database import SessionLocal, engine
-from models import User, MoodLog, ChatHistory, Base
-from chatbot import generate_response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects import postgresql, sqlite
+from database import AsyncSessionLocal, engine
+from models import User, MoodLog, ChatHistory, Feedback, Base
+from migrate_database import migrate_engine
+from chatbot import generate_response_async, stream_response_async, response_cache_stats, LLM_BREAKER, LLM_CALL_POLICY, PROMPT_STATS, SUMMARY_WORKER, HISTORY_BUFFER, CHAT_WRITER, USER_CACHE
+from health_knowledge import HEALTH_SEARCH_CACHE
+from user_cache import UserProfile
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from datetime import date
+import asyncio
 import csv
+import json
 from io import StringIO, BytesIO
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Table
 from reportlab.lib.styles import getSampleStyleSheet
@@ -17,12 +25,29 @@ from dotenv import load_dotenv
 import os
 
 load_dotenv()
- 
-Base.metadata.create_all(bind=engine)
+
+# Apply pending schema migrations at startup; set MIGRATE_ON_STARTUP=0 to run them from the CLI instead
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', '1') != '0'
+# Rows fetched per round trip by the streaming exports, which hold one batch in memory at a time
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '1000'))
 
 from fastapi.responses import FileResponse
 
-app = FastAPI()
+def init_database(bind):
+    """Create missing tables and bring the schema up to date"""
+    Base.metadata.create_all(bind=bind)
+    if MIGRATE_ON_STARTUP:
+        migrate_engine(bind)
+
+@asynccontextmanager
+async def lifespan(app):
+    # At startup rather than import, so importing the app touches no database
+    init_database(engine)
+    yield
+    # Write the exchanges still queued before the process exits
+    await asyncio.to_thread(CHAT_WRITER.stop)
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 @app.get("/")
@@ -37,12 +62,13 @@ def read_login():
 def read_index():
     return FileResponse("index.html")
 
-def get_db():
-    db = SessionLocal()
+async def get_async_db():
+    # Endpoints await their queries on the event loop instead of holding a threadpool worker
+    db = AsyncSessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
 
 class Login(BaseModel):
     username: str
@@ -61,78 +87,170 @@ class FeedbackData(BaseModel):
     feedback_text: str
     rating: int
 
+class LanguagePreference(BaseModel):
+    username: str
+    language: str
+
+def user_by_name(username):
+    """Statement selecting the user with this username"""
+    return select(User).where(User.username == username)
+
+async def find_user(db, username):
+    """The user's profile from USER_CACHE, reading the users table on a miss; None for an unknown user"""
+    profile = USER_CACHE.get(username)
+    if profile is None:
+        user = await db.scalar(user_by_name(username))
+        if user is not None:
+            profile = USER_CACHE.set(UserProfile.from_user(user))
+    return profile
+
 @app.post("/register")
-def register(data: Login, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == data.username).first():
+async def register(data: Login, db: AsyncSession = Depends(get_async_db)):
+    if await find_user(db, data.username):
         return {"error": "User already exists"}
     db.add(User(username=data.username, password=data.password))
-    db.commit()
+    await db.commit()
+    USER_CACHE.invalidate(data.username)
     return {"message": "Registered successfully"}
 
 @app.post("/login")
-def login(data: Login, db: Session = Depends(get_db)):
-    user = db.query(User).filter(
+async def login(data: Login, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(
         User.username == data.username,
         User.password == data.password
-    ).first()
+    ))
     if not user:
         return {"error": "Invalid credentials"}
+    USER_CACHE.set(UserProfile.from_user(user))
     return {"message": "Login success", "role": user.role}
 
-@app.post("/mood")
-def save_mood(data: Mood, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data.username).first()
-    today = date.today()
-
-    record = db.query(MoodLog).filter(
-        MoodLog.user_id == user.id,
-        MoodLog.log_date == today
-    ).first()
-
+@app.post("/language")
+async def set_language(data: LanguagePreference, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(update(User).where(User.username == data.username).values(language=data.language))
+    await db.commit()
+    if not result.rowcount:
+        return {"error": "User not found"}
+    USER_CACHE.invalidate(data.username)
+    return {"message": "Language saved"}
+
+async def upsert_mood(db, user_id, mood, log_date):
+    """Insert or replace a user's mood for a day, in one statement where the database supports it"""
+    dialect = db.bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        statement = insert(MoodLog).values(user_id=user_id, mood=mood, log_date=log_date)
+        await db.execute(statement.on_conflict_do_update(index_elements=["user_id", "log_date"], set_={"mood": mood}))
+        return
+
+    record = await db.scalar(select(MoodLog).where(
+        MoodLog.user_id == user_id,
+        MoodLog.log_date == log_date
+    ))
     if record:
-        record.mood = data.mood
+        record.mood = mood
     else:
-        db.add(MoodLog(user_id=user.id, mood=data.mood))
+        db.add(MoodLog(user_id=user_id, mood=mood, log_date=log_date))
 
-    db.commit()
+@app.post("/mood")
+async def save_mood(data: Mood, db: AsyncSession = Depends(get_async_db)):
+    user = await find_user(db, data.username)
+    await upsert_mood(db, user.id, data.mood, date.today())
+    await db.commit()
     return {"message": "Mood saved"}
 
 @app.get("/moods/{username}")
-def mood_history(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
-    moods = db.query(MoodLog).filter(
+async def mood_history(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await find_user(db, username)
+    moods = await db.scalars(select(MoodLog).where(
         MoodLog.user_id == user.id
-    ).order_by(MoodLog.log_date).all()
+    ).order_by(MoodLog.log_date))
     return [{"date": m.log_date, "mood": m.mood} for m in moods]
 
 @app.post("/chat")
-def chat(data: Chat, db: Session = Depends(get_db)):
-    return {"reply": generate_response(data.username, data.message, db)}
+async def chat(data: Chat):
+    # Async so a slow Gemini reply waits on the event loop instead of
+    # holding a threadpool worker and a database session
+    return {"reply": await generate_response_async(data.username, data.message)}
+
+def sse_event(data, event=None):
+    """Encode one server-sent event; data is sent as JSON so newlines survive"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(data: Chat):
+    async def events():
+        async for chunk in stream_response_async(data.username, data.message):
+            yield sse_event({"text": chunk})
+        yield sse_event({}, event="done")
 
-@app.get("/export/csv/{username}")
-def export_csv(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
-    moods = db.query(MoodLog).filter(MoodLog.user_id == user.id).all()
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def stream_rows(statement):
+    """Yield the rows of statement in lists of EXPORT_BATCH_ROWS, read from a server-side cursor
 
+    Runs in a session of its own, which stays open while the response streams.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        async for rows in result.partitions():
+            yield rows
+
+async def csv_chunks(header, batches):
+    """CSV text for header and each batch of rows, one chunk per batch"""
     output = StringIO()
     writer = csv.writer(output)
-    writer.writerow(["Date", "Mood"])
-    for m in moods:
-        writer.writerow([m.log_date, m.mood])
-    output.seek(0)
+    writer.writerow(header)
+    yield output.getvalue()
+    async for rows in batches:
+        output.seek(0)
+        output.truncate()
+        writer.writerows(rows)
+        yield output.getvalue()
+
+async def ndjson_chunks(fields, batches):
+    """One JSON object per row and line, one chunk per batch of rows"""
+    async for rows in batches:
+        yield "".join(json.dumps(dict(zip(fields, row)), default=str) + "\n" for row in rows)
+
+@app.get("/export/csv/{username}")
+async def export_csv(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await find_user(db, username)
+    moods = select(MoodLog.log_date, MoodLog.mood).where(MoodLog.user_id == user.id).order_by(MoodLog.log_date)
 
     return StreamingResponse(
-        output,
+        csv_chunks(["Date", "Mood"], stream_rows(moods)),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={username}_mood.csv"}
     )
 
-@app.get("/export/pdf/{username}")
-def export_pdf(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
-    moods = db.query(MoodLog).filter(MoodLog.user_id == user.id).order_by(MoodLog.log_date).all()
-    chats = db.query(ChatHistory).filter(ChatHistory.user_id == user.id).order_by(ChatHistory.timestamp).all()
+@app.get("/export/chats/{username}")
+async def export_chats(username: str, format: str = "csv", db: AsyncSession = Depends(get_async_db)):
+    if format not in ("csv", "ndjson"):
+        return {"error": "Format must be csv or ndjson"}
+    user = await find_user(db, username)
+    if not user:
+        return {"error": "User not found"}
+    chats = select(ChatHistory.timestamp, ChatHistory.user_message, ChatHistory.bot_response).where(
+        ChatHistory.user_id == user.id
+    ).order_by(ChatHistory.timestamp, ChatHistory.id)
 
+    if format == "csv":
+        chunks, media_type = csv_chunks(["Date/Time", "User Message", "Bot Response"], stream_rows(chats)), "text/csv"
+    else:
+        chunks, media_type = ndjson_chunks(["timestamp", "user_message", "bot_response"], stream_rows(chats)), "application/x-ndjson"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={username}_chats.{format}"}
+    )
+
+def build_pdf_report(username, moods, chats):
+    """Render the wellbeing report PDF into a BytesIO"""
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
     styles = getSampleStyleSheet()
@@ -173,6 +291,15 @@ def export_pdf(username: str, db: Session = Depends(get_db)):
 
     doc.build(elements)
     buffer.seek(0)
+    return buffer
+
+@app.get("/export/pdf/{username}")
+async def export_pdf(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await find_user(db, username)
+    moods = (await db.scalars(select(MoodLog).where(MoodLog.user_id == user.id).order_by(MoodLog.log_date))).all()
+    chats = (await db.scalars(select(ChatHistory).where(ChatHistory.user_id == user.id).order_by(ChatHistory.timestamp))).all()
+    # Laying out the PDF is CPU work, so it runs off the event loop
+    buffer = await asyncio.to_thread(build_pdf_report, username, moods, chats)
 
     return StreamingResponse(
         buffer,
@@ -180,22 +307,38 @@ def export_pdf(username: str, db: Session = Depends(get_db)):
         headers={"Content-Disposition": f"attachment; filename={username}_wellbeing_report.pdf"}
     )
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "response_cache": response_cache_stats(),
+        "health_search_cache": HEALTH_SEARCH_CACHE.stats(),
+        "prompt": PROMPT_STATS.snapshot(),
+        "summaries": SUMMARY_WORKER.stats(),
+        "history_buffer": HISTORY_BUFFER.stats(),
+        "chat_writes": CHAT_WRITER.stats(),
+        "user_cache": USER_CACHE.stats(),
+    }
+
+@app.get("/status/llm")
+def llm_status():
+    return {"circuit": LLM_BREAKER.status(), "calls": LLM_CALL_POLICY.status()}
+
 @app.get("/dashboard")
 def dashboard():
     return FileResponse("static/dashboard.html")
 
 @app.get("/users")
-def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+async def get_users(db: AsyncSession = Depends(get_async_db)):
+    users = await db.scalars(select(User))
     return [{"username": u.username, "role": u.role} for u in users]
 
 @app.post("/feedback")
-def submit_feedback(data: FeedbackData, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data.username).first()
+async def submit_feedback(data: FeedbackData, db: AsyncSession = Depends(get_async_db)):
+    user = await find_user(db, data.username)
     if not user:
         return {"error": "User not found"}
     db.add(Feedback(user_id=user.id, feedback_text=data.feedback_text, rating=data.rating))
-    db.commit()
+    await db.commit()
     return {"message": "Feedback submitted successfully"}
 
 @app.get("/doctors")
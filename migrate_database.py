@@ -1,79 +1,274 @@
 #!/usr/bin/env python3
 """
-Database migration script to add missing columns to existing database.
-This script handles schema updates for the Wellbeing Chatbot database.
+Versioned schema migrations for the Wellbeing Chatbot SQLite database.
+Each migration runs once, in order, and is recorded in the schema_version
+table. Steps check the schema before changing it, so they are safe on both
+old databases and fresh ones created by create_all. Large tables are copied
+and backfilled in batches of short transactions, so the app can keep
+writing while a migration runs.
+
+Usage: python migrate_database.py [db_path] [--batch-size N] [--status]
 """
 
-import sqlite3
+import argparse
 import os
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import Base
+
+BATCH_SIZE = 5000
+# Tables that only ever get new rows, so a batched copy can catch up on late inserts by id
+APPEND_ONLY_TABLES = {"chat_history", "feedback"}
+
+
+def compile_ddl(element):
+    return str(element.compile(dialect=sqlite_dialect.dialect()))
+
+
+def table_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def column_names(cursor, table_name):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def unique_constraints(table):
+    return [c for c in table.constraints if isinstance(c, UniqueConstraint)]
+
+
+def needs_rebuild(cursor, table):
+    """Whether an existing table lacks a foreign key or unique constraint its model declares"""
+    cursor.execute(f"PRAGMA foreign_key_list({table.name})")
+    has_foreign_keys = bool(cursor.fetchall())
+    cursor.execute(f"PRAGMA index_list({table.name})")
+    # Columns: seq, name, unique, origin, partial; origin 'u' marks a UNIQUE constraint
+    existing_unique = [row for row in cursor.fetchall() if row[3] == 'u']
+    return (bool(table.foreign_keys) and not has_foreign_keys) or len(existing_unique) < len(unique_constraints(table))
+
+
+def backfill(conn, table_name, assignments, condition, batch_size=BATCH_SIZE):
+    """UPDATE table_name SET assignments WHERE condition, batch_size rows per transaction
+
+    Returns the number of rows updated.
+    """
+    cursor = conn.cursor()
+    updated = 0
+    while True:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            f"UPDATE {table_name} SET {assignments} WHERE rowid IN "
+            f"(SELECT rowid FROM {table_name} WHERE {condition} LIMIT ?)",
+            (batch_size,)
+        )
+        count = cursor.rowcount
+        cursor.execute("COMMIT")
+        updated += count
+        if count < batch_size:
+            return updated
+
+
+def rebuild_table(conn, table, batch_size=BATCH_SIZE):
+    """Recreate a table from its model, since SQLite cannot add constraints in place
+
+    Rows are copied into a new table and the new table is swapped in. Append-only
+    tables are copied in batches by id, and a final short transaction copies
+    rows inserted meanwhile. Other tables are copied in that final transaction,
+    keeping only the newest row of any duplicates under a unique constraint.
+    Returns the number of duplicate rows dropped.
+    """
+    cursor = conn.cursor()
+    new_name = f"{table.name}_rebuild"
+    old_columns = set(column_names(cursor, table.name))
+    columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in old_columns)
+
+    # A leftover copy means an earlier run stopped part way; start the copy again
+    cursor.execute(f"DROP TABLE IF EXISTS {new_name}")
+    ddl = compile_ddl(CreateTable(table))
+    cursor.execute(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1))
+
+    copied_through = 0
+    if table.name in APPEND_ONLY_TABLES:
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name} "
+                f"WHERE id > ? ORDER BY id LIMIT ?",
+                (copied_through, batch_size)
+            )
+            count = cursor.rowcount
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {new_name}")
+            copied_through = cursor.fetchone()[0]
+            cursor.execute("COMMIT")
+            if count < batch_size:
+                break
+
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {table.name} WHERE id > ?", (copied_through,))
+        remaining = cursor.fetchone()[0]
+        select = f"SELECT {columns} FROM {table.name} WHERE id > ?"
+        for constraint in unique_constraints(table):
+            group = ", ".join(column.name for column in constraint.columns)
+            select += f" AND id IN (SELECT MAX(id) FROM {table.name} GROUP BY {group})"
+        cursor.execute(f"INSERT INTO {new_name} ({columns}) {select}", (copied_through,))
+        dropped = remaining - cursor.rowcount
+        cursor.execute(f"DROP TABLE {table.name}")
+        cursor.execute(f"ALTER TABLE {new_name} RENAME TO {table.name}")
+        cursor.execute("COMMIT")
+    except sqlite3.Error:
+        cursor.execute("ROLLBACK")
+        raise
+    return dropped
+
+
+# Migration steps, in order
+
+def add_user_language(conn, batch_size):
+    cursor = conn.cursor()
+    if table_exists(cursor, "users") and 'language' not in column_names(cursor, "users"):
+        cursor.execute("ALTER TABLE users ADD COLUMN language TEXT DEFAULT 'en'")
 
-def migrate_database():
-    """Add missing columns to existing database tables."""
 
-    db_path = 'wellbeing.db'
+def backfill_user_language(conn, batch_size):
+    if table_exists(conn.cursor(), "users"):
+        updated = backfill(conn, "users", "language = 'en'", "language IS NULL", batch_size)
+        if updated:
+            print(f"   Set language to 'en' for {updated} users")
 
+
+def add_constraints(conn, batch_size):
+    cursor = conn.cursor()
+    for table in Base.metadata.sorted_tables:
+        if table_exists(cursor, table.name) and needs_rebuild(cursor, table):
+            print(f"   Rebuilding {table.name} with its foreign keys and constraints")
+            dropped = rebuild_table(conn, table, batch_size)
+            if dropped:
+                print(f"   ⚠️  Dropped {dropped} duplicate rows from {table.name}, keeping the newest")
+    cursor.execute("PRAGMA foreign_key_check")
+    orphans = cursor.fetchall()
+    if orphans:
+        print(f"   ⚠️  Warning: {len(orphans)} rows reference users that do not exist")
+
+
+def add_indexes(conn, batch_size):
+    # An index is built in one statement; SQLite has no online index build
+    cursor = conn.cursor()
+    for table in Base.metadata.sorted_tables:
+        if table_exists(cursor, table.name):
+            for index in table.indexes:
+                cursor.execute(compile_ddl(CreateIndex(index, if_not_exists=True)))
+
+
+MIGRATIONS = [
+    (1, "add users.language", add_user_language),
+    (2, "backfill missing user languages", backfill_user_language),
+    (3, "foreign keys and one mood per user per day", add_constraints),
+    (4, "indexes on user_id lookups", add_indexes),
+]
+
+
+def ensure_version_table(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR, applied_at DATETIME)"
+    )
+
+
+def current_version(conn):
+    """Highest applied migration version, 0 for a database never migrated"""
+    if not table_exists(conn.cursor(), "schema_version"):
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def migrate(conn, batch_size=BATCH_SIZE):
+    """Apply pending migrations to an open sqlite3 connection; returns the versions applied"""
+    # Transactions are managed explicitly so batches commit one by one
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    # Table rebuilds need foreign key enforcement off, which only changes outside a transaction
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    applied = []
+    try:
+        ensure_version_table(conn)
+        for version, description, step in pending_migrations(conn):
+            print(f"Applying migration {version}: {description}")
+            step(conn, batch_size)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.utcnow().isoformat(" "))
+            )
+            applied.append(version)
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def migrate_database(db_path='wellbeing.db', batch_size=BATCH_SIZE):
+    """Bring the database file at db_path up to the latest schema version"""
     if not os.path.exists(db_path):
         print("Database file not found. No migration needed.")
-        return
+        return []
 
+    conn = sqlite3.connect(db_path)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Check if language column exists in users table
-        cursor.execute("PRAGMA table_info(users)")
-        columns = cursor.fetchall()
-        column_names = [col[1] for col in columns]
-
-        if 'language' not in column_names:
-            print("Adding 'language' column to users table...")
-            cursor.execute("ALTER TABLE users ADD COLUMN language TEXT DEFAULT 'en'")
-            print("✅ Added language column to users table")
-        else:
-            print("✅ Language column already exists in users table")
-
-        # Check if other tables need updates
-        # Check mood_logs table structure
-        cursor.execute("PRAGMA table_info(mood_logs)")
-        mood_columns = cursor.fetchall()
-        mood_column_names = [col[1] for col in mood_columns]
-
-        # Ensure mood_logs has proper structure
-        if 'user_id' not in mood_column_names:
-            print("⚠️  Warning: mood_logs table might need user_id column")
-        else:
-            print("✅ mood_logs table structure looks good")
-
-        # Check chat_history table
-        cursor.execute("PRAGMA table_info(chat_history)")
-        chat_columns = cursor.fetchall()
-        chat_column_names = [col[1] for col in chat_columns]
-
-        if 'user_id' not in chat_column_names:
-            print("⚠️  Warning: chat_history table might need user_id column")
-        else:
-            print("✅ chat_history table structure looks good")
-
-        # Check feedback table
-        cursor.execute("PRAGMA table_info(feedback)")
-        feedback_columns = cursor.fetchall()
-        feedback_column_names = [col[1] for col in feedback_columns]
-
-        if 'user_id' not in feedback_column_names:
-            print("⚠️  Warning: feedback table might need user_id column")
-        else:
-            print("✅ feedback table structure looks good")
-
-        conn.commit()
-        print("\n🎉 Database migration completed successfully!")
-
+        applied = migrate(conn, batch_size)
+        if applied:
+            print(f"🎉 Database migrated to version {applied[-1]}")
+        return applied
     except sqlite3.Error as e:
         print(f"❌ Database migration failed: {e}")
-        conn.rollback()
+        raise
     finally:
-        if conn:
+        conn.close()
+
+
+def migrate_engine(engine):
+    """Run pending migrations for a SQLAlchemy engine's SQLite file, e.g. at startup"""
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return []
+    return migrate_database(engine.url.database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("db_path", nargs="?", default="wellbeing.db")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="rows per transaction when copying or backfilling large tables")
+    parser.add_argument("--status", action="store_true", help="show the schema version and pending migrations")
+    args = parser.parse_args()
+
+    if args.status:
+        if not os.path.exists(args.db_path):
+            print("Database file not found.")
+            return
+        conn = sqlite3.connect(args.db_path)
+        try:
+            print(f"Schema version: {current_version(conn)}")
+            for version, description, _ in pending_migrations(conn):
+                print(f"Pending {version}: {description}")
+        finally:
             conn.close()
+        return
 
-if __name__ == "__main__":
     print("Starting database migration...")
-    migrate_database()
+    migrate_database(args.db_path, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Index, UniqueConstraint
 from database import Base
 from datetime import date, datetime
 
@@ -12,23 +12,35 @@ class User(Base):
 
 class MoodLog(Base):
     __tablename__ = "moods"
+    # One mood per user per day; the unique index also serves user_id lookups
+    __table_args__ = (UniqueConstraint("user_id", "log_date", name="uq_moods_user_date"),)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer)
+    user_id = Column(Integer, ForeignKey("users.id"))
     mood = Column(String)
     log_date = Column(Date, default=date.today)
 
 class ChatHistory(Base):
     __tablename__ = "chat_history"
+    # Recent history and exports read one user's rows in timestamp order
+    __table_args__ = (Index("ix_chat_history_user_timestamp", "user_id", "timestamp"),)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer)
+    user_id = Column(Integer, ForeignKey("users.id"))
     user_message = Column(String)
     bot_response = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True)
+    summary = Column(String)
+    summarized_through = Column(Integer, default=0)  # id of the last ChatHistory row folded in
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class Feedback(Base):
     __tablename__ = "feedback"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     feedback_text = Column(String)
     rating = Column(Integer)  # 1-5 scale
     timestamp = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,120 @@
+"""
+Token-budgeted conversation history for LLM prompts.
+Fits recent exchanges into a token budget, newest first: a reply repeated
+later in the conversation is collapsed to a short marker, long turns are cut
+short and the oldest exchanges are dropped once the budget is spent.
+"""
+
+import threading
+
+# Rough size of a token in English text, close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+REPEATED_REPLY = "[same reply as later in the conversation]"
+TRUNCATED_MARK = " [...]"
+
+
+def estimate_tokens(text):
+    """Approximate token count of text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text, limit):
+    """Cut text to about limit tokens at a word boundary; returns (text, truncated)"""
+    if estimate_tokens(text) <= limit:
+        return text, False
+    cut = text[:max(0, limit * CHARS_PER_TOKEN - len(TRUNCATED_MARK))]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut + TRUNCATED_MARK, True
+
+
+def format_history_line(message):
+    """A history message as it appears in the prompt"""
+    return f"{message['role']}: {message['content']}\n"
+
+
+def group_exchanges(conversation_history):
+    """Split history into exchanges, each a user message and the replies after it"""
+    exchanges = []
+    for message in conversation_history:
+        if message["role"] == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(message)
+    return exchanges
+
+
+def build_history_window(conversation_history, token_budget, turn_token_limit):
+    """Fit conversation history into token_budget tokens of prompt
+
+    Returns (messages, stats): the kept messages oldest first, and counts of
+    kept and dropped exchanges, truncated turns, collapsed repeated replies
+    and the history tokens used.
+    """
+    stats = {"exchanges": 0, "dropped": 0, "truncated": 0, "deduplicated": 0, "tokens": 0}
+    exchanges = group_exchanges(conversation_history)
+    seen_replies = set()
+    kept = []
+    for position, exchange in enumerate(reversed(exchanges)):
+        fitted = []
+        truncated = deduplicated = 0
+        for message in exchange:
+            content = message["content"]
+            if message["role"] == "assistant":
+                key = " ".join(content.split())
+                if key in seen_replies:
+                    content = REPEATED_REPLY
+                    deduplicated += 1
+                else:
+                    seen_replies.add(key)
+            content, was_truncated = truncate_to_tokens(content, turn_token_limit)
+            truncated += was_truncated
+            fitted.append(dict(message, content=content))
+        cost = sum(estimate_tokens(format_history_line(message)) for message in fitted)
+        if stats["tokens"] + cost > token_budget:
+            stats["dropped"] = len(exchanges) - position
+            break
+        kept.append(fitted)
+        stats["tokens"] += cost
+        stats["exchanges"] += 1
+        stats["truncated"] += truncated
+        stats["deduplicated"] += deduplicated
+    return [message for exchange in reversed(kept) for message in exchange], stats
+
+
+class PromptStats:
+    """Running prompt size figures for the LLM requests actually sent"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.last_tokens = 0
+        self.dropped = 0
+        self.truncated = 0
+        self.deduplicated = 0
+
+    def record(self, prompt_tokens, window=None):
+        """Count one prompt and, if given, the history window stats it was built with"""
+        with self._lock:
+            self.requests += 1
+            self.total_tokens += prompt_tokens
+            self.max_tokens = max(self.max_tokens, prompt_tokens)
+            self.last_tokens = prompt_tokens
+            if window:
+                self.dropped += window["dropped"]
+                self.truncated += window["truncated"]
+                self.deduplicated += window["deduplicated"]
+
+    def snapshot(self):
+        """Prompt size figures, for status endpoints"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "last_tokens": self.last_tokens,
+                "average_tokens": self.total_tokens / self.requests if self.requests else 0.0,
+                "max_tokens": self.max_tokens,
+                "dropped_exchanges": self.dropped,
+                "truncated_turns": self.truncated,
+                "deduplicated_replies": self.deduplicated,
+            }
@@ -144,19 +144,16 @@ def test_no_interference():
 
         # Test health query (should not be greeting/routine)
         health_msg = "symptoms of depression"
-        # Mock the Gemini API call
+        # Use the local fake LLM instead of calling Gemini
         import chatbot
-        original_genai = chatbot.genai
-        chatbot.genai = type('MockGenai', (), {
-            'GenerativeModel': lambda self, model: type('MockModel', (), {
-                'generate_content': lambda self, prompt: type('MockResponse', (), {'text': 'Mock health response about depression'})()
-            })()
-        })()
+        from llm_providers import FakeProvider
+        original_provider = chatbot.llm_provider
+        chatbot.llm_provider = FakeProvider(latency=0, jitter=0, chunk_delay=0)
 
         response = generate_response("test_user", health_msg, db_session)
 
         # Restore original
-        chatbot.genai = original_genai
+        chatbot.llm_provider = original_provider
 
         if "depression" not in response.lower():
             print("❌ FAIL: Health query not working properly")
@@ -23,16 +23,39 @@ async function sendMessage() {
 
     document.getElementById("chat-box").innerHTML += `<div class="message user-message"><div class="message-content">${msg}</div></div>`;
 
-    const res = await fetch("/chat", {
+    document.getElementById("user-input").value = ""; // Clear input after sending
+
+    const res = await fetch("/chat/stream", {
         method: "POST",
         headers: {"Content-Type": "application/json"},
         body: JSON.stringify({ username, message: msg })
     });
-    const data = await res.json();
-    document.getElementById("chat-box").innerHTML += `<div class="message bot-message"><div class="message-content">${data.reply}</div></div>`;
 
-    document.getElementById("user-input").value = ""; // Clear input after sending
-    document.getElementById("chat-box").scrollTop = document.getElementById("chat-box").scrollHeight; // Auto scroll to bottom
+    // Show the reply as it streams in, one server-sent event at a time
+    const chatBox = document.getElementById("chat-box");
+    chatBox.innerHTML += `<div class="message bot-message"><div class="message-content"></div></div>`;
+    const content = chatBox.lastElementChild.querySelector(".message-content");
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let reply = "";
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop(); // Keep any partial event for the next read
+        for (const event of events) {
+            const dataLine = event.split("\n").find(line => line.startsWith("data: "));
+            if (!dataLine) continue;
+            const payload = JSON.parse(dataLine.slice(6));
+            if (payload.text) {
+                reply += payload.text;
+                content.innerHTML = reply;
+            }
+        }
+        chatBox.scrollTop = chatBox.scrollHeight; // Auto scroll to bottom
+    }
 }
 
 // Add event listener for Enter key on user input
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Tests for the async and streaming chat paths.
+Checks that database sessions are closed while the model is awaited, that
+concurrent chats overlap instead of queueing behind each other, and that
+streamed replies are stored only once complete.
+"""
+
+import sys
+import os
+import asyncio
+import time
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import json
+
+import chatbot
+import main
+from chat_writer import ChatHistoryWriter
+from chatbot import generate_response_async, stream_response_async
+from llm_providers import FakeProvider, LLMError
+from llm_resilience import CircuitBreaker, LLMCallPolicy
+from database import create_async_test_engine, create_test_engine
+from models import User, ChatHistory, MoodLog
+
+
+class TrackingProvider(FakeProvider):
+    """Fake provider with a fixed reply that records how many sessions are open when called"""
+
+    def __init__(self, tracker, latency=0.2):
+        super().__init__(latency=latency, jitter=0, chunk_delay=0, chunk_words=2)
+        self.tracker = tracker
+        self.open_during_call = []
+
+    def reply_for(self, prompt):
+        return "A friendly reply."
+
+    def _plan_call(self):
+        self.open_during_call.append(self.tracker.open)
+        return super()._plan_call()
+
+
+class SessionTracker:
+    """Session factory that counts sessions currently open"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.open = 0
+
+    def __call__(self):
+        db = self.factory()
+        self.open += 1
+        close = db.close
+
+        async def tracked_close():
+            self.open -= 1
+            await close()
+
+        db.close = tracked_close
+        return db
+
+
+class ChatTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test database with one user, a tracked async session factory and a slow provider"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        self.Session = sessionmaker(bind=engine)
+        db = self.Session()
+        db.add(User(username="sam", password="pw"))
+        db.commit()
+        db.close()
+        self.tracker = SessionTracker(async_sessionmaker(bind=create_async_test_engine(engine)))
+        chatbot.RESPONSE_CACHE.invalidate()
+        chatbot.HISTORY_BUFFER.invalidate()
+        chatbot.USER_CACHE.invalidate()
+        self.provider = TrackingProvider(self.tracker)
+        self.breaker = CircuitBreaker()
+        self.policy = LLMCallPolicy(deadline=5)
+        self.writer = ChatHistoryWriter(self.Session, flush_interval=0.01)
+        self.addCleanup(self.writer.stop)
+        patches = [mock.patch.object(chatbot, "AsyncSessionLocal", self.tracker),
+                   mock.patch.object(chatbot, "CHAT_WRITER", self.writer),
+                   mock.patch.object(chatbot, "llm_provider", self.provider),
+                   mock.patch.object(chatbot, "LLM_BREAKER", self.breaker),
+                   mock.patch.object(chatbot, "LLM_CALL_POLICY", self.policy),
+                   # App startup creates its tables in the test database, not wellbeing.db
+                   mock.patch.object(main, "engine", engine),
+                   mock.patch.object(main, "CHAT_WRITER", self.writer),
+                   mock.patch.object(main, "MIGRATE_ON_STARTUP", False)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def history(self):
+        self.writer.join()
+        db = self.Session()
+        try:
+            return [(chat.user_message, chat.bot_response) for chat in db.query(ChatHistory).all()]
+        finally:
+            db.close()
+
+
+class TestAsyncChat(ChatTestCase):
+    """Test cases for generate_response_async"""
+
+    async def test_llm_reply_saved_after_await(self):
+        """The model reply is stored once the await finishes, with no session held during it"""
+        reply = await generate_response_async("sam", "Tell me something nice about Tuesdays")
+        self.assertEqual(reply, "A friendly reply.")
+        self.assertEqual(self.provider.open_during_call, [0])
+        self.assertEqual(self.tracker.open, 0)
+        self.assertEqual(self.history(), [("Tell me something nice about Tuesdays", "A friendly reply.")])
+
+    async def test_canned_reply_skips_model(self):
+        """Rule-based answers never reach the model"""
+        reply = await generate_response_async("sam", "hi")
+        self.assertIn(reply, self.history()[0])
+        self.assertEqual(self.provider.open_during_call, [])
+
+    async def test_concurrent_chats_overlap(self):
+        """Many slow model calls run concurrently on the event loop"""
+        started = time.perf_counter()
+        replies = await asyncio.gather(*[
+            generate_response_async("sam", f"Tell me a tale, part {index}") for index in range(20)
+        ])
+        elapsed = time.perf_counter() - started
+        self.assertEqual(set(replies), {"A friendly reply."})
+        self.assertLess(elapsed, 20 * self.provider.latency / 2)
+        self.assertEqual(len(self.history()), 20)
+
+    async def test_model_failure_falls_back(self):
+        """A failing model call still answers with the rule-based fallback"""
+        self.provider.error_rate = 1.0
+        reply = await generate_response_async("nobody", "Tell me something about Tuesdays")
+        self.assertTrue(reply)
+        self.assertEqual(self.history(), [])
+
+    def test_shutdown_writes_queued_exchanges(self):
+        """Stopping the app drains the write-behind queue without waiting out its interval"""
+        self.writer.flush_interval = 60
+        from fastapi.testclient import TestClient
+        with TestClient(main.app) as client:
+            client.post("/chat", json={"username": "sam", "message": "hi"})
+        self.assertEqual(self.writer.written, 1)
+        self.assertEqual(self.history()[0][0], "hi")
+
+
+class TestStreamingChat(ChatTestCase):
+    """Test cases for stream_response_async and /chat/stream"""
+
+    async def collect(self, username, message):
+        return [chunk async for chunk in stream_response_async(username, message)]
+
+    async def test_chunks_forwarded_and_saved_once(self):
+        """Model chunks are yielded as they arrive and stored whole at the end"""
+        chunks = await self.collect("sam", "Tell me something nice about Tuesdays")
+        self.assertEqual(chunks, ["A friendly ", "reply. "])
+        self.assertEqual(self.history(), [("Tell me something nice about Tuesdays", "A friendly reply.")])
+        self.assertEqual(self.provider.open_during_call, [0])
+
+    async def test_canned_reply_single_chunk(self):
+        """Rule-based answers go out as one chunk"""
+        chunks = await self.collect("sam", "I want to kill myself")
+        self.assertEqual(len(chunks), 1)
+        self.assertIn("Emergency Services", chunks[0])
+        self.assertEqual(self.history(), [("I want to kill myself", chunks[0])])
+
+    async def test_interrupted_stream_not_saved(self):
+        """A stream that fails midway stops without storing a partial reply"""
+        async def broken(prompt):
+            yield "A partial"
+            raise LLMError("connection dropped")
+        self.provider.stream_async = broken
+        chunks = await self.collect("sam", "Tell me something about Tuesdays")
+        self.assertEqual(chunks, ["A partial"])
+        self.assertEqual(self.history(), [])
+
+    async def test_failure_before_first_chunk_falls_back(self):
+        """A model that fails before streaming anything answers with the fallback"""
+        self.provider.error_rate = 1.0
+        chunks = await self.collect("sam", "Tell me something about Tuesdays")
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0])
+
+    def test_endpoint_sends_server_sent_events(self):
+        """/chat/stream sends one data event per chunk and a final done event"""
+        from fastapi.testclient import TestClient
+        with TestClient(main.app) as client:
+            response = client.post("/chat/stream", json={"username": "sam", "message": "Tell me about Tuesdays"})
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        events = [event for event in response.text.split("\n\n") if event]
+        self.assertEqual([json.loads(event[len("data: "):]) for event in events[:-1]],
+                         [{"text": "A friendly "}, {"text": "reply. "}])
+        self.assertEqual(events[-1], "event: done\ndata: {}")
+
+
+class TestResponseCache(ChatTestCase):
+    """Test cases for caching LLM replies across users"""
+
+    def add_user(self, username, mood=None):
+        db = self.Session()
+        user = User(username=username, password="pw")
+        db.add(user)
+        db.commit()
+        if mood:
+            db.add(MoodLog(user_id=user.id, mood=mood))
+            db.commit()
+        db.close()
+
+    async def test_same_message_served_from_cache(self):
+        """A second user sending the same message, normalized, gets the cached reply"""
+        self.add_user("alex")
+        before = chatbot.response_cache_stats()
+        first = await generate_response_async("sam", "I feel a bit off today")
+        second = await generate_response_async("alex", "  i feel a bit OFF today!! ")
+        self.assertEqual(first, second)
+        self.assertEqual(self.provider.calls, 1)
+        stats = chatbot.response_cache_stats()
+        self.assertEqual((stats["hits"] - before["hits"], stats["misses"] - before["misses"]), (1, 1))
+        # Both exchanges are still recorded
+        self.assertEqual(len(self.history()), 2)
+
+    async def test_mood_and_language_are_part_of_the_key(self):
+        """Different moods or languages never share a cached reply"""
+        self.add_user("alex", mood="anxious")
+        await generate_response_async("sam", "I feel a bit off today")
+        await generate_response_async("alex", "I feel a bit off today")
+        await generate_response_async("nobody", "I feel a bit off today", target_lang="es")
+        self.assertEqual(self.provider.calls, 3)
+
+    async def test_recent_history_bypasses_cache(self):
+        """An ongoing conversation gets a fresh, personal reply"""
+        self.add_user("alex")
+        bypassed = chatbot.response_cache_stats()["bypassed"]
+        await generate_response_async("alex", "I feel a bit off today")
+        await generate_response_async("sam", "hi")
+        await generate_response_async("sam", "I feel a bit off today")
+        self.assertEqual(self.provider.calls, 2)
+        self.assertEqual(chatbot.response_cache_stats()["bypassed"] - bypassed, 1)
+
+    async def test_streamed_replies_use_the_cache(self):
+        """Streaming fills the cache once complete and serves hits as one chunk"""
+        self.add_user("alex")
+        streamed = [chunk async for chunk in stream_response_async("sam", "I feel a bit off today")]
+        cached = [chunk async for chunk in stream_response_async("alex", "I feel a bit off today")]
+        self.assertEqual(cached, ["".join(streamed).strip()])
+        self.assertEqual(self.provider.calls, 1)
+
+    async def test_failed_replies_not_cached(self):
+        """Fallback answers after a model error are not stored"""
+        self.provider.error_rate = 1.0
+        await generate_response_async("sam", "I feel a bit off today")
+        self.assertEqual(len(chatbot.RESPONSE_CACHE), 0)
+
+    def test_shared_prompt_is_anonymous(self):
+        """Prompts for cacheable replies leave out the username and old history"""
+        prompt, key, cached = chatbot.plan_llm_request(
+            "sam", "I feel a bit off today", None, "en", [], chatbot.MessageAnalysis("I feel a bit off today"))
+        self.assertNotIn("sam", prompt)
+        self.assertEqual(key, ("i feel a bit off today", "", "en"))
+        self.assertIsNone(cached)
+
+    def test_metrics_endpoint(self):
+        """/metrics reports the response and health search cache counters"""
+        from fastapi.testclient import TestClient
+        with TestClient(main.app) as client:
+            metrics = client.get("/metrics").json()
+        self.assertIn("hit_rate", metrics["response_cache"])
+        self.assertIn("bypassed", metrics["response_cache"])
+        self.assertIn("evictions", metrics["health_search_cache"])
+
+
+class TestFakeProvider(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the local fake LLM provider"""
+
+    def test_replies_are_deterministic(self):
+        """The same prompt always gets the same reply, of the configured length"""
+        provider = FakeProvider(latency=0, jitter=0, chunk_delay=0, reply_words=40)
+        self.assertEqual(provider.generate("hello"), provider.generate("hello"))
+        self.assertEqual(len(provider.generate("hello").split()), 40)
+
+    async def test_stream_joins_to_reply(self):
+        """Streamed chunks add up to the non-streamed reply"""
+        provider = FakeProvider(latency=0, jitter=0, chunk_delay=0)
+        chunks = [chunk async for chunk in provider.stream_async("a prompt")]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), await provider.generate_async("a prompt"))
+
+    async def test_latency_and_jitter(self):
+        """Calls take the configured latency, within the jitter"""
+        provider = FakeProvider(latency=0.05, jitter=0.02, chunk_delay=0, seed=1)
+        for _ in range(3):
+            started = time.perf_counter()
+            await provider.generate_async("a prompt")
+            self.assertGreaterEqual(time.perf_counter() - started, 0.025)
+
+    def test_error_rate(self):
+        """Roughly error_rate of calls fail, reproducibly for a seed"""
+        def failures(seed):
+            provider = FakeProvider(latency=0, jitter=0, chunk_delay=0, error_rate=0.3, seed=seed)
+            outcome = []
+            for _ in range(200):
+                try:
+                    provider.generate("a prompt")
+                    outcome.append(False)
+                except LLMError:
+                    outcome.append(True)
+            return outcome
+        self.assertEqual(failures(5), failures(5))
+        self.assertTrue(40 <= sum(failures(5)) <= 80)
+
+    def test_provider_from_environment(self):
+        """LLM_PROVIDER and FAKE_LLM_* pick and configure the provider"""
+        from llm_providers import get_provider
+        with mock.patch.dict(os.environ, {"LLM_PROVIDER": "fake", "FAKE_LLM_LATENCY": "0.1", "FAKE_LLM_ERROR_RATE": "0.5"}):
+            provider = get_provider()
+        self.assertIsInstance(provider, FakeProvider)
+        self.assertEqual((provider.latency, provider.error_rate), (0.1, 0.5))
+        with self.assertRaises(ValueError):
+            get_provider("nonexistent")
+
+
+if __name__ == "__main__":
+    unittest.main()
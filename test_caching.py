@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process LRU cache.
+"""
+
+import sys
+import os
+import threading
+import unittest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from caching import LRUCache
+
+
+class FakeClock:
+    """Manually advanced clock for expiry tests"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    """Test cases for LRUCache"""
+
+    def test_hits_and_misses(self):
+        """Lookups are counted as hits or misses"""
+        cache = LRUCache(maxsize=4)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        """A full cache drops the entry used longest ago"""
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl_expiry(self):
+        """Entries older than the ttl are treated as missing"""
+        clock = FakeClock()
+        cache = LRUCache(maxsize=4, ttl=10, clock=clock)
+        cache.set("a", 1)
+        clock.now = 9
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_get_or_set_computes_once(self):
+        """get_or_set only calls compute on a miss"""
+        cache = LRUCache(maxsize=4)
+        calls = []
+        for _ in range(3):
+            self.assertEqual(cache.get_or_set("k", lambda: calls.append(1) or "v"), "v")
+        self.assertEqual(len(calls), 1)
+
+    def test_invalidate(self):
+        """invalidate drops one key or everything"""
+        cache = LRUCache(maxsize=4)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate("a")
+        self.assertNotIn("a", cache)
+        self.assertIn("b", cache)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_concurrent_access(self):
+        """Concurrent readers and writers keep the size bound and the counters consistent"""
+        cache = LRUCache(maxsize=50)
+
+        def worker(offset):
+            for index in range(2000):
+                key = (offset + index) % 120
+                cache.get_or_set(key, lambda: key * 2)
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertLessEqual(stats["size"], 50)
+        self.assertEqual(stats["hits"] + stats["misses"], 8 * 2000)
+        self.assertTrue(all(cache.get(key, count=False) in (None, key * 2) for key in range(120)))
+
+    def test_rejects_empty_cache(self):
+        """A cache must be able to hold at least one entry"""
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Tests for the write-behind ChatHistory writer.
+"""
+
+import sys
+import os
+import asyncio
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+from chat_writer import ChatHistoryWriter
+from llm_providers import FakeProvider
+from llm_resilience import CircuitBreaker
+from database import create_async_test_engine, create_test_engine
+from models import User, ChatHistory
+
+
+class WriterTestCase(unittest.TestCase):
+    """Test database with one user and a session factory the test can hold up"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        self.Session = sessionmaker(bind=engine)
+        db = self.Session()
+        user = User(username="sam", password="pw")
+        db.add(user)
+        db.commit()
+        self.user_id = user.id
+        db.close()
+        self.release = threading.Event()
+        self.release.set()
+
+    def held_session(self):
+        """A session, once the test sets self.release"""
+        self.release.wait()
+        return self.Session()
+
+    def stored(self):
+        db = self.Session()
+        try:
+            return [chat.user_message for chat in db.query(ChatHistory).order_by(ChatHistory.id)]
+        finally:
+            db.close()
+
+    def submit(self, writer, message):
+        return writer.submit(self.user_id, message, f"reply to {message}", datetime.utcnow())
+
+
+class TestChatHistoryWriter(WriterTestCase):
+    """Test cases for ChatHistoryWriter"""
+
+    def test_rows_written_in_batches(self):
+        writer = ChatHistoryWriter(self.Session, batch_size=4, flush_interval=0.2)
+        self.addCleanup(writer.stop)
+        for index in range(10):
+            self.assertTrue(self.submit(writer, f"message {index}"))
+        writer.join()
+        self.assertEqual(self.stored(), [f"message {index}" for index in range(10)])
+        self.assertEqual((writer.written, writer.batches), (10, 3))
+
+    def test_full_queue_refuses(self):
+        """Past max_queue submit() returns False so the caller writes inline"""
+        self.release.clear()
+        writer = ChatHistoryWriter(self.held_session, max_queue=2, batch_size=1)
+        self.addCleanup(writer.stop)
+        self.assertTrue(self.submit(writer, "first"))
+        # The thread takes the first row and waits for its session, leaving room for two
+        while writer.stats()["depth"]:
+            pass
+        self.assertTrue(self.submit(writer, "second"))
+        self.assertTrue(self.submit(writer, "third"))
+        self.assertFalse(self.submit(writer, "fourth"))
+        self.assertEqual(writer.overflows, 1)
+        self.release.set()
+        writer.join()
+        self.assertEqual(self.stored(), ["first", "second", "third"])
+
+    def test_pending_until_committed(self):
+        self.release.clear()
+        writer = ChatHistoryWriter(self.held_session, flush_interval=0)
+        self.addCleanup(writer.stop)
+        self.submit(writer, "hello")
+        self.assertEqual([exchange[0] for exchange in writer.pending(self.user_id)], ["hello"])
+        self.assertEqual(writer.pending(self.user_id + 1), [])
+        self.release.set()
+        writer.join()
+        self.assertEqual(writer.pending(self.user_id), [])
+
+    def test_stop_drains_queue(self):
+        """stop() writes what is queued without waiting out the flush interval"""
+        writer = ChatHistoryWriter(self.Session, flush_interval=60)
+        for index in range(3):
+            self.submit(writer, f"message {index}")
+        writer.stop()
+        self.assertEqual(len(self.stored()), 3)
+        # A later submit starts a new thread
+        self.submit(writer, "after")
+        writer.stop()
+        self.assertEqual(len(self.stored()), 4)
+
+    def test_failed_batch_counted(self):
+        def failing_session():
+            db = self.Session()
+            db.commit = mock.Mock(side_effect=RuntimeError("disk full"))
+            return db
+
+        writer = ChatHistoryWriter(failing_session, flush_interval=0)
+        self.addCleanup(writer.stop)
+        with mock.patch("builtins.print") as printed:
+            self.submit(writer, "hello")
+            writer.join()
+        self.assertEqual((writer.failed, writer.written), (1, 0))
+        self.assertEqual(printed.call_args[0][0], "Chat history write failed: disk full")
+        self.assertEqual(writer.pending(self.user_id), [])
+        self.assertEqual(self.stored(), [])
+
+    def test_disabled_writer(self):
+        writer = ChatHistoryWriter(self.Session, max_queue=0)
+        self.assertFalse(self.submit(writer, "hello"))
+        self.assertEqual(writer.overflows, 0)
+
+
+class TestWriteBehindChat(WriterTestCase):
+    """Chats reply before their exchange is written and still see it next turn"""
+
+    def setUp(self):
+        super().setUp()
+        self.prompts = []
+        provider = FakeProvider(latency=0, jitter=0, chunk_delay=0)
+        original = provider.generate_async
+
+        async def recording(prompt):
+            self.prompts.append(prompt)
+            return await original(prompt)
+
+        provider.generate_async = recording
+        chatbot.HISTORY_BUFFER.invalidate()
+        chatbot.USER_CACHE.invalidate()
+        chatbot.RESPONSE_CACHE.invalidate()
+        patches = [mock.patch.object(chatbot, "AsyncSessionLocal",
+                                     async_sessionmaker(bind=create_async_test_engine(self.Session.kw["bind"]))),
+                   mock.patch.object(chatbot, "llm_provider", provider),
+                   mock.patch.object(chatbot, "LLM_BREAKER", CircuitBreaker())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def use_writer(self, writer):
+        patch = mock.patch.object(chatbot, "CHAT_WRITER", writer)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(writer.stop)
+
+    def test_reply_before_write(self):
+        """Queued exchanges reach the next prompt even when the buffer has to reload"""
+        self.release.clear()
+        self.use_writer(ChatHistoryWriter(self.held_session, flush_interval=0))
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me a tale"))
+        self.assertEqual(self.stored(), [])
+        chatbot.HISTORY_BUFFER.invalidate()
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me another tale"))
+        history = self.prompts[-1].split("Conversation history:\n", 1)[1]
+        self.assertIn("user: Tell me a tale\n", history)
+        self.release.set()
+        chatbot.CHAT_WRITER.join()
+        self.assertEqual(self.stored(), ["Tell me a tale", "Tell me another tale"])
+
+    def test_full_queue_writes_inline(self):
+        self.use_writer(ChatHistoryWriter(self.Session, max_queue=0))
+        asyncio.run(chatbot.generate_response_async("sam", "hi"))
+        self.assertEqual(self.stored(), ["hi"])
+
+    def test_queued_exchange_merged_once(self):
+        """An exchange both committed and still listed as queued appears once"""
+        timestamp = datetime.utcnow() - timedelta(seconds=1)
+        history = [{"role": "user", "content": "hello", "timestamp": timestamp},
+                   {"role": "assistant", "content": "hi", "timestamp": timestamp}]
+        queued = [("hello", "hi", timestamp), ("again", "hi again", datetime.utcnow())]
+        merged = chatbot.merge_queued_exchanges(history, queued, 10)
+        self.assertEqual([message["content"] for message in merged], ["hello", "hi", "again", "hi again"])
+        self.assertEqual(len(chatbot.merge_queued_exchanges(history, queued, 1)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
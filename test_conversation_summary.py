@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Tests for rolling conversation summaries and the background summary worker.
+"""
+
+import sys
+import os
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+from chat_writer import ChatHistoryWriter
+from conversation_summary import SummaryWorker, summarize_user, load_summary, build_summary_prompt
+from llm_providers import FakeProvider
+from llm_resilience import CircuitBreaker
+from database import create_async_test_engine, create_test_engine
+from models import User, ChatHistory, ConversationSummary
+
+
+def fake_summarize(previous_summary, exchanges):
+    """Summary listing the folded user messages after the previous summary"""
+    parts = [previous_summary] if previous_summary else []
+    return " | ".join(parts + [user_message for user_message, _ in exchanges])
+
+
+class SummaryTestCase(unittest.TestCase):
+    """In-memory database with one user"""
+
+    def setUp(self):
+        self.engine = create_test_engine()
+        self.Session = sessionmaker(bind=self.engine)
+        db = self.Session()
+        user = User(username="sam", password="pw")
+        db.add(user)
+        db.commit()
+        self.user_id = user.id
+        db.close()
+
+    def add_exchanges(self, count, start=0):
+        db = self.Session()
+        for index in range(start, start + count):
+            db.add(ChatHistory(user_id=self.user_id, user_message=f"message {index}", bot_response=f"reply {index}"))
+        db.commit()
+        db.close()
+
+
+class TestSummarizeUser(SummaryTestCase):
+    """Test cases for summarize_user"""
+
+    def test_below_threshold_does_nothing(self):
+        self.add_exchanges(5)
+        db = self.Session()
+        self.assertFalse(summarize_user(db, self.user_id, fake_summarize, threshold=6, keep_recent=2))
+        self.assertIsNone(load_summary(db, self.user_id))
+        db.close()
+
+    def test_folds_older_exchanges_and_keeps_recent(self):
+        """Exchanges beyond keep_recent are folded, and later runs extend the summary"""
+        self.add_exchanges(6)
+        db = self.Session()
+        self.assertTrue(summarize_user(db, self.user_id, fake_summarize, threshold=6, keep_recent=2))
+        record = load_summary(db, self.user_id)
+        self.assertEqual(record.summary, "message 0 | message 1 | message 2 | message 3")
+        db.close()
+
+        self.add_exchanges(3, start=6)
+        db = self.Session()
+        self.assertFalse(summarize_user(db, self.user_id, fake_summarize, threshold=6, keep_recent=2))
+        self.add_exchanges(1, start=9)
+        self.assertTrue(summarize_user(db, self.user_id, fake_summarize, threshold=6, keep_recent=2))
+        record = load_summary(db, self.user_id)
+        self.assertTrue(record.summary.endswith("message 3 | message 4 | message 5 | message 6 | message 7"))
+        self.assertEqual(db.get(ChatHistory, record.summarized_through).user_message, "message 7")
+        db.close()
+
+    def test_summary_prompt_includes_previous_summary(self):
+        prompt = build_summary_prompt("Sam is stressed.", [("hi", "hello")], 200, 50)
+        self.assertIn("Sam is stressed.", prompt)
+        self.assertIn("user: hi\nassistant: hello\n", prompt)
+
+
+class TestSummaryWorker(SummaryTestCase):
+    """Test cases for SummaryWorker"""
+
+    def test_worker_summarizes_in_background(self):
+        self.add_exchanges(4)
+        worker = SummaryWorker(self.Session, fake_summarize, threshold=4, keep_recent=1)
+        self.addCleanup(worker.stop)
+        worker.request(self.user_id)
+        worker.request(self.user_id)
+        worker.join()
+        self.assertEqual(worker.updated + worker.skipped, 1)
+        db = self.Session()
+        self.assertEqual(load_summary(db, self.user_id).summary, "message 0 | message 1 | message 2")
+        db.close()
+
+    def test_failure_is_counted(self):
+        def broken(previous_summary, exchanges):
+            raise RuntimeError("LLM unavailable")
+
+        self.add_exchanges(4)
+        worker = SummaryWorker(self.Session, broken, threshold=4, keep_recent=1)
+        self.addCleanup(worker.stop)
+        with mock.patch("builtins.print"):
+            worker.request(self.user_id)
+            worker.join()
+        self.assertEqual(worker.failed, 1)
+
+    def test_disabled_with_zero_threshold(self):
+        worker = SummaryWorker(self.Session, fake_summarize, threshold=0)
+        worker.request(self.user_id)
+        self.assertIsNone(worker._thread)
+
+
+class TestSummaryInChat(SummaryTestCase):
+    """The chat prompt carries the summary plus only the exchanges after it"""
+
+    def setUp(self):
+        super().setUp()
+        chatbot.HISTORY_BUFFER.invalidate()
+        chatbot.USER_CACHE.invalidate()
+        self.prompts = []
+        provider = FakeProvider(latency=0, jitter=0, chunk_delay=0)
+        original = provider.generate_async
+
+        async def recording(prompt):
+            self.prompts.append(prompt)
+            return await original(prompt)
+
+        provider.generate_async = recording
+        self.worker = SummaryWorker(self.Session, fake_summarize, threshold=6, keep_recent=3,
+                                    on_update=chatbot.HISTORY_BUFFER.invalidate)
+        self.addCleanup(self.worker.stop)
+        writer = ChatHistoryWriter(self.Session, flush_interval=0.01)
+        self.addCleanup(writer.stop)
+        patches = [mock.patch.object(chatbot, "SessionLocal", self.Session),
+                   mock.patch.object(chatbot, "CHAT_WRITER", writer),
+                   mock.patch.object(chatbot, "AsyncSessionLocal",
+                                     async_sessionmaker(bind=create_async_test_engine(self.engine))),
+                   mock.patch.object(chatbot, "llm_provider", provider),
+                   mock.patch.object(chatbot, "LLM_BREAKER", CircuitBreaker()),
+                   mock.patch.object(chatbot, "SUMMARY_WORKER", self.worker),
+                   mock.patch.object(chatbot, "PROMPT_HISTORY_EXCHANGES", 3)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_prompt_uses_summary_after_threshold(self):
+        self.add_exchanges(6)
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me a tale"))
+        self.worker.join()
+        self.assertEqual(self.worker.updated, 1)
+
+        # The check may run before or after the first reply is saved, folding 3 or 4 exchanges
+        db = self.Session()
+        summary = load_summary(db, self.user_id).summary
+        db.close()
+        last_folded = int(summary.rsplit(" ", 1)[1])
+        self.assertIn(last_folded, (2, 3))
+
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me another tale"))
+        prompt = self.prompts[-1]
+        self.assertIn(f"Summary of earlier conversation:\n{summary}\n", prompt)
+        history = prompt.split("Conversation history:\n", 1)[1]
+        self.assertNotIn(f"message {last_folded}\n", history)
+        # Exchanges between the summary and the 3-exchange window are in neither, so check the newest
+        self.assertIn("user: message 5\n", history)
+        self.assertIn("user: Tell me a tale\n", history)
+
+    def test_returning_user_gets_summary(self):
+        """A summary reaches the prompt even when the last exchange is too old to personalize it"""
+        db = self.Session()
+        db.add(ChatHistory(user_id=self.user_id, user_message="message old", bot_response="reply old",
+                           timestamp=datetime.utcnow() - timedelta(days=2)))
+        db.add(ConversationSummary(user_id=self.user_id, summary="Sam has been sleeping badly", summarized_through=0))
+        db.commit()
+        db.close()
+        chatbot.RESPONSE_CACHE.invalidate()
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me a tale"))
+        self.assertIn("Summary of earlier conversation:\nSam has been sleeping badly\n", self.prompts[-1])
+        self.assertIn("user: message old\n", self.prompts[-1])
+        # A reply shaped by the summary is not shared with other users
+        self.assertEqual(len(chatbot.RESPONSE_CACHE), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
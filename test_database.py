@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for engine creation from the environment and the SQLite connection profile.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from database import (
+    SQLITE_PRAGMAS, configure_sqlite, create_database_engine, normalize_database_url,
+    sqlite_pragmas_from_environment,
+)
+
+
+class TestDatabaseEngine(unittest.TestCase):
+    """Test cases for create_database_engine"""
+
+    def test_heroku_postgres_url(self):
+        self.assertEqual(normalize_database_url("postgres://u:p@host/db"), "postgresql://u:p@host/db")
+        self.assertEqual(normalize_database_url("sqlite:///./wellbeing.db"), "sqlite:///./wellbeing.db")
+
+    def test_pool_settings_from_environment(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings = {"DB_POOL_SIZE": "3", "DB_MAX_OVERFLOW": "2", "DB_POOL_RECYCLE": "60", "DB_POOL_PRE_PING": "0"}
+            with mock.patch.dict(os.environ, settings):
+                engine = create_database_engine(f"sqlite:///{os.path.join(directory, 'pool.db')}")
+            self.assertIsInstance(engine.pool, QueuePool)
+            self.assertEqual((engine.pool.size(), engine.pool._max_overflow, engine.pool._recycle), (3, 2, 60))
+            self.assertFalse(engine.pool._pre_ping)
+            engine.dispose()
+
+    def test_memory_database_shares_one_connection(self):
+        """Every session sees the same private in-memory database"""
+        engine = create_database_engine("sqlite://")
+        self.assertIsInstance(engine.pool, StaticPool)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE notes (id INTEGER)")
+        with engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql("SELECT COUNT(*) FROM notes").scalar(), 0)
+
+
+class TestSQLiteProfile(unittest.TestCase):
+    """Test cases for configure_sqlite"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.url = f"sqlite:///{os.path.join(directory.name, 'profile.db')}"
+
+    def pragma(self, engine, name):
+        with engine.connect() as conn:
+            return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_applied_to_every_connection(self):
+        engine = configure_sqlite(create_engine(self.url), SQLITE_PRAGMAS)
+        self.addCleanup(engine.dispose)
+        self.assertEqual(self.pragma(engine, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(engine, "synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma(engine, "busy_timeout"), 5000)
+        self.assertEqual(self.pragma(engine, "temp_store"), 2)  # MEMORY
+        self.assertEqual(self.pragma(engine, "cache_size"), -16000)
+
+    def test_environment_overrides(self):
+        with mock.patch.dict(os.environ, {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_MMAP_SIZE": ""}):
+            pragmas = sqlite_pragmas_from_environment()
+        self.assertEqual(pragmas["journal_mode"], "DELETE")
+        self.assertEqual(pragmas["synchronous"], "NORMAL")
+        engine = configure_sqlite(create_engine(self.url), pragmas)
+        self.addCleanup(engine.dispose)
+        self.assertEqual(self.pragma(engine, "journal_mode"), "delete")
+        # An empty value leaves SQLite's default
+        self.assertEqual(self.pragma(engine, "mmap_size"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming mood and chat history exports.
+"""
+
+import sys
+import os
+import asyncio
+import csv
+import json
+import unittest
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import main
+from user_cache import UserProfileCache
+from database import create_async_test_engine, create_test_engine
+from models import User, MoodLog, ChatHistory
+
+
+class TestExports(unittest.TestCase):
+    """Test cases for /export/csv and /export/chats"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        user = User(username="sam", password="pw")
+        db.add(user)
+        db.commit()
+        started = datetime(2024, 1, 1, 9, 0)
+        db.add_all([MoodLog(user_id=user.id, mood=f"mood {index}", log_date=date(2024, 1, 1) + timedelta(days=index))
+                    for index in range(5)])
+        db.add_all([ChatHistory(user_id=user.id, user_message=f"message {index}", bot_response=f"reply, {index}",
+                                timestamp=started + timedelta(minutes=index)) for index in range(5)])
+        db.commit()
+        db.close()
+        AsyncSession = async_sessionmaker(bind=create_async_test_engine(engine))
+
+        async def session():
+            async with AsyncSession() as db:
+                yield db
+
+        main.app.dependency_overrides[main.get_async_db] = session
+        self.addCleanup(main.app.dependency_overrides.clear)
+        for patch in (mock.patch.object(main, "AsyncSessionLocal", AsyncSession),
+                      mock.patch.object(main, "EXPORT_BATCH_ROWS", 2),
+                      mock.patch.object(main, "engine", engine),
+                      mock.patch.object(main, "MIGRATE_ON_STARTUP", False),
+                      mock.patch.object(main, "USER_CACHE", UserProfileCache())):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get(self, path):
+        with TestClient(main.app) as client:
+            return client.get(path)
+
+    def test_rows_read_in_batches(self):
+        async def batches():
+            return [len(rows) async for rows in main.stream_rows(select(ChatHistory.user_message))]
+
+        self.assertEqual(asyncio.run(batches()), [2, 2, 1])
+
+    def test_chunk_per_batch(self):
+        async def batches():
+            yield [("a", 1), ("b", 2)]
+            yield [("c", 3)]
+
+        async def chunks():
+            return [chunk async for chunk in main.csv_chunks(["Name", "Count"], batches())]
+
+        self.assertEqual(asyncio.run(chunks()), ["Name,Count\r\n", "a,1\r\nb,2\r\n", "c,3\r\n"])
+
+    def test_mood_csv(self):
+        response = self.get("/export/csv/sam")
+        self.assertTrue(response.headers["content-type"].startswith("text/csv"))
+        rows = list(csv.reader(StringIO(response.text)))
+        self.assertEqual(rows[0], ["Date", "Mood"])
+        self.assertEqual(rows[1:], [[f"2024-01-0{index + 1}", f"mood {index}"] for index in range(5)])
+
+    def test_chat_csv(self):
+        rows = list(csv.reader(StringIO(self.get("/export/chats/sam").text)))
+        self.assertEqual(rows[0], ["Date/Time", "User Message", "Bot Response"])
+        self.assertEqual([row[1:] for row in rows[1:]], [[f"message {index}", f"reply, {index}"] for index in range(5)])
+
+    def test_chat_ndjson(self):
+        response = self.get("/export/chats/sam?format=ndjson")
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+        records = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0], {"timestamp": "2024-01-01 09:00:00", "user_message": "message 0",
+                                      "bot_response": "reply, 0"})
+
+    def test_chat_export_errors(self):
+        self.assertIn("error", self.get("/export/chats/sam?format=xml").json())
+        self.assertIn("error", self.get("/export/chats/nobody").json())
+
+
+if __name__ == "__main__":
+    unittest.main()
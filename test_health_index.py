@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for the indexed health knowledge search.
+Compares search_health_database with a walk over every table, the way it used to search,
+and checks that results come back ranked by BM25 relevance.
+"""
+
+import sys
+import os
+import unittest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import health_knowledge
+from health_knowledge import (
+    search_health_database, score_health_entries, normalize_query, rank_health_entries,
+    refresh_health_index, HEALTH_SEARCH_CACHE, HEALTH_INDEX_ENTRIES, HEALTH_CONDITIONS, MENTAL_HEALTH_CONDITIONS,
+    SYMPTOM_CHECKER, WELLNESS_TOPICS, SYMPTOM_PREVENTION,
+)
+
+
+def table_scan(query):
+    """Reference search that walks every table entry"""
+    query_lower = query.lower()
+    results = []
+    for condition, info in HEALTH_CONDITIONS.items():
+        condition_normalized = condition.replace('_', ' ')
+        if condition in query_lower or condition_normalized in query_lower or any(symptom in query_lower for symptom in info.get('symptoms', [])):
+            results.append({"type": "condition", "name": condition, "info": info})
+    for condition, info in MENTAL_HEALTH_CONDITIONS.items():
+        condition_normalized = condition.replace('_', ' ')
+        if condition in query_lower or condition_normalized in query_lower:
+            results.append({"type": "mental_health", "name": condition, "info": info})
+    for symptom, causes in SYMPTOM_CHECKER.items():
+        if symptom in query_lower:
+            results.append({"type": "symptom", "name": symptom, "causes": causes})
+    for topic, advice in WELLNESS_TOPICS.items():
+        if topic in query_lower:
+            results.append({"type": "wellness", "name": topic, "advice": advice})
+    for symptom, prevention_tips in SYMPTOM_PREVENTION.items():
+        if symptom in query_lower:
+            results.append({"type": "prevention", "name": symptom, "prevention_tips": prevention_tips})
+    return results
+
+
+def without_scores(results):
+    """Results with the ranking score dropped, for comparison with the table walk"""
+    return [{key: value for key, value in result.items() if key != "score"} for result in results]
+
+
+def sort_key(result):
+    """Order-independent key for comparing result lists"""
+    return (result["type"], result["name"])
+
+
+class TestHealthIndex(unittest.TestCase):
+    """Test cases for the health knowledge index"""
+
+    def test_matches_table_scan(self):
+        """The index returns the same entries as a full table walk"""
+        queries = [
+            "I have a headache",
+            "What are the symptoms of anxiety?",
+            "Tell me about diabetes",
+            "What causes hypertension?",
+            "racing heart and sweating, also some fatigue",
+            "chest_pain and fever",
+            "tips for sleep and nutrition",
+            "ptsd and bipolar disorder",
+            "I feel fine",
+            "",
+        ]
+        # Every searchable phrase on its own must hit as well
+        for info in HEALTH_CONDITIONS.values():
+            queries.extend(info.get('symptoms', []))
+        queries.extend(HEALTH_CONDITIONS)
+        queries.extend(SYMPTOM_PREVENTION)
+        for query in queries:
+            found = sorted(without_scores(search_health_database(query)), key=sort_key)
+            self.assertEqual(found, sorted(table_scan(query), key=sort_key), query)
+
+    def test_results_are_fresh(self):
+        """Each search returns new result dicts so callers can modify them"""
+        first = search_health_database("headache")
+        first[0]["extra"] = True
+        self.assertNotIn("extra", search_health_database("headache")[0])
+
+
+class TestHealthRanking(unittest.TestCase):
+    """Test cases for BM25 ranking of health search results"""
+
+    def test_sorted_by_score(self):
+        """Results come back by descending score, ties in table order"""
+        for query in ["fatigue", "I have fatigue and a fever", "racing heart, sweating and chest pain"]:
+            results = search_health_database(query)
+            scores = [result["score"] for result in results]
+            self.assertEqual(scores, sorted(scores, reverse=True), query)
+            table_order = table_scan(query)
+            for score in set(scores):
+                tied = [sort_key(result) for result in results if result["score"] == score]
+                in_table_order = [sort_key(result) for result in table_order if sort_key(result) in tied]
+                self.assertEqual(tied, in_table_order, query)
+
+    def test_most_relevant_first(self):
+        """The entry the query is about ranks above entries that only mention it"""
+        self.assertEqual(sort_key(search_health_database("What are the symptoms of anxiety?")[0]),
+                         ("condition", "anxiety"))
+        self.assertEqual(sort_key(search_health_database("how to prevent diabetes")[0]),
+                         ("prevention", "diabetes"))
+        top = search_health_database("racing heart, sweating and chest pain")[:2]
+        self.assertEqual({result["name"] for result in top}, {"anxiety", "heart_disease"})
+
+    def test_scores_match_matrix(self):
+        """Each result carries the score computed from the term-document matrix"""
+        scores = score_health_entries("headache and nausea")
+        self.assertEqual(len(scores), len(HEALTH_INDEX_ENTRIES))
+        for result in search_health_database("headache and nausea"):
+            entry_id = next(index for index, entry in enumerate(HEALTH_INDEX_ENTRIES)
+                            if entry[0] == result["type"] and entry[1] == result["name"])
+            self.assertAlmostEqual(result["score"], scores[entry_id])
+
+    def test_unknown_words_score_zero(self):
+        """Words outside the vocabulary contribute nothing"""
+        self.assertFalse(score_health_entries("qwertyuiop zxcvb").any())
+
+
+class TestHealthSearchCache(unittest.TestCase):
+    """Test cases for memoized health searches"""
+
+    def setUp(self):
+        HEALTH_SEARCH_CACHE.invalidate()
+
+    def test_normalized_queries_share_an_entry(self):
+        """Case, spacing and trailing punctuation do not create new cache entries"""
+        first = search_health_database("I have a headache")
+        misses = HEALTH_SEARCH_CACHE.stats()["misses"]
+        for query in ["i have a headache!!", "  I HAVE a   headache.", "I have a headache?"]:
+            self.assertEqual(search_health_database(query), first, query)
+        self.assertEqual(HEALTH_SEARCH_CACHE.stats()["misses"], misses)
+        self.assertEqual(len(HEALTH_SEARCH_CACHE), 1)
+
+    def test_normalization_keeps_results(self):
+        """Searching the normalized query finds what the raw query finds"""
+        for query in ["Racing heart, sweating and CHEST PAIN!", "chest_pain and fever...", "Tips for sleep?!"]:
+            self.assertEqual(rank_health_entries(normalize_query(query)), rank_health_entries(query), query)
+
+    def test_normalization_joins_spaced_phrases(self):
+        """Collapsed whitespace lets a phrase typed with extra spaces match"""
+        self.assertEqual(rank_health_entries("chest  pain"), ())
+        self.assertEqual(search_health_database("chest  pain"), search_health_database("chest pain"))
+
+    def test_refresh_picks_up_table_changes(self):
+        """refresh_health_index drops cached results and indexes new entries"""
+        self.assertEqual(search_health_database("zyxitis"), [])
+        health_knowledge.SYMPTOM_CHECKER["zyxitis"] = ["testing"]
+        try:
+            refresh_health_index()
+            self.assertEqual([result["name"] for result in search_health_database("zyxitis")], ["zyxitis"])
+        finally:
+            del health_knowledge.SYMPTOM_CHECKER["zyxitis"]
+            refresh_health_index()
+        self.assertEqual(search_health_database("zyxitis"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process per-user conversation buffer.
+"""
+
+import sys
+import os
+import asyncio
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+from chat_writer import ChatHistoryWriter
+from history_buffer import ConversationBuffer
+from llm_providers import FakeProvider
+from llm_resilience import CircuitBreaker
+from database import create_async_test_engine, create_test_engine
+from models import User, MoodLog, ChatHistory, ConversationSummary
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def history_of(*pairs):
+    history = []
+    for user_message, bot_response in pairs:
+        history.append({"role": "user", "content": user_message, "timestamp": None})
+        history.append({"role": "assistant", "content": bot_response, "timestamp": None})
+    return history
+
+
+def load(buffer, user_id, summary, history):
+    buffer.begin_load(user_id)
+    buffer.put(user_id, summary, history)
+
+
+class TestConversationBuffer(unittest.TestCase):
+    """Test cases for ConversationBuffer"""
+
+    def test_miss_then_hit(self):
+        buffer = ConversationBuffer()
+        self.assertIsNone(buffer.get(1))
+        load(buffer, 1, "summary", history_of(("hi", "hello")))
+        self.assertEqual(buffer.get(1), ("summary", history_of(("hi", "hello"))))
+        self.assertEqual((buffer.stats()["hits"], buffer.stats()["misses"]), (1, 1))
+
+    def test_append_keeps_latest_exchanges(self):
+        """Saved exchanges extend a buffered user's ring, dropping the oldest"""
+        buffer = ConversationBuffer(exchanges_per_user=2)
+        load(buffer, 1, None, history_of(("a", "1"), ("b", "2")))
+        buffer.append(1, "c", "3", None)
+        self.assertEqual(buffer.get(1), (None, history_of(("b", "2"), ("c", "3"))))
+
+    def test_append_ignores_unbuffered_users(self):
+        buffer = ConversationBuffer()
+        buffer.append(1, "c", "3", None)
+        self.assertEqual(len(buffer), 0)
+
+    def test_write_during_load_discards_loaded_rows(self):
+        """Rows read before a concurrent save are not stored"""
+        buffer = ConversationBuffer()
+        buffer.begin_load(1)
+        buffer.append(1, "new", "reply", None)
+        buffer.put(1, None, history_of(("old", "reply")))
+        self.assertIsNone(buffer.get(1))
+
+    def test_load_mark(self):
+        """A load started before the user id was known is dropped after any save"""
+        buffer = ConversationBuffer()
+        mark = buffer.load_mark()
+        buffer.put(1, None, history_of(("old", "reply")), mark)
+        self.assertIsNotNone(buffer.get(1))
+        mark = buffer.load_mark()
+        buffer.append(3, "new", "reply", None)
+        buffer.put(2, None, [], mark)
+        self.assertIsNone(buffer.get(2))
+
+    def test_lru_eviction_by_user_count(self):
+        buffer = ConversationBuffer(max_users=2)
+        load(buffer, 1, None, [])
+        load(buffer, 2, None, [])
+        buffer.get(1)
+        load(buffer, 3, None, [])
+        self.assertIsNone(buffer.get(2))
+        self.assertIsNotNone(buffer.get(1))
+        self.assertEqual(buffer.stats()["evictions"], 1)
+
+    def test_memory_cap(self):
+        """Entries are evicted to keep the estimated size under max_bytes"""
+        buffer = ConversationBuffer(max_bytes=5000)
+        for user_id in range(10):
+            load(buffer, user_id, None, history_of(("x" * 500, "y" * 500)))
+        self.assertLessEqual(buffer.bytes, 5000)
+        self.assertLess(len(buffer), 10)
+        self.assertIsNotNone(buffer.get(9))
+        buffer.invalidate()
+        self.assertEqual(buffer.bytes, 0)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        buffer = ConversationBuffer(ttl=60, clock=clock)
+        load(buffer, 1, None, [])
+        clock.now = 59
+        self.assertIsNotNone(buffer.get(1))
+        clock.now = 60
+        self.assertIsNone(buffer.get(1))
+        self.assertEqual(buffer.stats()["expirations"], 1)
+
+    def test_disabled(self):
+        buffer = ConversationBuffer(max_users=0)
+        load(buffer, 1, None, [])
+        self.assertIsNone(buffer.get(1))
+
+
+class TestBufferedChat(unittest.TestCase):
+    """Hot users build their prompt without reading chat_history"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        async_engine = create_async_test_engine(engine)
+        self.statements = []
+        event.listen(async_engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: self.statements.append(statement))
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        db.add(User(username="sam", password="pw"))
+        db.commit()
+        db.close()
+        self.prompts = []
+        provider = FakeProvider(latency=0, jitter=0, chunk_delay=0)
+        original = provider.generate_async
+
+        async def recording(prompt):
+            self.prompts.append(prompt)
+            return await original(prompt)
+
+        provider.generate_async = recording
+        chatbot.HISTORY_BUFFER.invalidate()
+        chatbot.USER_CACHE.invalidate()
+        writer = ChatHistoryWriter(Session, flush_interval=0.01)
+        self.addCleanup(writer.stop)
+        patches = [mock.patch.object(chatbot, "AsyncSessionLocal", async_sessionmaker(bind=async_engine)),
+                   mock.patch.object(chatbot, "CHAT_WRITER", writer),
+                   mock.patch.object(chatbot, "llm_provider", provider),
+                   mock.patch.object(chatbot, "LLM_BREAKER", CircuitBreaker())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def history_reads(self):
+        return [statement for statement in self.statements
+                if statement.lstrip().upper().startswith("SELECT") and "FROM chat_history" in statement]
+
+    def test_second_turn_skips_history_query(self):
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me a tale"))
+        self.assertEqual(len(self.history_reads()), 1)
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me another tale"))
+        asyncio.run(chatbot.generate_response_async("sam", "breathing"))
+        asyncio.run(chatbot.generate_response_async("sam", "And one more tale"))
+        self.assertEqual(len(self.history_reads()), 1)
+        # The exchanges saved since the first load are in the prompt all the same
+        history = self.prompts[-1].split("Conversation history:\n", 1)[1]
+        self.assertIn("user: Tell me a tale\n", history)
+        self.assertIn("user: Tell me another tale\n", history)
+        self.assertIn("user: breathing\n", history)
+
+
+class TestChatContext(unittest.TestCase):
+    """load_chat_context reads a user's context in one query"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        self.statements = []
+        event.listen(engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: self.statements.append(statement))
+        self.Session = sessionmaker(bind=engine)
+        db = self.Session()
+        user = User(username="sam", password="pw", language="es")
+        db.add(user)
+        db.commit()
+        self.user_id = user.id
+        db.add_all([MoodLog(user_id=user.id, mood="tired", log_date=date.today() - timedelta(days=1)),
+                    MoodLog(user_id=user.id, mood="calm", log_date=date.today())])
+        started = datetime.utcnow() - timedelta(hours=1)
+        db.add_all([ChatHistory(user_id=user.id, user_message=f"message {index}", bot_response=f"reply {index}",
+                                timestamp=started + timedelta(minutes=index)) for index in range(14)])
+        db.add(ConversationSummary(user_id=user.id, summary="Sam sleeps badly", summarized_through=2))
+        db.commit()
+        db.close()
+        chatbot.HISTORY_BUFFER.invalidate()
+        chatbot.USER_CACHE.invalidate()
+        patch = mock.patch.object(chatbot, "PROMPT_HISTORY_EXCHANGES", 10)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def load(self, username):
+        db = self.Session()
+        try:
+            self.statements.clear()
+            return chatbot.load_chat_context(db, username)
+        finally:
+            db.close()
+
+    def test_one_query(self):
+        context = self.load("sam")
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual((context.user_id, context.current_mood, context.language), (self.user_id, "calm", "es"))
+        self.assertEqual(context.summary, "Sam sleeps badly")
+        # The last 10 exchanges after the summarized ones, oldest first
+        self.assertEqual([message["content"] for message in context.conversation_history[::2]],
+                         [f"message {index}" for index in range(4, 14)])
+        self.assertEqual(context.conversation_history[1]["content"], "reply 4")
+
+    def test_buffered_user_skips_history(self):
+        first = self.load("sam")
+        context = self.load("sam")
+        self.assertEqual(len(self.statements), 1)
+        self.assertNotIn("chat_history", self.statements[0])
+        self.assertEqual(context.current_mood, "calm")
+        self.assertEqual(context.conversation_history, first.conversation_history)
+
+    def test_user_without_history(self):
+        db = self.Session()
+        db.add(User(username="alex", password="pw"))
+        db.commit()
+        db.close()
+        context = self.load("alex")
+        self.assertEqual((context.current_mood, context.language, context.summary), (None, "en", None))
+        self.assertEqual(context.conversation_history, [])
+
+    def test_unknown_user(self):
+        context = self.load("nobody")
+        self.assertIsNone(context.user_id)
+        self.assertEqual(context.conversation_history, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Tests for the keyword automaton used to route chat messages.
+Checks that one automaton pass finds the same keywords as the per-list substring scans.
+"""
+
+import sys
+import os
+import unittest
+import difflib
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from keyword_matcher import KeywordAutomaton, FuzzyIndex, compile_keyword_lists, MIN_INFLECTED_LENGTH
+
+
+class TestKeywordAutomaton(unittest.TestCase):
+    """Test cases for KeywordAutomaton"""
+
+    def setUp(self):
+        self.keyword_lists = {
+            "crisis": ["kill myself", "end it all", "hopeless", "give up"],
+            "breathing": ["breathing", "panic", "anxiety"],
+            "greeting": ["hi", "hello", "good morning"],
+            "overlap": ["he", "she", "his", "hers"],
+        }
+        self.automaton = KeywordAutomaton()
+        for category, words in self.keyword_lists.items():
+            self.automaton.add_many(words, category)
+        self.automaton.build()
+
+    def expected_matches(self, text):
+        """Reference result computed with plain substring checks"""
+        text_lower = text.lower()
+        expected = {}
+        for category, words in self.keyword_lists.items():
+            found = [word for word in words if word in text_lower]
+            if found:
+                expected[category] = set(found)
+        return expected
+
+    def test_matches_substring_scan(self):
+        """Every category found by substring scans is found by the automaton"""
+        messages = [
+            "I want to kill myself",
+            "Hello, I have anxiety and panic attacks",
+            "Good morning! breathing exercises please",
+            "ushers said this is his",
+            "I feel hopeless and want to give up",
+            "nothing relevant here",
+            "",
+        ]
+        for message in messages:
+            matches = self.automaton.find(message)
+            found = {category: set(phrases) for category, phrases in matches.items()}
+            self.assertEqual(found, self.expected_matches(message), message)
+
+    def test_overlapping_phrases(self):
+        """Overlapping keywords sharing suffixes are all reported"""
+        matches = self.automaton.find("ushers")
+        self.assertEqual(set(matches["overlap"]), {"she", "he", "hers"})
+
+    def test_multiple_categories_per_phrase(self):
+        """A phrase can feed several categories at once"""
+        automaton = KeywordAutomaton()
+        automaton.add("suicide", "crisis", "crisis:suicide")
+        matches = automaton.find("Thoughts of SUICIDE")
+        self.assertIn("crisis", matches)
+        self.assertIn("crisis:suicide", matches)
+
+    def test_match_positions(self):
+        """iter_matches reports the span of each occurrence"""
+        automaton = KeywordAutomaton()
+        automaton.add("panic", "breathing")
+        spans = [(start, end) for start, end, _, _ in automaton.iter_matches("a panic b panic")]
+        self.assertEqual(spans, [(2, 7), (10, 15)])
+
+
+class TestWordBoundaryMatching(unittest.TestCase):
+    """Test cases for word-boundary-aware matching"""
+
+    def setUp(self):
+        self.automaton = compile_keyword_lists({
+            "greeting": ["hi", "hello"],
+            "crisis": ["mad", "abuse", "kill myself"],
+            "stress": ["stress"],
+        }, word_boundaries=True)
+
+    def test_no_match_inside_words(self):
+        """Short keywords do not fire inside longer words"""
+        for message in ["this is hard", "I made dinner", "a nomad life", "think about it"]:
+            self.assertEqual(self.automaton.find(message), {}, message)
+
+    def test_whole_word_matches(self):
+        """Keywords surrounded by spaces or punctuation still match"""
+        self.assertIn("greeting", self.automaton.find("Hi!"))
+        self.assertIn("crisis", self.automaton.find("I'm so mad."))
+        self.assertIn("crisis", self.automaton.find("I want to kill myself"))
+
+    def test_inflected_matches(self):
+        """Longer keywords tolerate simple inflections"""
+        self.assertIn("crisis", self.automaton.find("being abused"))
+        self.assertIn("stress", self.automaton.find("I'm stressed out"))
+        self.assertNotIn("stress", self.automaton.find("common stressors"))
+
+    def test_stem_changes(self):
+        """E-drop, consonant doubling and y-to-i spellings are matched"""
+        automaton = compile_keyword_lists({"x": ["abuse", "stop", "empty", "fear"]}, word_boundaries=True)
+        for message in ["he keeps abusing me", "I keep stopping halfway", "I stopped eating",
+                        "this emptiness", "I feel fearful"]:
+            self.assertIn("x", automaton.find(message), message)
+        for message in ["a stoppage", "fearsome"]:
+            self.assertNotIn("x", automaton.find(message), message)
+
+    def test_per_phrase_boundary_override(self):
+        """A phrase added without word boundaries keeps substring matching"""
+        automaton = KeywordAutomaton(word_boundaries=True)
+        automaton.add("rage", "crisis", word_boundaries=False)
+        automaton.add("hi", "greeting")
+        self.assertIn("crisis", automaton.find("I feel so enraged"))
+        self.assertNotIn("greeting", automaton.find("this"))
+
+
+class TestRoutingAutomataRegression(unittest.TestCase):
+    """Regression tests for the automata compiled in chatbot.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        import chatbot
+        cls.chatbot = chatbot
+
+    def test_crisis_recall_matches_substring_scan(self):
+        """Messages the old substring scan sent to the crisis handler still get there"""
+        messages = [
+            "I want to kill myself",
+            "I'm cutting myself",
+            "at my breaking point",
+            "being abused",
+            "I'm drowning in hopelessness",
+            "my worthlessness is crushing me",
+            "I'm desperately alone",
+            "constant numbness",
+            "my suicidality is back",
+            "I feel so enraged",
+            "nothing matters anymore",
+            "hitting rock bottom",
+        ]
+        for message in messages:
+            self.assertTrue(any(word in message.lower() for word in self.chatbot.ALL_CRISIS_WORDS), message)
+            self.assertIn("crisis", self.chatbot.ROUTING_AUTOMATON.find(message), message)
+
+    def test_every_long_crisis_word_keeps_substring_recall(self):
+        """Each crisis keyword still fires when embedded in a longer word"""
+        for word in self.chatbot.ALL_CRISIS_WORDS:
+            if len(word) < MIN_INFLECTED_LENGTH:
+                continue
+            message = "so" + word + "ness today"
+            self.assertIn("crisis", self.chatbot.ROUTING_AUTOMATON.find(message), word)
+
+    def test_short_crisis_words_need_whole_words(self):
+        """Short crisis keywords no longer fire inside unrelated words"""
+        for message in ["I made dinner", "living like a nomad"]:
+            self.assertNotIn("crisis", self.chatbot.ROUTING_AUTOMATON.find(message), message)
+        self.assertIn("crisis", self.chatbot.ROUTING_AUTOMATON.find("I'm so mad"))
+
+    def test_crisis_type_uses_precomputed_matches(self):
+        """get_crisis_support_response picks the crisis type from a given analysis"""
+        analysis = self.chatbot.MessageAnalysis("I have been hurting myself")
+        response = self.chatbot.get_crisis_support_response("I have been hurting myself", analysis)
+        self.assertIn("Delay the urge", response)
+
+    def test_describing_symptoms(self):
+        """Symptom descriptions with compound or inflected pain words are recognised"""
+        for message in ["my headache is killing me", "toothache since monday", "painful knees",
+                        "my back aches", "it hurts when I walk"]:
+            self.assertIn("describing", self.chatbot.HEALTH_QUERY_AUTOMATON.find(message), message)
+        self.assertNotIn("describing", self.chatbot.HEALTH_QUERY_AUTOMATON.find("painting class"))
+
+    def test_fallback_feelings_from_real_phrasings(self):
+        """Fallback emotion detection handles common inflected phrasings"""
+        cases = [
+            ("I'm fearful of tomorrow", "anxiety"),
+            ("there's an emptiness inside", "loneliness"),
+            ("I keep worrying about money", "anxiety"),
+            ("I was stressing all day", "stress"),
+            ("feeling lonely again", "loneliness"),
+            ("I'm so angry at myself", "anger"),
+            ("crying every night", "sadness"),
+        ]
+        for message, feeling in cases:
+            self.assertIn(feeling, self.chatbot.FALLBACK_AUTOMATON.find(message), message)
+        self.assertNotIn("anger", self.chatbot.FALLBACK_AUTOMATON.find("I made a plan"))
+
+
+class TestFuzzyIndex(unittest.TestCase):
+    """Test cases for the fuzzy intent index"""
+
+    def setUp(self):
+        self.terms = ["stress", "anxiety", "sadness", "fatigue", "sleep_issue", "burnout", "headache",
+                      "insomnia", "panic attack", "loneliness", "mindfulness", "hi", "ocd", "adhd"]
+        self.index = FuzzyIndex(self.terms)
+
+    def brute_force(self, word, threshold):
+        """Reference result computed with difflib against every term"""
+        return sorted(term for term in self.terms
+                      if difflib.SequenceMatcher(None, term, word).ratio() >= threshold)
+
+    def test_matches_difflib(self):
+        """The index returns exactly the difflib matches for typos and noise"""
+        random.seed(7)
+        words = ["stres", "anxeity", "headach", "insomnai", "lonelyness", "hi", "h", "ocdd", "xyz"]
+        for _ in range(200):
+            term = list(random.choice(self.terms))
+            position = random.randrange(len(term))
+            term[position] = random.choice("abcdefghijklmnopqrstuvwxyz")
+            words.append("".join(term))
+        for threshold in (0.6, 0.7, 0.8, 0.9):
+            for word in words:
+                self.assertEqual(sorted(self.index.query(word, threshold)),
+                                 self.brute_force(word, threshold), (word, threshold))
+
+    def test_find_matching_intents(self):
+        """find_matching_intents keeps its signature and tolerates typos"""
+        from chatbot import find_matching_intents, INTENT_RESPONSES
+        matches = find_matching_intents("i have so much stres and anxeity", INTENT_RESPONSES)
+        self.assertIn("stress", matches)
+        self.assertIn("anxiety", matches)
+        self.assertEqual(find_matching_intents("zzz", ["stress"]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Tests for the LLM circuit breaker, call deadlines and hedging.
+"""
+
+import sys
+import os
+import asyncio
+import time
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+import main
+from database import create_async_test_engine, create_test_engine
+from llm_providers import FakeProvider, LLMError, FAKE_SENTENCES
+from llm_resilience import (CircuitBreaker, CircuitOpenError, LatencyHistogram, LLMCallPolicy,
+                            LLMDeadlineExceeded, CLOSED, OPEN, HALF_OPEN)
+
+
+class FakeClock:
+    """Manually advanced clock for probe interval tests"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail():
+    raise LLMError("unavailable")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test cases for CircuitBreaker state changes"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_rate_threshold=0.5, minimum_calls=4, window_size=10,
+                                      probe_interval=30, clock=self.clock)
+
+    def fail_times(self, count):
+        for _ in range(count):
+            with self.assertRaises(LLMError):
+                self.breaker.call(fail)
+
+    def test_stays_closed_below_threshold(self):
+        """Occasional failures and too few calls keep the circuit closed"""
+        self.fail_times(3)
+        self.assertEqual(self.breaker.state, CLOSED)
+        for _ in range(5):
+            self.breaker.call(lambda: "ok")
+        self.fail_times(1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_opens_at_failure_rate(self):
+        """Enough failures in the window open the circuit and later calls fail fast"""
+        self.breaker.call(lambda: "ok")
+        self.fail_times(3)
+        self.assertEqual(self.breaker.state, OPEN)
+        called = []
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: called.append(1))
+        self.assertEqual(called, [])
+        self.assertEqual(self.breaker.status()["rejected"], 1)
+        self.assertEqual(self.breaker.status()["retry_in"], 30)
+
+    def test_half_open_probe_closes_on_success(self):
+        """After the probe interval one call goes through and a success closes the circuit"""
+        self.fail_times(4)
+        self.clock.now = 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_failure_reopens(self):
+        """A failed probe opens the circuit for another interval"""
+        self.fail_times(4)
+        self.clock.now = 30
+        self.fail_times(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now = 59
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now = 60
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.status()["times_opened"], 2)
+
+    def test_abandoned_stream_releases_probe(self):
+        """A stream closed early by its consumer gives the probe back"""
+        self.fail_times(4)
+        self.clock.now = 30
+
+        async def chunks():
+            yield "a"
+            yield "b"
+
+        async def read_one():
+            stream = self.breaker.stream(chunks())
+            await stream.__anext__()
+            await stream.aclose()
+
+        asyncio.run(read_one())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_stream_outcomes(self):
+        """A finished stream is a success and a broken one a failure"""
+        async def broken():
+            yield "a"
+            raise LLMError("dropped")
+
+        async def consume(chunks):
+            return [chunk async for chunk in self.breaker.stream(chunks)]
+
+        for _ in range(4):
+            with self.assertRaises(LLMError):
+                asyncio.run(consume(broken()))
+        self.assertEqual(self.breaker.state, OPEN)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """Test cases for LatencyHistogram"""
+
+    def test_buckets_and_percentiles(self):
+        """Samples land in the first bucket at or above them and percentiles use recent samples"""
+        histogram = LatencyHistogram(buckets=(0.1, 1.0))
+        for seconds in [0.05, 0.1, 0.5, 0.7, 3.0]:
+            histogram.record(seconds)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["buckets"], {"<=0.1s": 2, "<=1s": 2, ">1s": 1})
+        self.assertEqual(snapshot["count"], 5)
+        self.assertEqual(snapshot["p50"], 0.5)
+        self.assertEqual(snapshot["p99"], 3.0)
+
+    def test_empty(self):
+        self.assertIsNone(LatencyHistogram().percentile(0.95))
+
+
+def sleeper(delays, started):
+    """make_call factory whose successive calls take the given delays and return their index"""
+    async def make_call():
+        index = len(started)
+        started.append(index)
+        await asyncio.sleep(delays[index])
+        return index
+    return make_call
+
+
+class TestLLMCallPolicy(unittest.IsolatedAsyncioTestCase):
+    """Test cases for deadlines and hedged calls"""
+
+    async def test_deadline_exceeded(self):
+        """A call past the deadline raises and is cancelled"""
+        policy = LLMCallPolicy(deadline=0.05)
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        started = time.perf_counter()
+        with self.assertRaises(LLMDeadlineExceeded):
+            await policy.run(slow)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        await asyncio.sleep(0)
+        self.assertEqual(cancelled, [True])
+        self.assertEqual((policy.calls, policy.timeouts), (1, 1))
+
+    async def test_fast_call_is_not_hedged(self):
+        started = []
+        policy = LLMCallPolicy(deadline=1, hedge_after=0.1)
+        self.assertEqual(await policy.run(sleeper([0.01], started)), 0)
+        self.assertEqual(started, [0])
+        self.assertEqual(policy.histogram.count, 1)
+
+    async def test_hedge_wins_over_slow_primary(self):
+        """A slow first call is hedged and the faster second call answers"""
+        started = []
+        policy = LLMCallPolicy(deadline=1, hedge_after=0.02)
+        began = time.perf_counter()
+        self.assertEqual(await policy.run(sleeper([0.5, 0.01], started)), 1)
+        self.assertLess(time.perf_counter() - began, 0.3)
+        self.assertEqual((policy.hedges, policy.hedge_wins), (1, 1))
+
+    async def test_p95_hedging_waits_for_samples(self):
+        """hedge_after="p95" only hedges once enough latencies are known"""
+        policy = LLMCallPolicy(deadline=1, hedge_after="p95", min_samples=3)
+        self.assertIsNone(policy.hedge_delay())
+        for seconds in (0.01, 0.02, 0.03):
+            policy.histogram.record(seconds)
+        self.assertEqual(policy.hedge_delay(), 0.03)
+
+    async def test_failure_is_raised(self):
+        async def broken():
+            raise LLMError("unavailable")
+
+        with self.assertRaises(LLMError):
+            await LLMCallPolicy(deadline=1).run(broken)
+
+    async def test_stream_first_chunk_deadline(self):
+        """A stream that does not start within the deadline raises; one that starts runs to the end"""
+        async def chunks(delay):
+            await asyncio.sleep(delay)
+            yield "a"
+            await asyncio.sleep(0.1)
+            yield "b"
+
+        policy = LLMCallPolicy(deadline=0.05)
+        with self.assertRaises(LLMDeadlineExceeded):
+            [chunk async for chunk in policy.first_chunk(chunks(0.5))]
+        self.assertEqual([chunk async for chunk in policy.first_chunk(chunks(0))], ["a", "b"])
+        self.assertEqual(policy.timeouts, 1)
+
+
+class TestChatFastFail(unittest.TestCase):
+    """generate_response skips the LLM while the circuit is open"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        patches = [mock.patch.object(chatbot, "SessionLocal", sessionmaker(bind=engine)),
+                   mock.patch.object(chatbot, "AsyncSessionLocal",
+                                     async_sessionmaker(bind=create_async_test_engine(engine))),
+                   # App startup creates its tables in the test database, not wellbeing.db
+                   mock.patch.object(main, "engine", engine),
+                   mock.patch.object(main, "MIGRATE_ON_STARTUP", False)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_open_circuit_answers_from_rules_without_waiting(self):
+        """Once open, replies come from the fallback without calling the provider"""
+        provider = FakeProvider(latency=0.05, jitter=0, chunk_delay=0, error_rate=1.0)
+        breaker = CircuitBreaker(minimum_calls=3, probe_interval=60)
+        with mock.patch.object(chatbot, "llm_provider", provider), \
+                mock.patch.object(chatbot, "LLM_BREAKER", breaker):
+            for index in range(3):
+                asyncio.run(chatbot.generate_response_async("nobody", f"Tell me a tale, part {index}"))
+            self.assertEqual(breaker.state, OPEN)
+            started = time.perf_counter()
+            reply = asyncio.run(chatbot.generate_response_async("nobody", "Tell me a tale, part 9"))
+            elapsed = time.perf_counter() - started
+        self.assertTrue(reply)
+        self.assertEqual(provider.calls, 3)
+        self.assertLess(elapsed, provider.latency)
+
+    def test_deadline_answers_from_rules(self):
+        """A call past the deadline gets the fallback and counts as a breaker failure"""
+        provider = FakeProvider(latency=1, jitter=0, chunk_delay=0)
+        breaker = CircuitBreaker()
+        with mock.patch.object(chatbot, "llm_provider", provider), \
+                mock.patch.object(chatbot, "LLM_BREAKER", breaker), \
+                mock.patch.object(chatbot, "LLM_CALL_POLICY", LLMCallPolicy(deadline=0.05)):
+            started = time.perf_counter()
+            reply = asyncio.run(chatbot.generate_response_async("nobody", "Tell me a tale, part 1"))
+            elapsed = time.perf_counter() - started
+        self.assertTrue(reply)
+        self.assertFalse(any(sentence in reply for sentence in FAKE_SENTENCES))
+        self.assertLess(elapsed, provider.latency)
+        self.assertEqual(breaker.status()["recent_failures"], 1)
+
+    def test_status_endpoint(self):
+        """/status/llm reports the breaker state"""
+        from fastapi.testclient import TestClient
+        with TestClient(main.app) as client:
+            status = client.get("/status/llm").json()
+        self.assertIn(status["circuit"]["state"], (CLOSED, OPEN, HALF_OPEN))
+        self.assertIn("buckets", status["calls"]["latency"])
+
+
+if __name__ == "__main__":
+    unittest.main()
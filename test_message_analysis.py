@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-request message analysis shared by generate_response stages.
+Checks that stages give the same answers with and without a shared analysis,
+and that each derived piece is computed at most once per message.
+"""
+
+import sys
+import os
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+from chatbot import (
+    MessageAnalysis, generate_response, get_crisis_support_response, format_health_response,
+    get_prevention_solutions, get_enhanced_fallback_response, get_work_life_balance_response,
+    get_professional_support_response, build_gemini_prompt,
+)
+from health_knowledge import search_health_database
+from database import create_test_engine
+
+MESSAGES = [
+    "I want to kill myself",
+    "What are the symptoms of anxiety?",
+    "I have a headache and feel dizzy",
+    "How to prevent diabetes?",
+    "I'm a professor and grading is burning me out",
+    "My department review is next week",
+    "I feel so lonely and I need help",
+    "Is this normal?",
+    "",
+]
+
+
+class TestMessageAnalysis(unittest.TestCase):
+    """Test cases for MessageAnalysis"""
+
+    def test_stages_match_standalone_calls(self):
+        """Passing a shared analysis does not change any stage's answer"""
+        for message in MESSAGES:
+            analysis = MessageAnalysis(message)
+            self.assertEqual(get_crisis_support_response(message, analysis), get_crisis_support_response(message), message)
+            results = search_health_database(message)
+            self.assertEqual(format_health_response(results, message, analysis), format_health_response(results, message), message)
+            self.assertEqual(get_prevention_solutions(message, analysis), get_prevention_solutions(message), message)
+            self.assertEqual(get_enhanced_fallback_response(message, "sad", analysis), get_enhanced_fallback_response(message, "sad"), message)
+            self.assertEqual(get_work_life_balance_response(message, None, analysis), get_work_life_balance_response(message, None), message)
+            self.assertEqual(get_professional_support_response(message, None, analysis), get_professional_support_response(message, None), message)
+
+    def test_flags(self):
+        """Routing flags come from the single routing pass"""
+        self.assertTrue(MessageAnalysis("I want to kill myself").is_crisis)
+        self.assertTrue(MessageAnalysis("I'm a professor").is_professor_query)
+        self.assertTrue(MessageAnalysis("how to prevent a cold").is_prevention_query)
+        self.assertEqual(MessageAnalysis("so much stress lately").intent, "stress")
+        self.assertTrue(MessageAnalysis("Is this normal?").is_question)
+        self.assertEqual(MessageAnalysis("  Hi   THERE ").words, ["hi", "there"])
+
+    def test_lazy_parts_computed_once(self):
+        """Health search and keyword passes run on first use and only once"""
+        with mock.patch.object(chatbot, "search_health_database", wraps=search_health_database) as search:
+            analysis = MessageAnalysis("I have a headache")
+            self.assertEqual(search.call_count, 0)
+            analysis.health_results
+            analysis.health_results
+            self.assertEqual(search.call_count, 1)
+        with mock.patch.object(chatbot, "FALLBACK_AUTOMATON", wraps=chatbot.FALLBACK_AUTOMATON) as automaton:
+            analysis = MessageAnalysis("I feel sad")
+            analysis.feelings
+            analysis.feelings
+            self.assertEqual(automaton.find.call_count, 1)
+
+    def test_prompt_mentions_academic_context(self):
+        """The Gemini prompt notes academic context found by the routing pass"""
+        prompt = build_gemini_prompt("sam", "I'm a professor", None, [], MessageAnalysis("I'm a professor"))
+        self.assertIn("They work in academia", prompt)
+        self.assertTrue(prompt.endswith("user: I'm a professor"))
+        self.assertNotIn("academia", build_gemini_prompt("sam", "hello there", None, []))
+
+
+class TestGenerateResponsePasses(unittest.TestCase):
+    """generate_response analyses each message once"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        self.db = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_single_routing_and_health_pass(self):
+        """A health question costs one routing pass and one health search"""
+        with mock.patch.object(chatbot, "ROUTING_AUTOMATON", wraps=chatbot.ROUTING_AUTOMATON) as routing, \
+                mock.patch.object(chatbot, "search_health_database", wraps=search_health_database) as search:
+            response = generate_response("nobody", "What are the symptoms of tuberculosis?", self.db)
+        self.assertIn("Symptoms of Tuberculosis", response)
+        self.assertEqual(routing.find.call_count, 1)
+        self.assertEqual(search.call_count, 1)
+
+    def test_crisis_skips_health_search(self):
+        """Messages answered by an early stage never search the health database"""
+        with mock.patch.object(chatbot, "search_health_database", wraps=search_health_database) as search:
+            response = generate_response("nobody", "I want to kill myself", self.db)
+        self.assertIn("Emergency Services", response)
+        self.assertEqual(search.call_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the token-budgeted conversation history sent to the LLM.
+"""
+
+import sys
+import os
+import asyncio
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import chatbot
+from chat_writer import ChatHistoryWriter
+from excercises import breathing_exercise
+from llm_providers import FakeProvider
+from llm_resilience import CircuitBreaker
+from database import create_async_test_engine, create_test_engine
+from models import User
+from prompt_history import (
+    build_history_window, estimate_tokens, truncate_to_tokens, format_history_line,
+    PromptStats, REPEATED_REPLY, TRUNCATED_MARK,
+)
+
+
+def exchange(user, assistant):
+    return [{"role": "user", "content": user}, {"role": "assistant", "content": assistant}]
+
+
+class TestHistoryWindow(unittest.TestCase):
+    """Test cases for build_history_window"""
+
+    def test_short_history_kept_whole(self):
+        history = exchange("hi", "Hello!") + exchange("how are you", "Good, thanks.")
+        messages, stats = build_history_window(history, 1000, 100)
+        self.assertEqual(messages, history)
+        self.assertEqual(stats["exchanges"], 2)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertEqual(stats["tokens"], sum(estimate_tokens(format_history_line(m)) for m in history))
+
+    def test_long_turn_truncated(self):
+        """A long canned exercise is cut to the per-turn limit at a word boundary"""
+        history = exchange("breathing please", breathing_exercise())
+        messages, stats = build_history_window(history, 1000, 30)
+        reply = messages[1]["content"]
+        self.assertTrue(reply.endswith(TRUNCATED_MARK))
+        self.assertLessEqual(estimate_tokens(reply), 30)
+        self.assertEqual(stats["truncated"], 1)
+
+    def test_repeated_reply_collapsed_in_older_turns(self):
+        """Only the most recent copy of a repeated reply is sent in full"""
+        history = exchange("breathing", "Long exercise text") + exchange("thanks", "Welcome") \
+            + exchange("breathing again", "Long exercise text")
+        messages, stats = build_history_window(history, 1000, 100)
+        self.assertEqual(messages[1]["content"], REPEATED_REPLY)
+        self.assertEqual(messages[5]["content"], "Long exercise text")
+        self.assertEqual(stats["deduplicated"], 1)
+
+    def test_oldest_exchanges_dropped_over_budget(self):
+        """Whole exchanges are dropped oldest first once the budget is spent"""
+        history = []
+        for index in range(10):
+            history += exchange(f"message {index} " + "word " * 20, f"reply {index} " + "word " * 20)
+        messages, stats = build_history_window(history, 100, 100)
+        self.assertLessEqual(stats["tokens"], 100)
+        self.assertGreater(stats["dropped"], 0)
+        self.assertEqual(stats["exchanges"] + stats["dropped"], 10)
+        self.assertEqual(messages[-1]["content"], history[-1]["content"])
+        self.assertEqual([m["role"] for m in messages[:2]], ["user", "assistant"])
+
+    def test_truncate_keeps_short_text(self):
+        self.assertEqual(truncate_to_tokens("short", 10), ("short", False))
+
+
+class TestPromptBudgetInChat(unittest.TestCase):
+    """Prompts built by generate_response stay within the history budget"""
+
+    def setUp(self):
+        engine = create_test_engine()
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        db.add(User(username="sam", password="pw"))
+        db.commit()
+        db.close()
+        chatbot.HISTORY_BUFFER.invalidate()
+        chatbot.USER_CACHE.invalidate()
+        self.prompts = []
+        provider = FakeProvider(latency=0, jitter=0, chunk_delay=0)
+        original = provider.generate_async
+
+        async def recording(prompt):
+            self.prompts.append(prompt)
+            return await original(prompt)
+
+        provider.generate_async = recording
+        self.stats = PromptStats()
+        writer = ChatHistoryWriter(Session, flush_interval=0.01)
+        self.addCleanup(writer.stop)
+        patches = [mock.patch.object(chatbot, "CHAT_WRITER", writer),
+                   mock.patch.object(chatbot, "AsyncSessionLocal",
+                                     async_sessionmaker(bind=create_async_test_engine(engine))),
+                   mock.patch.object(chatbot, "llm_provider", provider),
+                   mock.patch.object(chatbot, "LLM_BREAKER", CircuitBreaker()),
+                   mock.patch.object(chatbot, "PROMPT_STATS", self.stats)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_canned_replies_saved_and_deduplicated(self):
+        """Repeated exercises are stored, then sent once and truncated in the prompt"""
+        for _ in range(3):
+            self.assertIn("breathing", asyncio.run(chatbot.generate_response_async("sam", "breathing")).lower())
+        asyncio.run(chatbot.generate_response_async("sam", "Tell me a tale"))
+        prompt = self.prompts[-1]
+        self.assertEqual(prompt.count(REPEATED_REPLY), 2)
+        self.assertEqual(prompt.count(TRUNCATED_MARK), 1)
+        history = prompt.split("Conversation history:\n", 1)[1]
+        self.assertLessEqual(estimate_tokens(history), chatbot.PROMPT_HISTORY_TOKENS + 50)
+        snapshot = self.stats.snapshot()
+        self.assertEqual(snapshot["requests"], 1)
+        self.assertEqual(snapshot["last_tokens"], estimate_tokens(prompt))
+        self.assertEqual(snapshot["deduplicated_replies"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Tests for the database indexes and constraints, the mood upsert and the
+migrations that bring existing SQLite files up to date.
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from database import create_async_test_engine, create_test_engine
+from user_cache import UserProfileCache
+from models import User, MoodLog
+from migrate_database import MIGRATIONS, backfill, current_version, migrate_database
+
+# Schema as created before indexes and constraints were declared
+LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR, password VARCHAR, role VARCHAR,
+                    language TEXT DEFAULT 'en', PRIMARY KEY (id), UNIQUE (username));
+CREATE TABLE moods (id INTEGER NOT NULL, user_id INTEGER, mood VARCHAR, log_date DATE, PRIMARY KEY (id));
+CREATE TABLE chat_history (id INTEGER NOT NULL, user_id INTEGER, user_message VARCHAR, bot_response VARCHAR,
+                           timestamp DATETIME, PRIMARY KEY (id));
+CREATE TABLE feedback (id INTEGER NOT NULL, user_id INTEGER, feedback_text VARCHAR, rating INTEGER,
+                       timestamp DATETIME, PRIMARY KEY (id));
+INSERT INTO users (id, username, password) VALUES (1, 'sam', 'pw');
+INSERT INTO moods (id, user_id, mood, log_date) VALUES (1, 1, 'sad', '2024-01-01');
+INSERT INTO moods (id, user_id, mood, log_date) VALUES (2, 1, 'happy', '2024-01-01');
+INSERT INTO moods (id, user_id, mood, log_date) VALUES (3, 1, 'calm', '2024-01-02');
+INSERT INTO chat_history (id, user_id, user_message, bot_response, timestamp)
+    VALUES (1, 1, 'hi', 'hello', '2024-01-01 10:00:00');
+"""
+
+
+def empty_database():
+    """Session factory for a test database with the current schema and no rows"""
+    engine = create_test_engine()
+    return sessionmaker(bind=engine)
+
+
+class TestSchema(unittest.TestCase):
+    """Test cases for the declared indexes and constraints"""
+
+    def test_one_mood_per_user_per_day(self):
+        db = empty_database()()
+        db.add(MoodLog(user_id=1, mood="sad", log_date=date(2024, 1, 1)))
+        db.add(MoodLog(user_id=1, mood="happy", log_date=date(2024, 1, 1)))
+        with self.assertRaises(IntegrityError):
+            db.commit()
+        db.close()
+
+    def test_history_query_uses_index(self):
+        """The recent-history query reads chat_history through the (user_id, timestamp) index"""
+        Session = empty_database()
+        if Session.kw["bind"].dialect.name != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite's")
+        db = Session()
+        plan = db.connection().exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT * FROM chat_history WHERE user_id = 1 ORDER BY timestamp DESC LIMIT 10"
+        ).fetchall()
+        db.close()
+        self.assertIn("ix_chat_history_user_timestamp", " ".join(str(row) for row in plan))
+
+
+class TestMoodUpsert(unittest.TestCase):
+    """Test cases for /mood"""
+
+    def test_second_mood_replaces_the_first(self):
+        from fastapi.testclient import TestClient
+        import main
+        Session = empty_database()
+        db = Session()
+        db.add(User(username="sam", password="pw"))
+        db.commit()
+        db.close()
+        AsyncSession = async_sessionmaker(bind=create_async_test_engine(Session.kw["bind"]))
+
+        async def session():
+            async with AsyncSession() as db:
+                yield db
+
+        main.app.dependency_overrides[main.get_async_db] = session
+        self.addCleanup(main.app.dependency_overrides.clear)
+        for patch in (mock.patch.object(main, "engine", Session.kw["bind"]),
+                      mock.patch.object(main, "MIGRATE_ON_STARTUP", False),
+                      mock.patch.object(main, "USER_CACHE", UserProfileCache())):
+            patch.start()
+            self.addCleanup(patch.stop)
+        with TestClient(main.app) as client:
+            client.post("/mood", json={"username": "sam", "mood": "sad"})
+            client.post("/mood", json={"username": "sam", "mood": "happy"})
+            moods = client.get("/moods/sam").json()
+        self.assertEqual([mood["mood"] for mood in moods], ["happy"])
+
+
+class TestMigration(unittest.TestCase):
+    """Test cases for migrate_database on a database with the old schema"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "legacy.db")
+        conn = sqlite3.connect(self.path)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.close()
+
+    def migrate(self, batch_size=5000):
+        with mock.patch("builtins.print"):
+            return migrate_database(self.path, batch_size)
+
+    def test_adds_constraints_and_indexes(self):
+        self.migrate()
+        conn = sqlite3.connect(self.path)
+        for table in ("moods", "chat_history", "feedback"):
+            self.assertTrue(conn.execute(f"PRAGMA foreign_key_list({table})").fetchall(), table)
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(chat_history)")}
+        self.assertIn("ix_chat_history_user_timestamp", indexes)
+        # The newest duplicate mood for a day is kept
+        moods = conn.execute("SELECT id, mood FROM moods ORDER BY id").fetchall()
+        self.assertEqual(moods, [(2, "happy"), (3, "calm")])
+        self.assertEqual(conn.execute("SELECT user_message FROM chat_history").fetchall(), [("hi",)])
+        conn.close()
+
+    def test_idempotent(self):
+        self.migrate()
+        conn = sqlite3.connect(self.path)
+        schema = conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall()
+        conn.close()
+        self.migrate()
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall(), schema)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM moods").fetchone(), (2,))
+        conn.close()
+
+    def test_records_versions(self):
+        self.assertEqual(self.migrate(), [version for version, _, _ in MIGRATIONS])
+        self.assertEqual(self.migrate(), [])
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(current_version(conn), MIGRATIONS[-1][0])
+        conn.close()
+
+    def test_batched_copy(self):
+        """Rows are copied a batch at a time and none are lost"""
+        conn = sqlite3.connect(self.path)
+        conn.executemany("INSERT INTO chat_history (user_id, user_message, bot_response) VALUES (1, ?, 'ok')",
+                         [(f"message {i}",) for i in range(7)])
+        conn.commit()
+        conn.close()
+        self.migrate(batch_size=2)
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM chat_history").fetchone(), (8,))
+        self.assertTrue(conn.execute("PRAGMA foreign_key_list(chat_history)").fetchall())
+        conn.close()
+
+    def test_leftover_rebuild_table(self):
+        """A copy left behind by an interrupted run is started over"""
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE chat_history_rebuild (id INTEGER PRIMARY KEY, user_message VARCHAR)")
+        conn.execute("INSERT INTO chat_history_rebuild (id, user_message) VALUES (1, 'hi')")
+        conn.commit()
+        conn.close()
+        self.migrate()
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT user_message FROM chat_history").fetchall(), [("hi",)])
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertNotIn("chat_history_rebuild", tables)
+        conn.close()
+
+    def test_backfill_in_batches(self):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, 'pw')",
+                         [(f"user{i}",) for i in range(5)])
+        conn.execute("UPDATE users SET language = NULL")
+        self.assertEqual(backfill(conn, "users", "language = 'en'", "language IS NULL", batch_size=2), 6)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM users WHERE language = 'en'").fetchone(), (6,))
+        conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
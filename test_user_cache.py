@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Tests for the user profile cache and the endpoints that use it.
+"""
+
+import sys
+import os
+import unittest
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from user_cache import UserProfile, UserProfileCache, shared_store_from_environment
+from database import create_async_test_engine, create_test_engine
+from models import User
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStore:
+    """Dictionary with the get, set and delete methods of a Redis client"""
+
+    def __init__(self):
+        self.data = {}
+        self.fail = False
+
+    def get(self, key):
+        if self.fail:
+            raise ConnectionError("store unavailable")
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("store unavailable")
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestUserProfileCache(unittest.TestCase):
+    """Test cases for UserProfileCache"""
+
+    def test_miss_then_hit(self):
+        cache = UserProfileCache()
+        self.assertIsNone(cache.get("sam"))
+        cache.set(UserProfile(1, "sam", "admin", "es"))
+        profile = cache.get("sam")
+        self.assertEqual((profile.id, profile.role, profile.language), (1, "admin", "es"))
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 1))
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = UserProfileCache(ttl=60, clock=clock)
+        cache.set(UserProfile(1, "sam"))
+        clock.now = 60
+        self.assertIsNone(cache.get("sam"))
+
+    def test_invalidate(self):
+        cache = UserProfileCache()
+        cache.set(UserProfile(1, "sam"))
+        cache.set(UserProfile(2, "alex"))
+        cache.invalidate("sam")
+        self.assertIsNone(cache.get("sam"))
+        self.assertIsNotNone(cache.get("alex"))
+        cache.invalidate()
+        self.assertIsNone(cache.get("alex"))
+        self.assertEqual(cache.stats()["invalidations"], 2)
+
+    def test_bounded(self):
+        cache = UserProfileCache(maxsize=2)
+        for user_id in range(3):
+            cache.set(UserProfile(user_id, f"user{user_id}"))
+        self.assertIsNone(cache.get("user0"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_shared_store(self):
+        """A profile stored by one worker is found by another, and invalidation reaches both"""
+        store = FakeStore()
+        first, second = UserProfileCache(shared=store), UserProfileCache(shared=store)
+        first.set(UserProfile(1, "sam", "user", "fr"))
+        self.assertEqual(second.get("sam").language, "fr")
+        self.assertEqual(second.stats()["shared_hits"], 1)
+        first.invalidate("sam")
+        self.assertEqual(store.data, {})
+
+    def test_shared_store_errors(self):
+        store = FakeStore()
+        store.fail = True
+        cache = UserProfileCache(shared=store)
+        with mock.patch("builtins.print"):
+            cache.set(UserProfile(1, "sam"))
+            self.assertEqual(cache.get("sam").id, 1)
+            cache.invalidate("sam")
+            self.assertIsNone(cache.get("sam"))
+        self.assertEqual(cache.stats()["shared_errors"], 2)
+
+    def test_disabled(self):
+        cache = UserProfileCache(maxsize=0)
+        cache.set(UserProfile(1, "sam"))
+        self.assertIsNone(cache.get("sam"))
+
+    def test_missing_redis_package(self):
+        with mock.patch.dict(os.environ, {"USER_CACHE_REDIS_URL": "redis://localhost:6379/0"}), \
+                mock.patch.dict(sys.modules, {"redis": None}), mock.patch("builtins.print") as printed:
+            self.assertIsNone(shared_store_from_environment())
+        self.assertIn("redis package is not installed", printed.call_args[0][0])
+
+
+class TestCachedEndpoints(unittest.TestCase):
+    """Endpoints look users up through USER_CACHE"""
+
+    def setUp(self):
+        import main
+        self.main = main
+        engine = create_test_engine()
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        db.add(User(username="sam", password="pw"))
+        db.commit()
+        db.close()
+        async_engine = create_async_test_engine(engine)
+        self.statements = []
+        event.listen(async_engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: self.statements.append(statement))
+        AsyncSession = async_sessionmaker(bind=async_engine)
+
+        async def session():
+            async with AsyncSession() as db:
+                yield db
+
+        main.app.dependency_overrides[main.get_async_db] = session
+        self.addCleanup(main.app.dependency_overrides.clear)
+        self.cache = UserProfileCache()
+        for patch in (mock.patch.object(main, "engine", engine),
+                      mock.patch.object(main, "MIGRATE_ON_STARTUP", False),
+                      mock.patch.object(main, "USER_CACHE", self.cache)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def user_reads(self):
+        return [statement for statement in self.statements if "FROM users" in statement]
+
+    def test_lookups_served_from_cache(self):
+        from fastapi.testclient import TestClient
+        with TestClient(self.main.app) as client:
+            client.post("/mood", json={"username": "sam", "mood": "calm"})
+            client.get("/moods/sam")
+            client.post("/feedback", json={"username": "sam", "feedback_text": "Nice", "rating": 5})
+        self.assertEqual(len(self.user_reads()), 1)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    def test_register_and_language_change_invalidate(self):
+        from fastapi.testclient import TestClient
+        with TestClient(self.main.app) as client:
+            self.assertIn("message", client.post("/register", json={"username": "alex", "password": "pw"}).json())
+            self.assertIn("error", client.post("/register", json={"username": "alex", "password": "pw"}).json())
+            self.assertEqual(self.cache.get("alex").language, "en")
+            self.assertEqual(client.post("/language", json={"username": "alex", "language": "de"}).json(),
+                             {"message": "Language saved"})
+            self.assertIsNone(self.cache.get("alex"))
+            client.get("/moods/alex")
+            self.assertEqual(self.cache.get("alex").language, "de")
+            self.assertIn("error", client.post("/language", json={"username": "nobody", "language": "de"}).json())
+            self.assertIn("user_cache", client.get("/metrics").json())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Cache of user profiles keyed by username.
+Nearly every endpoint starts by turning a username into the user's id, and
+users almost never change, so their id, role and language are kept in a
+bounded in-process LRU cache with a TTL. Registering a user or changing
+their language invalidates the entry.
+
+With several workers each keeps its own copy, so a change made through one
+worker reaches the others only when their entry expires. Setting
+USER_CACHE_REDIS_URL also shares profiles through Redis, where invalidation
+is seen by every worker at their next local miss.
+"""
+
+import json
+import os
+import time
+
+from caching import LRUCache
+
+KEY_PREFIX = "wellbeing:user:"
+
+
+class UserProfile:
+    """The parts of a User row that requests look up by username"""
+
+    __slots__ = ("id", "username", "role", "language")
+
+    def __init__(self, id, username, role="user", language="en"):
+        self.id = id
+        self.username = username
+        self.role = role or "user"
+        self.language = language or "en"
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.role, user.language)
+
+    def to_json(self):
+        return json.dumps({"id": self.id, "username": self.username, "role": self.role, "language": self.language})
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**json.loads(text))
+
+
+class UserProfileCache:
+    """username -> UserProfile, with an optional shared store behind the local cache
+
+    shared is a Redis client, or anything with the same get, set(ex=) and
+    delete methods. Errors from it are counted and the local cache carries
+    on alone. A maxsize of 0 turns caching off.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300, shared=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self._local = LRUCache(maxsize=maxsize, ttl=ttl, clock=clock) if maxsize > 0 else None
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self._local is not None
+
+    def get(self, username):
+        """The cached profile for username, or None on a miss"""
+        if not self.enabled:
+            return None
+        profile = self._local.get(username)
+        if profile is None and self.shared is not None:
+            text = self._shared_call(self.shared.get, KEY_PREFIX + username)
+            if text is not None:
+                profile = UserProfile.from_json(text)
+                self.shared_hits += 1
+                self._local.set(username, profile)
+        return profile
+
+    def set(self, profile):
+        """Store a profile read from the database"""
+        if not self.enabled:
+            return profile
+        self._local.set(profile.username, profile)
+        if self.shared is not None:
+            self._shared_call(self.shared.set, KEY_PREFIX + profile.username, profile.to_json(),
+                              ex=max(int(self.ttl), 1))
+        return profile
+
+    def invalidate(self, username=None):
+        """Forget username's profile after it changes, or every local entry when called without one"""
+        self.invalidations += 1
+        if not self.enabled:
+            return
+        if username is None:
+            self._local.invalidate()
+            return
+        self._local.invalidate(username)
+        if self.shared is not None:
+            self._shared_call(self.shared.delete, KEY_PREFIX + username)
+
+    def _shared_call(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            self.shared_errors += 1
+            print(f"User cache store error: {str(e)}")
+            return None
+
+    def stats(self):
+        """Counters and current size, for status endpoints"""
+        stats = self._local.stats() if self.enabled else {"size": 0, "maxsize": 0, "hits": 0, "misses": 0}
+        stats.update({
+            "ttl": self.ttl,
+            "shared": self.shared is not None,
+            "shared_hits": self.shared_hits,
+            "shared_errors": self.shared_errors,
+            "invalidations": self.invalidations,
+        })
+        return stats
+
+
+def shared_store_from_environment():
+    """Redis client for USER_CACHE_REDIS_URL, or None when unset or the redis package is missing"""
+    url = os.getenv('USER_CACHE_REDIS_URL')
+    if not url:
+        return None
+    try:
+        import redis
+    except ImportError:
+        print("USER_CACHE_REDIS_URL is set but the redis package is not installed; caching user profiles per process")
+        return None
+    return redis.Redis.from_url(url, decode_responses=True, socket_timeout=0.5)
+
+
+def user_cache_from_environment():
+    """UserProfileCache configured by the USER_CACHE_* environment variables"""
+    return UserProfileCache(
+        maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+        ttl=float(os.getenv('USER_CACHE_TTL', '300')),
+        shared=shared_store_from_environment(),
+    )